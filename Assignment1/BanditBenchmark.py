@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Throughput benchmarks
+Practical for course 'Reinforcement Learning',
+Bachelor AI, Leiden University, The Netherlands
+2022
+By Luca Goemans & Sayf El Kaddouri
+"""
+import argparse
+import json
+import platform
+import sys
+import time
+import tracemalloc
+import numpy as np
+from BanditEnvironment import BanditEnvironment, BatchBanditEnvironment
+from BanditExperiment import run_repetitions
+from BanditJit import JIT_POLICIES, NUMBA_AVAILABLE
+
+# parameter value used per policy, the defaults of the assignment
+POLICIES = {'egreedy': 0.1, 'oi': 1.0, 'ucb': 0.25, 'thompson': 1.0, 'gradient': 0.1}
+BACKENDS = ['numpy', 'python', 'numba', 'indexed']
+N_ACTIONS = [10, 100, 1000, 10000]
+N_TIMESTEPS = [1000]
+N_REPETITIONS = [1, 100, 500]
+# the reference loop (python and indexed backends) is skipped above this many steps, it would dominate the benchmark time
+MAX_PYTHON_STEPS = 200000
+# these numpy policies sample or update every action per step, they are skipped above this many action steps
+# (n_actions * n_timesteps * n_repetitions), at 10000 actions and 500 repetitions one run takes minutes
+DENSE_POLICIES = ('thompson', 'gradient')
+MAX_DENSE_STEPS = 10**8
+
+
+def _measure(run, repeats):
+    ''' returns the best wall clock time of repeats calls of run, and the peak traced memory of one extra call '''
+    seconds = min(_time(run) for _ in range(repeats))
+    tracemalloc.start()
+    try:
+        run()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return seconds, peak
+
+
+def _time(run):
+    start = time.perf_counter()
+    run()
+    return time.perf_counter() - start
+
+
+def benchmark_run_repetitions(policy, backend, n_actions, n_timesteps, n_repetitions, repeats=3, seed=0):
+    """
+    Time run_repetitions for one configuration
+
+    :returns result: A dict with the configuration, the best time in seconds, steps per second and peak memory in bytes
+    """
+    param_value = POLICIES[policy]
+    run = lambda: run_repetitions(n_actions, n_timesteps, n_repetitions, param_value=param_value, policy=policy,
+                                  backend=backend, seed=seed)
+    if backend == 'numba':
+        run_repetitions(n_actions, 2, 1, param_value=param_value, policy=policy, backend=backend) # compile first
+    seconds, peak = _measure(run, repeats)
+    steps = n_timesteps * n_repetitions
+    return {'benchmark': 'run_repetitions', 'policy': policy, 'backend': backend, 'n_actions': n_actions,
+            'n_timesteps': n_timesteps, 'n_repetitions': n_repetitions, 'seconds': seconds,
+            'steps_per_second': steps / seconds, 'peak_memory_bytes': peak}
+
+
+def benchmark_environment(n_actions, n_timesteps, n_repetitions, repeats=3, seed=0):
+    """
+    Time the act calls of a BatchBanditEnvironment with n_repetitions instances, and of a single BanditEnvironment
+
+    :returns results: A list with one result dict per environment
+    """
+    def run_batch():
+        env = BatchBanditEnvironment(n_repetitions=n_repetitions, n_actions=n_actions, rng=seed)
+        a = np.zeros(n_repetitions, dtype=np.int64)
+        for _ in range(n_timesteps):
+            env.act(a)
+
+    def run_single():
+        env = BanditEnvironment(n_actions=n_actions, rng=seed)
+        for _ in range(n_timesteps):
+            env.act(0)
+
+    results = []
+    for name, run, steps in [('BatchBanditEnvironment', run_batch, n_timesteps * n_repetitions),
+                             ('BanditEnvironment', run_single, n_timesteps)]:
+        seconds, peak = _measure(run, repeats)
+        results.append({'benchmark': name, 'n_actions': n_actions, 'n_timesteps': n_timesteps,
+                        'n_repetitions': n_repetitions if name == 'BatchBanditEnvironment' else 1,
+                        'seconds': seconds, 'steps_per_second': steps / seconds, 'peak_memory_bytes': peak})
+    return results
+
+
+def run_benchmarks(n_actions_grid=N_ACTIONS, n_timesteps_grid=N_TIMESTEPS, n_repetitions_grid=N_REPETITIONS,
+                   policies=tuple(POLICIES), backends=BACKENDS, repeats=3, max_python_steps=MAX_PYTHON_STEPS,
+                   max_dense_steps=MAX_DENSE_STEPS):
+    """
+    Benchmark every policy and backend over the grid, plus the environments
+
+    :returns results: A list of result dicts, see benchmark_run_repetitions
+    """
+    results = []
+    for n_actions in n_actions_grid:
+        for n_timesteps in n_timesteps_grid:
+            for n_repetitions in n_repetitions_grid:
+                results += benchmark_environment(n_actions, n_timesteps, n_repetitions, repeats=repeats)
+                for policy in policies:
+                    if policy in DENSE_POLICIES and n_actions * n_timesteps * n_repetitions > max_dense_steps:
+                        continue
+                    for backend in backends:
+                        if backend in ('python', 'indexed') and n_timesteps * n_repetitions > max_python_steps:
+                            continue
+                        if backend == 'numba' and (not NUMBA_AVAILABLE or policy not in JIT_POLICIES):
+                            continue
+                        result = benchmark_run_repetitions(policy, backend, n_actions, n_timesteps, n_repetitions,
+                                                           repeats=repeats)
+                        print("{policy:8s} {backend:6s} actions={n_actions:<6d} timesteps={n_timesteps:<7d} "
+                              "repetitions={n_repetitions:<5d} {steps_per_second:12.0f} steps/s "
+                              "{peak_memory_bytes:>12d} B peak".format(**result))
+                        results.append(result)
+    return results
+
+
+def find_regressions(baseline, results, tolerance=0.2):
+    """
+    Compare results with a baseline run of the same benchmarks
+
+    :param baseline: Result dicts of an earlier run
+    :param results: Result dicts of the current run
+    :param tolerance: Allowed relative drop in steps per second (default is 0.2)
+    :returns regressions: A list of (baseline result, result) pairs that got slower than the tolerance allows
+    """
+    config = lambda result: tuple(result.get(name) for name in
+                                  ('benchmark', 'policy', 'backend', 'n_actions', 'n_timesteps', 'n_repetitions'))
+    baseline_by_config = {config(result): result for result in baseline}
+    regressions = []
+    for result in results:
+        old = baseline_by_config.get(config(result))
+        if old is not None and result['steps_per_second'] < (1 - tolerance) * old['steps_per_second']:
+            regressions.append((old, result))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the bandit policies, environments and experiment driver")
+    parser.add_argument('--n-actions', type=int, nargs='+', default=N_ACTIONS)
+    parser.add_argument('--n-timesteps', type=int, nargs='+', default=N_TIMESTEPS)
+    parser.add_argument('--n-repetitions', type=int, nargs='+', default=N_REPETITIONS)
+    parser.add_argument('--policies', nargs='+', default=list(POLICIES), choices=list(POLICIES))
+    parser.add_argument('--backends', nargs='+', default=BACKENDS, choices=BACKENDS)
+    parser.add_argument('--repeats', type=int, default=3, help="timed runs per configuration, the best is reported")
+    parser.add_argument('--max-python-steps', type=int, default=MAX_PYTHON_STEPS)
+    parser.add_argument('--max-dense-steps', type=int, default=MAX_DENSE_STEPS,
+                        help="skip {} above this many action steps".format(' and '.join(DENSE_POLICIES)))
+    parser.add_argument('--output', default='benchmark_results.json', help="JSON file to write the results to")
+    parser.add_argument('--baseline', help="JSON file of an earlier run, exit with status 1 on a regression")
+    parser.add_argument('--tolerance', type=float, default=0.2, help="allowed relative drop in steps per second")
+    args = parser.parse_args(argv)
+
+    results = run_benchmarks(args.n_actions, args.n_timesteps, args.n_repetitions, args.policies, args.backends,
+                             repeats=args.repeats, max_python_steps=args.max_python_steps,
+                             max_dense_steps=args.max_dense_steps)
+    report = {'python': platform.python_version(), 'numpy': np.__version__, 'platform': platform.platform(),
+              'numba': NUMBA_AVAILABLE, 'time': time.strftime('%Y-%m-%dT%H:%M:%S'), 'results': results}
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print("Wrote {} results to {}".format(len(results), args.output))
+
+    if args.baseline is not None:
+        with open(args.baseline) as f:
+            baseline = json.load(f)['results']
+        regressions = find_regressions(baseline, results, tolerance=args.tolerance)
+        for old, new in regressions:
+            print("Regression: {benchmark} {policy} {backend} actions={n_actions} timesteps={n_timesteps} "
+                  "repetitions={n_repetitions}".format(**{'policy': None, 'backend': None, **new}),
+                  "{:.0f} -> {:.0f} steps/s".format(old['steps_per_second'], new['steps_per_second']))
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+On-disk cache for experiment results
+Practical for course 'Reinforcement Learning',
+Bachelor AI, Leiden University, The Netherlands
+2022
+By Luca Goemans & Sayf El Kaddouri
+"""
+import functools
+import hashlib
+import inspect
+import json
+import os
+import shutil
+import tempfile
+import numpy as np
+
+CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '.bandit_cache')
+MAX_CACHE_BYTES = 256 * 2**20
+
+
+@functools.lru_cache(maxsize=None)
+def source_hash(*objects):
+    ''' objects: modules, classes or functions whose source code determines a result
+    returns a short hash of their source, which changes whenever one of them is edited '''
+    digest = hashlib.sha256()
+    for obj in objects:
+        digest.update(inspect.getsource(obj).encode())
+    return digest.hexdigest()[:16]
+
+
+def write_atomic(path, write):
+    ''' calls write with a binary file that replaces path once write returns, so a reader, e.g. a concurrent worker,
+    never sees a partially written file '''
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path) or '.', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            write(f)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+
+class ResultCache:
+    ''' Stores dictionaries of arrays as one .npz file per key. The total size is bounded by max_bytes,
+    when it is exceeded the least recently used entries are removed. '''
+
+    def __init__(self, directory=CACHE_DIR, max_bytes=MAX_CACHE_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+
+    def key(self, **config):
+        ''' config: JSON serializable description of a result, e.g. policy, param_value, seed and code version
+        returns the key under which the result is stored '''
+        return hashlib.sha256(json.dumps(config, sort_keys=True).encode()).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + '.npz')
+
+    def get(self, key):
+        ''' returns a dict with the stored arrays, or None if the key is not cached '''
+        path = self._path(key)
+        try:
+            with np.load(path) as data:
+                arrays = {name: data[name] for name in data.files}
+            os.utime(path) # mark as recently used
+        except (OSError, ValueError):
+            return None
+        return arrays
+
+    def put(self, key, **arrays):
+        ''' stores the arrays under key, then evicts the least recently used entries if the cache is too large '''
+        os.makedirs(self.directory, exist_ok=True)
+        write_atomic(self._path(key), lambda f: np.savez(f, **arrays))
+        self.evict()
+
+    def evict(self):
+        ''' removes the least recently used entries until the cache is no larger than max_bytes '''
+        entries = []
+        for name in os.listdir(self.directory):
+            if not name.endswith('.npz'):
+                continue
+            try:
+                stat = os.stat(os.path.join(self.directory, name))
+            except FileNotFoundError: # evicted by another process
+                continue
+            entries.append((stat.st_mtime, stat.st_size, name))
+        total = sum(size for _, size, _ in entries)
+        for _, size, name in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except FileNotFoundError:
+                pass
+            total -= size
+
+    def clear(self):
+        ''' removes every cached entry '''
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+
+def test():
+    cache = ResultCache(directory=os.path.join(tempfile.gettempdir(), 'bandit_cache_test'), max_bytes=2000)
+    cache.clear()
+    keys = [cache.key(policy='egreedy', param_value=epsilon) for epsilon in [0.01, 0.05, 0.1]]
+    for key in keys:
+        cache.put(key, avg_r_per_timestep=np.random.rand(100))
+    print("Cached entries after eviction: {}".format([cache.get(key) is not None for key in keys]))
+    cache.clear()
+
+    # top up cached runs of every environment, first with more repetitions and then with more timesteps
+    from BanditEnvironment import ENVIRONMENTS
+    from BanditExperiment import run_repetitions_stats
+    cache = ResultCache(directory=os.path.join(tempfile.gettempdir(), 'bandit_cache_test'))
+    for environment in ENVIRONMENTS:
+        for policy in ['egreedy', 'thompson']:
+            kwargs = dict(n_actions=10, param_value=0.1, policy=policy, seed=2022, environment=environment)
+            run_repetitions_stats(n_timesteps=1000, n_repetitions=150, cache=cache, **kwargs)
+            more = run_repetitions_stats(n_timesteps=1000, n_repetitions=200, cache=cache, **kwargs)
+            longer = run_repetitions_stats(n_timesteps=1500, n_repetitions=200, cache=cache, **kwargs)
+            expected = run_repetitions_stats(n_timesteps=1500, n_repetitions=200, **kwargs)
+            print("{} {}: topped up repetitions and timesteps match: {}".format(
+                environment, policy, np.allclose(more.mean, expected.mean[:1000]) and
+                np.allclose(longer.mean, expected.mean)))
+    cache.clear()
+
+
+if __name__ == '__main__':
+    test()
@@ -9,23 +9,414 @@ By Thomas Moerland
 """
 
 import numpy as np
+from BanditRandom import (ENV_STREAM, BlockSampler, as_seed_sequence, batch_rngs, get_rng_states, make_rng,
+                          set_rng_states)
+
+def draw_means(rng, reward, out):
+    ''' draws the mean pay-off of every action into the array out, float64 arrays are filled without a copy '''
+    if reward == 'bernoulli':
+        draw = rng.random # uniform means on [0, 1)
+    elif reward == 'gaussian':
+        draw = rng.standard_normal # standard normal means
+    else:
+        raise ValueError("Reward error, please pass one of the following to the reward argument: 'bernoulli' or 'gaussian' ")
+    if out.dtype == np.float64:
+        draw(out=out)
+    else:
+        out[:] = draw(len(out))
+    return out
+
 
 class BanditEnvironment:
+    __slots__ = ('n_actions', 'reward', 'rng', 'means', 'best_action', 'best_average_return')
 
-    def __init__(self, n_actions):
-        ''' Initializes a bandit environment'''
+    def __init__(self, n_actions, reward='bernoulli', rng=None, dtype=np.float64):
+        ''' Initializes a bandit environment
+        reward: 'bernoulli' for 0/1 rewards with uniform means, 'gaussian' for unit variance rewards with normal means
+        rng: Generator, SeedSequence or int seed used for the means and the rewards (default is None, random)
+        dtype: dtype of the means, np.float32 halves their memory (default is np.float64) '''
         self.n_actions = n_actions
-        self.means = np.random.uniform(low=0.0,high=1.0,size=n_actions)
-        #self.means = np.random.normal(loc=0.0,scale=1.0,size=n_actions) # alternative bandit definitions are possible
+        self.reward = reward
+        self.means = np.empty(n_actions, dtype=dtype)
+        self.reset(rng)
+
+    def reset(self, rng=None):
+        ''' draws a new bandit problem into the existing buffers, rng as in __init__ '''
+        self.rng = make_rng(rng)
+        draw_means(self.rng, self.reward, self.means)
         self.best_action = np.argmax(self.means)
         self.best_average_return = np.max(self.means)
     
     def act(self,a):
         ''' returns a sampled reward for action a ''' 
-        r = np.random.binomial(1,self.means[a])
-        #r= np.random.normal(loc=self.means[a],scale=1.0) # alternative bandit definitions are possible
+        # a uniform draw below the mean is a Bernoulli sample, and uses the stream like BatchBanditEnvironment
+        if self.reward == 'bernoulli':
+            return int(self.rng.random() < self.means[a])
+        return self.means[a] + self.rng.standard_normal()
+
+    def expected_reward(self,a):
+        ''' returns the mean pay-off of action a, without sampling '''
+        return self.means[a]
+
+    def state_dict(self):
+        ''' returns a dict of arrays with the means and the state of the reward stream '''
+        return {'means': self.means, 'rng_state': get_rng_states([self.rng])}
+
+    def load_state_dict(self, state):
+        ''' continues from a state returned by state_dict, the means are kept without a copy if their dtype matches '''
+        self.means = np.asarray(state['means'], dtype=self.means.dtype)
+        set_rng_states([self.rng], state['rng_state'])
+        self.best_action = np.argmax(self.means)
+        self.best_average_return = np.max(self.means)
+
+
+class BatchBanditEnvironment:
+    __slots__ = ('n_repetitions', 'n_actions', 'reward', 'rngs', 'means', 'best_action', 'best_average_return',
+                 'chunk_size', '_rows', '_noise')
+
+    def __init__(self, n_repetitions, n_actions, reward='bernoulli', chunk_size=None, rng=None, dtype=np.float64):
+        ''' Initializes n_repetitions independent bandit environments that are stepped in lockstep.
+        Row i of every array belongs to the i-th bandit instance.
+        reward: 'bernoulli' for 0/1 rewards with uniform means, 'gaussian' for unit variance rewards with normal means
+        chunk_size: number of timesteps of reward noise sampled per RNG call (default is None, see BlockSampler)
+        rng: list with one Generator per instance, or a seed from which those are derived (default is None, random).
+        Instance i draws exactly the numbers a BanditEnvironment with rng[i] would draw.
+        dtype: dtype of the means, np.float32 halves their memory (default is np.float64) '''
+        self.n_repetitions = n_repetitions
+        self.n_actions = n_actions
+        self.reward = reward
+        self.means = np.empty((n_repetitions, n_actions), dtype=dtype)
+        self._rows = np.arange(n_repetitions)
+        self.chunk_size = chunk_size
+        self.reset(rng)
+
+    def reset(self, rng=None):
+        ''' draws new bandit problems into the existing buffers, rng as in __init__ '''
+        self.rngs = batch_rngs(rng, self.n_repetitions, role=ENV_STREAM)
+        for rng, means in zip(self.rngs, self.means):
+            draw_means(rng, self.reward, means)
+        self.best_action = np.argmax(self.means,axis=1)
+        self.best_average_return = np.max(self.means,axis=1)
+        # Only one value per instance and timestep is needed: a Bernoulli reward is a uniform draw below the
+        # mean of the chosen action, a Gaussian reward is the mean of the chosen action plus standard normal noise
+        self._noise = BlockSampler(self.rngs, chunk_size=self.chunk_size, normal=(self.reward == 'gaussian'))
+        self.chunk_size = self._noise.chunk_size
+
+    def prefetch(self, n_timesteps):
+        ''' samples the reward noise of every instance for the next n_timesteps, one RNG call per instance '''
+        self._noise.prefetch(n_timesteps)
+
+    def act(self,a):
+        ''' a: vector with one action per bandit instance
+        returns a vector with a sampled reward per bandit instance '''
+        noise = self._noise.next()
+        if self.reward == 'bernoulli':
+            return (noise < self.means[self._rows,a]).astype(np.int64)
+        return self.means[self._rows,a] + noise
+
+    def expected_reward(self,a):
+        ''' a: vector with one action per bandit instance
+        returns the mean pay-off of the chosen action per instance, without sampling '''
+        return self.means[self._rows,a]
+
+    def state_dict(self):
+        ''' returns a dict of arrays with the state of every instance, the instances are on the first axis '''
+        noise = self._noise.state_dict()
+        return {'means': self.means, 'rng_state': noise['rng_state'], 'noise': noise['block']}
+
+    def load_state_dict(self, state):
+        ''' restores a state returned by state_dict, the number of instances has to match '''
+        self.means = np.array(state['means'], dtype=self.means.dtype)
+        self.best_action = np.argmax(self.means,axis=1)
+        self.best_average_return = np.max(self.means,axis=1)
+        self._noise.load_state_dict({'rng_state': state['rng_state'], 'block': state['noise']})
+
+
+def derived_rng(rng):
+    ''' returns a new Generator seeded from rng, for randomness that must not shift the draws of rng itself '''
+    return make_rng(as_seed_sequence(rng))
+
+
+def time_to_change(rng, hazard):
+    ''' returns the number of timesteps until the next change point, inf if there are none '''
+    return float(rng.geometric(hazard)) if hazard > 0 else np.inf
+
+
+class NonstationaryBanditEnvironment(BanditEnvironment):
+    ''' Bandit environment whose means move after every step: a Gaussian random walk with standard deviation
+    drift per step, and change points at which all means are redrawn, on average every 1 / hazard steps.
+    Bernoulli means are clipped to [0, 1]. The drift and the change points come from two streams seeded from rng
+    after the means are drawn. Seeding them draws from rng, so even with drift 0 the rewards differ from those of a
+    stationary environment with the same rng. '''
+    __slots__ = ('drift', 'hazard', 'drift_rng', 'change_rng', 't', 'next_change')
+
+    def __init__(self, n_actions, reward='bernoulli', rng=None, dtype=np.float64, drift=0.01, hazard=0.0):
+        ''' drift: standard deviation of the random walk of every mean per step (default is 0.01)
+        hazard: probability of a change point per step (default is 0.0, none) '''
+        self.drift = drift
+        self.hazard = hazard
+        super().__init__(n_actions, reward=reward, rng=rng, dtype=dtype)
+
+    def reset(self, rng=None):
+        super().reset(rng)
+        self.drift_rng = derived_rng(self.rng)
+        self.change_rng = derived_rng(self.rng)
+        self.t = 0
+        self.next_change = time_to_change(self.change_rng, self.hazard)
+
+    def act(self,a):
+        r = super().act(a)
+        self.step()
+        return r
+
+    def step(self):
+        ''' moves the means one timestep '''
+        self.t += 1
+        if self.drift > 0:
+            self.means += self.drift * self.drift_rng.standard_normal(self.n_actions)
+            if self.reward == 'bernoulli':
+                np.clip(self.means, 0.0, 1.0, out=self.means)
+        if self.t == self.next_change:
+            draw_means(self.change_rng, self.reward, self.means)
+            self.next_change = self.t + time_to_change(self.change_rng, self.hazard)
+        self.best_action = np.argmax(self.means)
+        self.best_average_return = np.max(self.means)
+
+    def state_dict(self):
+        state = super().state_dict()
+        state.update({'drift_rng_state': get_rng_states([self.drift_rng]),
+                      'change_rng_state': get_rng_states([self.change_rng]), 't': np.array(self.t),
+                      'next_change': np.array(self.next_change)})
+        return state
+
+    def load_state_dict(self, state):
+        super().load_state_dict(state)
+        set_rng_states([self.drift_rng], state['drift_rng_state'])
+        set_rng_states([self.change_rng], state['change_rng_state'])
+        self.t = int(state['t'])
+        self.next_change = float(state['next_change'])
+
+
+class ContextualBanditEnvironment(BanditEnvironment):
+    ''' Linear contextual bandit: every timestep shows a context x of n_features standard normal features, and
+    the mean pay-off of action a is theta_a . x for Gaussian rewards, or sigmoid(theta_a . x) for Bernoulli
+    rewards. The weights theta are standard normal. means always holds the pay-offs under the current context. '''
+    __slots__ = ('n_features', 'theta', 'context', 'context_rng')
+
+    def __init__(self, n_actions, reward='bernoulli', rng=None, dtype=np.float64, n_features=5):
+        ''' n_features: dimension of the context (default is 5) '''
+        self.n_features = n_features
+        self.theta = np.empty((n_actions, n_features))
+        super().__init__(n_actions, reward=reward, rng=rng, dtype=dtype)
+
+    def reset(self, rng=None):
+        self.rng = make_rng(rng)
+        self.rng.standard_normal(out=self.theta)
+        self.context_rng = derived_rng(self.rng)
+        self.next_context()
+
+    def next_context(self):
+        ''' shows the context of the next timestep '''
+        self.context = self.context_rng.standard_normal(self.n_features)
+        self.means[:] = linear_means(self.theta, self.context, self.reward)
+        self.best_action = np.argmax(self.means)
+        self.best_average_return = np.max(self.means)
+
+    def act(self,a):
+        r = super().act(a)
+        self.next_context()
         return r
 
+    def state_dict(self):
+        state = super().state_dict()
+        state.update({'theta': self.theta, 'context': self.context,
+                      'context_rng_state': get_rng_states([self.context_rng])})
+        return state
+
+    def load_state_dict(self, state):
+        super().load_state_dict(state)
+        self.theta = np.asarray(state['theta'])
+        self.context = np.asarray(state['context'])
+        set_rng_states([self.context_rng], state['context_rng_state'])
+
+
+def linear_means(theta, context, reward):
+    ''' theta: (..., n_actions, n_features) weights, context: (..., n_features) features
+    returns the (..., n_actions) mean pay-offs, summed the same way for a single instance and a batch '''
+    z = np.sum(theta * context[..., None, :], axis=-1)
+    if reward == 'bernoulli':
+        return 1 / (1 + np.exp(-z))
+    return z
+
+
+class BatchNonstationaryBanditEnvironment(BatchBanditEnvironment):
+    ''' NonstationaryBanditEnvironment for n_repetitions instances, the random walk of all instances is one
+    array operation per step. Instance i draws exactly the numbers a NonstationaryBanditEnvironment with rng[i]
+    would draw. '''
+    __slots__ = ('drift', 'hazard', 'drift_rngs', 'change_rngs', 't', 'next_change', '_drift_noise')
+
+    def __init__(self, n_repetitions, n_actions, reward='bernoulli', chunk_size=None, rng=None, dtype=np.float64,
+                 drift=0.01, hazard=0.0):
+        self.drift = drift
+        self.hazard = hazard
+        super().__init__(n_repetitions, n_actions, reward=reward, chunk_size=chunk_size, rng=rng, dtype=dtype)
+
+    def reset(self, rng=None):
+        super().reset(rng)
+        self.drift_rngs = [derived_rng(rng) for rng in self.rngs]
+        self.change_rngs = [derived_rng(rng) for rng in self.rngs]
+        self._drift_noise = BlockSampler(self.drift_rngs, width=self.n_actions, normal=True)
+        self.t = np.zeros(self.n_repetitions, dtype=np.int64)
+        self.next_change = np.array([time_to_change(rng, self.hazard) for rng in self.change_rngs])
+
+    def prefetch(self, n_timesteps):
+        ''' samples the reward noise of the next n_timesteps, the random walk steps of the next n_timesteps are drawn
+        at most the chunk_size of their sampler at a time, as a step holds n_actions values per instance '''
+        super().prefetch(n_timesteps)
+        if self.drift > 0:
+            self._drift_noise.reserve(n_timesteps)
+
+    def act(self,a):
+        r = super().act(a)
+        self.step()
+        return r
+
+    def step(self):
+        ''' moves the means of every instance one timestep '''
+        self.t += 1
+        if self.drift > 0:
+            self.means += self.drift * self._drift_noise.next()
+            if self.reward == 'bernoulli':
+                np.clip(self.means, 0.0, 1.0, out=self.means)
+        for i in np.flatnonzero(self.t == self.next_change):
+            # change points are rare, so only the instances that change draw new means
+            draw_means(self.change_rngs[i], self.reward, self.means[i])
+            self.next_change[i] = self.t[i] + time_to_change(self.change_rngs[i], self.hazard)
+        self.best_action = np.argmax(self.means,axis=1)
+        self.best_average_return = np.max(self.means,axis=1)
+
+    def state_dict(self):
+        state = super().state_dict()
+        drift_noise = self._drift_noise.state_dict()
+        state.update({'drift_rng_state': drift_noise['rng_state'], 'drift_noise': drift_noise['block'],
+                      'change_rng_state': get_rng_states(self.change_rngs), 't': self.t,
+                      'next_change': self.next_change})
+        return state
+
+    def load_state_dict(self, state):
+        super().load_state_dict(state)
+        self._drift_noise.load_state_dict({'rng_state': state['drift_rng_state'], 'block': state['drift_noise']})
+        set_rng_states(self.change_rngs, state['change_rng_state'])
+        self.t = np.array(state['t'])
+        self.next_change = np.array(state['next_change'])
+
+
+class BatchContextualBanditEnvironment(BatchBanditEnvironment):
+    ''' ContextualBanditEnvironment for n_repetitions instances. The contexts are drawn chunk_size timesteps at a
+    time per instance, and the means of all instances are one array operation per step. '''
+    __slots__ = ('n_features', 'theta', 'context', 'context_rngs', '_contexts')
+
+    def __init__(self, n_repetitions, n_actions, reward='bernoulli', chunk_size=None, rng=None, dtype=np.float64,
+                 n_features=5):
+        self.n_features = n_features
+        self.theta = np.empty((n_repetitions, n_actions, n_features))
+        super().__init__(n_repetitions, n_actions, reward=reward, chunk_size=chunk_size, rng=rng, dtype=dtype)
+
+    def reset(self, rng=None):
+        self.rngs = batch_rngs(rng, self.n_repetitions, role=ENV_STREAM)
+        for rng, theta in zip(self.rngs, self.theta):
+            rng.standard_normal(out=theta)
+        self.context_rngs = [derived_rng(rng) for rng in self.rngs]
+        self._contexts = BlockSampler(self.context_rngs, width=self.n_features, chunk_size=self.chunk_size, normal=True)
+        self._noise = BlockSampler(self.rngs, chunk_size=self.chunk_size, normal=(self.reward == 'gaussian'))
+        self.chunk_size = self._noise.chunk_size
+        # only the first context, prefetch draws those of the steps, so a checkpoint holds no contexts that depend on
+        # the chunk_size and thereby on n_repetitions
+        self._contexts.prefetch(1)
+        self.next_context()
+
+    def prefetch(self, n_timesteps):
+        ''' samples the reward noise and the contexts shown after each of the next n_timesteps for every instance '''
+        super().prefetch(n_timesteps)
+        self._contexts.prefetch(n_timesteps)
+
+    def next_context(self):
+        ''' shows the context of the next timestep to every instance '''
+        self.context = self._contexts.next()
+        self.means[:] = linear_means(self.theta, self.context, self.reward)
+        self.best_action = np.argmax(self.means,axis=1)
+        self.best_average_return = np.max(self.means,axis=1)
+
+    def act(self,a):
+        r = super().act(a)
+        self.next_context()
+        return r
+
+    def state_dict(self):
+        state = super().state_dict()
+        contexts = self._contexts.state_dict()
+        state.update({'theta': self.theta, 'context': self.context, 'context_rng_state': contexts['rng_state'],
+                      'contexts': contexts['block']})
+        return state
+
+    def load_state_dict(self, state):
+        super().load_state_dict(state)
+        self.theta = np.array(state['theta'])
+        self.context = np.array(state['context'])
+        self._contexts.load_state_dict({'rng_state': state['context_rng_state'], 'block': state['contexts']})
+
+
+class EnvironmentSpec:
+    ''' A registered environment: its class, its batched class and the constructor options it is registered with '''
+    __slots__ = ('env_class', 'batch_class', 'options')
+
+    def __init__(self, env_class, batch_class, options):
+        self.env_class = env_class
+        self.batch_class = batch_class
+        self.options = options
+
+
+ENVIRONMENTS = {}
+
+
+def register_environment(name, env_class, batch_class, **options):
+    """
+    Make an environment available to run_repetitions under name
+
+    :param name: The name passed as the environment argument of run_repetitions
+    :param env_class: The environment for a single repetition, used by the 'python' and 'indexed' backends
+    :param batch_class: The environment for n_repetitions instances in lockstep, used by the 'numpy' backend
+    :param options: Constructor arguments of both classes, e.g. drift=0.01
+    """
+    ENVIRONMENTS[name] = EnvironmentSpec(env_class, batch_class, options)
+
+
+def make_environment(name, n_actions, n_repetitions=None, **kwargs):
+    """
+    Construct a registered environment
+
+    :param name: Name of the environment, see register_environment
+    :param n_actions: Cardinality of the action space
+    :param n_repetitions: Construct the batched variant for this many instances (default is None, a single instance)
+    :param kwargs: Further constructor arguments, e.g. rng and dtype
+    :returns env: The environment
+    :raise ValueError: If no environment is registered under name
+    """
+    if name not in ENVIRONMENTS:
+        raise ValueError("Environment error, please pass one of the following to the environment argument: {} ".format(
+            ', '.join("'{}'".format(name) for name in ENVIRONMENTS)))
+    spec = ENVIRONMENTS[name]
+    if n_repetitions is None:
+        return spec.env_class(n_actions, **spec.options, **kwargs)
+    return spec.batch_class(n_repetitions, n_actions, **spec.options, **kwargs)
+
+
+register_environment('stationary', BanditEnvironment, BatchBanditEnvironment)
+register_environment('random_walk', NonstationaryBanditEnvironment, BatchNonstationaryBanditEnvironment, drift=0.01)
+register_environment('change_point', NonstationaryBanditEnvironment, BatchNonstationaryBanditEnvironment, drift=0.0,
+                     hazard=0.002)
+register_environment('contextual', ContextualBanditEnvironment, BatchContextualBanditEnvironment, n_features=5)
+
     
 def test():
     # Initialize environment
@@ -39,6 +430,21 @@ def test():
     for a in range(n_actions):
         r = env.act(a)
         print('Sampled action = {}, obtained reward {}'.format(a,r))
+
+    # Test batched sampling
+    print('------------------------------')
+    batch_env = BatchBanditEnvironment(n_repetitions=3, n_actions=n_actions)
+    a = np.arange(3)
+    print('Sampled actions = {}, obtained rewards {}'.format(a,batch_env.act(a)))
+
+    # Test the non-stationary and contextual environments
+    print('------------------------------')
+    for name in ['random_walk', 'change_point', 'contextual']:
+        env = make_environment(name, n_actions, rng=1)
+        before = env.best_action
+        for _ in range(1000):
+            env.act(0)
+        print("{}: best action {} before and {} after 1000 steps".format(name, before, env.best_action))
     
 if __name__ == '__main__':
     test()
@@ -8,79 +8,412 @@ Bachelor AI, Leiden University, The Netherlands
 By Thomas Moerland
 """
 from unicodedata import name
+import inspect
+import time
+import warnings
 import numpy as np
-from BanditEnvironment import BanditEnvironment
-from BanditPolicies import EgreedyPolicy, OIPolicy, UCBPolicy
-from Helper import LearningCurvePlot, ComparisonPlot, smooth
+from BanditEnvironment import ENVIRONMENTS, BanditEnvironment, make_environment
+from BanditPolicies import POLICIES, EgreedyPolicy, make_policy
+from BanditRandom import ENV_STREAM, POLICY_STREAM, as_seed_sequence, repetition_rngs
+from BanditCache import ResultCache, source_hash
+from BanditResults import ResultStore
+from BanditStats import LearningCurveStats, RunningStats
+from BanditIndex import ArgmaxTree
+from BanditJit import JIT_POLICIES, NUMBA_AVAILABLE, run_repetitions_jit
+from BanditPlots import PlotPool, best_param_value, submit_all
+from BanditProfile import current_timings, instrument, instrumented
 
 
-def run_repetitions(n_actions, n_timesteps, n_repetitions, param_value=0.1, policy='egreedy'):
+def run_repetitions(n_actions, n_timesteps, n_repetitions, param_value=0.1, policy='egreedy', backend='numpy',
+                    seed=None, first_repetition=0, cache=None, compact=False, environment='stationary',
+                    feedback_delay=1):
     """
     Perform a bandit experiment using a given policy for n_repetitions consisting of n_timesteps for n_actions
 
     :param n_actions: Cardinality of the action space
     :param n_timesteps: Number of timesteps per repetition (experiment trial)
     :param n_repetitions: Number of repetitions, how often an experiment should be run
-    :param param_value: Pass a float for epsilon, optimistic initialization or UCB (default is 0.1)
-    :param policy: The policy the reinforcement algorithm will use (default is 'egreedy')
+    :param param_value: Hyperparameter of the policy, e.g. epsilon, the initial value or the UCB constant (default is 0.1)
+    :param policy: The name of a registered policy, see BanditPolicies.register_policy (default is 'egreedy')
+    :param backend: 'numpy' steps all repetitions in lockstep with one array operation per timestep,
+     'python' runs the reference loop one repetition and one timestep at a time, 'numba' runs that loop compiled,
+     which suits few repetitions with many timesteps and falls back to 'numpy' without numba, 'indexed' runs the
+     reference loop with tree-indexed action selection, which suits very large n_actions (default is 'numpy')
+    :param seed: Int, SeedSequence or Generator from which every repetition derives its own environment and policy
+     streams, all backends draw the same numbers for the same seed (default is None, random)
+    :param first_repetition: Index of the first repetition, repetitions [first_repetition, first_repetition +
+     n_repetitions) are run, so a large run can be split in parts that together equal the whole (default is 0)
+    :param cache: A ResultCache that is checked before and filled after simulating, only used when the seed is an
+     int or SeedSequence, as other seeds are not reproducible. A cached run with fewer repetitions or timesteps is
+     topped up by simulating only what is missing (default is None, no caching)
+    :param compact: Keep Q-values and means as float32 and counts as int32, which halves the memory of the policy
+     and environment arrays at a small loss of precision, after which the backends agree up to float32 rounding.
+     The 'numba' backend keeps a single repetition in memory and ignores it (default is False)
+    :param environment: The name of a registered environment, e.g. 'random_walk', 'change_point' or 'contextual',
+     see BanditEnvironment.register_environment. The 'numba' backend only has a kernel for 'stationary' and falls
+     back to 'numpy' for the others (default is 'stationary')
+    :param feedback_delay: Rewards reach the policy in bulk every feedback_delay timesteps: the actions and rewards of
+     timesteps [k * feedback_delay, (k + 1) * feedback_delay) are learned with one update_batch after the last of
+     them, so actions are chosen on feedback that is up to feedback_delay - 1 timesteps old. The 'numba' backend
+     falls back to 'numpy' for delays other than 1 (default is 1, every reward is learned right away)
     :returns avg_r_per_timestep: A list of of floats which represent the average reward per timestep,
      with length=n_repetitions
-    :raise ValueError: If the policy param is not one of the following: 'egreedy', 'oi' or 'ucb'
-    """
-    avg_r_per_timestep = np.zeros(n_timesteps)
-    if policy == 'egreedy':
-        for rep in range(n_repetitions):
-            env = BanditEnvironment(n_actions=n_actions) # Initialize environment    
-            pi = EgreedyPolicy(n_actions=n_actions) # Initialize policy
-            for timestep in range(n_timesteps):
-                a = pi.select_action(epsilon=param_value) # select action
-                r = env.act(a) # sample reward
-                avg_r_per_timestep[timestep] += (r - avg_r_per_timestep[timestep])/(rep+1)
-                pi.update(a,r) # update policy
-    elif policy == 'oi':
-        for rep in range(n_repetitions):
-            env = BanditEnvironment(n_actions=n_actions) # Initialize environment    
-            pi = OIPolicy(n_actions=n_actions, initial_value=param_value) # Initialize policy
-            for timestep in range(n_timesteps):
-                a = pi.select_action() # select action
-                r = env.act(a) # sample reward
-                avg_r_per_timestep[timestep] += (r - avg_r_per_timestep[timestep])/(rep+1)
-                pi.update(a,r) # update policy
-    elif policy == 'ucb':
-        for rep in range(n_repetitions):
-            env = BanditEnvironment(n_actions=n_actions) # Initialize environment    
-            pi =UCBPolicy(n_actions=n_actions) # Initialize policy
-            for timestep in range(n_timesteps):
-                a = pi.select_action(c=param_value, t=timestep) # select action
-                r = env.act(a) # sample reward
-                avg_r_per_timestep[timestep] += (r - avg_r_per_timestep[timestep])/(rep+1)
-                pi.update(a,r) # update policy
+    :raise ValueError: If no policy is registered under the policy param, no environment under the environment param,
+     the backend is not 'numpy', 'python', 'numba' or 'indexed', or feedback_delay is not a whole number of at least 1
+    """
+    stats = run_repetitions_stats(n_actions, n_timesteps, n_repetitions, param_value=param_value, policy=policy,
+                                  backend=backend, seed=seed, first_repetition=first_repetition, cache=cache,
+                                  compact=compact, environment=environment, feedback_delay=feedback_delay)
+    return stats.mean
+
+
+def run_repetitions_stats(n_actions, n_timesteps, n_repetitions, param_value=0.1, policy='egreedy', backend='numpy',
+                          seed=None, first_repetition=0, cache=None, metrics=False, compact=False,
+                          environment='stationary', feedback_delay=1):
+    """
+    Perform the experiment of run_repetitions, but return the streaming statistics of the learning curve: mean,
+    variance, standard error and cumulative regret per timestep, in O(n_timesteps) memory. The other arguments are
+    the same as for run_repetitions.
+
+    :param metrics: Also track the expected regret of the chosen action and whether it was the best action per
+     timestep, in the same pass over the timesteps (default is False)
+    :returns stats: A LearningCurveStats over the repetitions
+    """
+    key = None
+    if cache is not None:
+        key = result_key(cache, n_actions, param_value, policy, backend, seed, first_repetition, metrics=metrics,
+                         compact=compact, environment=environment, feedback_delay=feedback_delay)
+    if key is None:
+        stats, _ = simulate(n_actions, n_timesteps, n_repetitions, param_value, policy, backend, seed, first_repetition,
+                            metrics=metrics, compact=compact, environment=environment, feedback_delay=feedback_delay)
+        return stats
+
+    cached = cache.get(key)
+    n_cached = LearningCurveStats.from_state_dict(cached).n_repetitions if cached is not None else None
+    if n_cached == n_repetitions and len(cached['reward_mean']) >= n_timesteps:
+        return LearningCurveStats.from_state_dict(cached).truncate(n_timesteps)
+    if cached is not None and n_cached <= n_repetitions:
+        stats, state = top_up(cached, n_actions, n_timesteps, n_repetitions, param_value, policy, backend, seed,
+                              first_repetition, compact=compact, environment=environment,
+                              feedback_delay=feedback_delay)
     else:
-        raise ValueError("Policy error, please pass one of the following to the policy argument: 'egreedy', 'oi' or 'ucb' ")
-    return avg_r_per_timestep
-    
+        # nothing cached, or a cached run with more repetitions which can not be split
+        stats, state = simulate(n_actions, n_timesteps, n_repetitions, param_value, policy, backend, seed,
+                                first_repetition, metrics=metrics, compact=compact, environment=environment,
+                                feedback_delay=feedback_delay)
+        if cached is not None:
+            return stats
+    cache.put(key, **stats.state_dict(), **state)
+    return stats.truncate(n_timesteps)
+
 
-def plot_avg_reward(y, name='untitled.png',smoothing=True, save=True):
+def result_key(cache, n_actions, param_value, policy, backend, seed, first_repetition, metrics=False, compact=False,
+               environment='stationary', feedback_delay=1):
     """
-    Plot a graph that shows the learning curve given a certain y
+    Build the cache key of a run_repetitions call, which includes a hash of the simulation code. The number of
+    repetitions and timesteps are not part of the key, a cached entry is topped up when more are requested.
 
-    :param y: A list that contains the y coordinates (average reward per timestep) values that should be plotted
-    :param name: Which file name the plot should have when saved (default is 'untitled.png')
-    :param smoothing: A boolean when True apply a smoothing curve, else not (default is True)
-    :param save: Whether the plot should be saved (default True)
+    :returns key: The key, or None if the seed does not make the result reproducible
     """
-    if '.png' not in name:
-        name += '.png'
-    egreedy_plot = LearningCurvePlot(title=name)
-    egreedy_plot.add_curve(y)
-    if smoothing:
-        smoothed_line = smooth(y=y, window=smoothing_window)
-        egreedy_plot.add_curve(smoothed_line)
-    if save:
-        egreedy_plot.save(name='egreedy.png')
-    
+    if isinstance(seed, (int, np.integer)):
+        seed = np.random.SeedSequence(int(seed))
+    if not isinstance(seed, np.random.SeedSequence):
+        return None
+    # policies can be registered from other modules, so the classes of the policy are hashed as well
+    spec = POLICIES.get(policy)
+    policy_classes = [] if spec is None else [cls for cls in (spec.policy_class, spec.batch_class) if cls is not None]
+    # the same goes for environments, whose registered options are part of the key
+    env_spec = ENVIRONMENTS.get(environment)
+    env_classes = [] if env_spec is None else [env_spec.env_class, env_spec.batch_class]
+    env_options = None if env_spec is None else env_spec.options
+    code_version = source_hash(inspect.getmodule(BanditEnvironment), inspect.getmodule(EgreedyPolicy), *policy_classes,
+                               *env_classes,
+                               inspect.getmodule(as_seed_sequence), inspect.getmodule(LearningCurveStats),
+                               inspect.getmodule(run_repetitions_jit), inspect.getmodule(ArgmaxTree),
+                               run_repetitions_loop, run_repetitions_batched, top_up)
+    return cache.key(policy=policy, param_value=param_value, n_actions=n_actions, first_repetition=first_repetition,
+                     backend=backend, seed=[seed.entropy, list(seed.spawn_key)], metrics=metrics,
+                     compact=compact, environment=[environment, env_options], feedback_delay=feedback_delay,
+                     code_version=code_version)
+
+
+def lookup_result(cache, n_actions, n_timesteps, n_repetitions, param_value=0.1, policy='egreedy', backend='numpy',
+                  seed=None, first_repetition=0, metrics=False, compact=False, environment='stationary',
+                  feedback_delay=1):
+    """
+    Look up the result of a run_repetitions_stats call without simulating anything
+
+    :returns stats: The cached LearningCurveStats, or None if it has to be (partly) simulated
+    """
+    key = result_key(cache, n_actions, param_value, policy, backend, seed, first_repetition, metrics=metrics,
+                     compact=compact, environment=environment, feedback_delay=feedback_delay)
+    cached = cache.get(key) if key is not None else None
+    if cached is None:
+        return None
+    stats = LearningCurveStats.from_state_dict(cached)
+    if stats.n_repetitions != n_repetitions or stats.n_timesteps < n_timesteps:
+        return None
+    return stats.truncate(n_timesteps)
+
+
+def simulate(n_actions, n_timesteps, n_repetitions, param_value, policy, backend, seed, first_repetition,
+             state=None, first_timestep=0, metrics=False, compact=False, environment='stationary', feedback_delay=1):
+    """
+    Simulate repetitions [first_repetition, first_repetition + n_repetitions) with the given backend
+
+    :param metrics: Track the expected regret and optimal action rate as well (default is False)
+    :param compact: Use float32 and int32 arrays for the environments and policies (default is False)
+    :param environment: The name of a registered environment (default is 'stationary')
+    :param feedback_delay: Number of timesteps whose rewards are learned at once (default is 1)
+    :param state: Checkpointed environment and policy state to continue from, only for the 'numpy' backend
+    :param first_timestep: The timestep the checkpoint was taken at (default is 0)
+    :returns (stats, state): The LearningCurveStats of the simulated timesteps, and a dict with the final state,
+     which is empty for the 'python', 'numba' and 'indexed' backends
+    """
+    check_feedback_delay(feedback_delay)
+    seed = as_seed_sequence(seed)
+    env_rngs = repetition_rngs(seed, n_repetitions, first_repetition, role=ENV_STREAM)
+    policy_rngs = repetition_rngs(seed, n_repetitions, first_repetition, role=POLICY_STREAM)
+    timings = current_timings()
+    started = time.perf_counter() if timings is not None else None
+    if backend == 'numba' and (not NUMBA_AVAILABLE or policy not in JIT_POLICIES or environment != 'stationary'
+                               or feedback_delay != 1):
+        warnings.warn("numba is not installed or has no kernel for policy '{}' in environment '{}' with feedback "
+                      "delay {}, falling back to the numpy backend".format(policy, environment, feedback_delay))
+        backend = 'numpy'
+    if backend == 'numpy':
+        result = run_repetitions_batched(n_actions, n_timesteps, n_repetitions, param_value=param_value, policy=policy,
+                                         env_rngs=env_rngs, policy_rngs=policy_rngs, state=state,
+                                         first_timestep=first_timestep, metrics=metrics, compact=compact,
+                                         environment=environment, feedback_delay=feedback_delay)
+    elif backend in ('python', 'indexed'):
+        result = run_repetitions_loop(n_actions, n_timesteps, n_repetitions, param_value=param_value,
+                                      policy=policy, env_rngs=env_rngs, policy_rngs=policy_rngs, metrics=metrics,
+                                      indexed=backend == 'indexed', compact=compact, environment=environment,
+                                      feedback_delay=feedback_delay), {}
+    elif backend == 'numba':
+        result = run_repetitions_jit(n_actions, n_timesteps, n_repetitions, param_value=param_value, policy=policy,
+                                     env_rngs=env_rngs, policy_rngs=policy_rngs, metrics=metrics), {}
+    else:
+        raise ValueError("Backend error, please pass one of the following to the backend argument: 'numpy', 'python', 'numba' or 'indexed' ")
+    if timings is not None:
+        timings.add_steps((policy, param_value), n_repetitions * n_timesteps, time.perf_counter() - started)
+    return result
+
+
+def top_up(cached, n_actions, n_timesteps, n_repetitions, param_value, policy, backend, seed, first_repetition,
+           compact=False, environment='stationary', feedback_delay=1):
+    """
+    Extend a cached entry to n_repetitions and n_timesteps, simulating only what is missing. Extra timesteps of the
+    cached repetitions continue from their checkpointed state, the missing repetitions are simulated from the start.
+
+    :returns (stats, state): The merged statistics and the state of all repetitions
+    """
+    stats = LearningCurveStats.from_state_dict(cached)
+    n_cached = stats.n_repetitions
+    metrics = stats.metrics
+    state = {name: value for name, value in cached.items() if name.startswith(('env_', 'policy_', 'feedback_'))}
+    if stats.n_timesteps < n_timesteps:
+        if not state:
+            # no checkpoint (python backend), so simulate the cached repetitions again
+            stats, state = simulate(n_actions, n_timesteps, n_cached, param_value, policy, backend, seed,
+                                    first_repetition, metrics=metrics, compact=compact, environment=environment,
+                                    feedback_delay=feedback_delay)
+        else:
+            extra, state = simulate(n_actions, n_timesteps - stats.n_timesteps, n_cached, param_value, policy,
+                                    backend, seed, first_repetition, state=state, first_timestep=stats.n_timesteps,
+                                    metrics=metrics, compact=compact, environment=environment,
+                                    feedback_delay=feedback_delay)
+            stats = stats.extend(extra)
+    if n_cached < n_repetitions:
+        new_stats, new_state = simulate(n_actions, stats.n_timesteps, n_repetitions - n_cached, param_value, policy,
+                                        backend, seed, first_repetition + n_cached, metrics=metrics, compact=compact,
+                                        environment=environment, feedback_delay=feedback_delay)
+        stats.merge(new_stats)
+        state = {name: np.concatenate([state[name], new_state[name]]) for name in state}
+    return stats, state
+
 
-def experiment(n_actions, n_timesteps, n_repetitions, smoothing_window):
+def run_repetitions_loop(n_actions, n_timesteps, n_repetitions, param_value=0.1, policy='egreedy',
+                         env_rngs=None, policy_rngs=None, metrics=False, indexed=False, compact=False,
+                         environment='stationary', feedback_delay=1):
+    """
+    Perform the experiment of run_repetitions with the reference loop, one repetition and one timestep at a time
+
+    :param n_actions: Cardinality of the action space
+    :param n_timesteps: Number of timesteps per repetition (experiment trial)
+    :param n_repetitions: Number of repetitions, how often an experiment should be run
+    :param param_value: Hyperparameter of the policy, e.g. epsilon, the initial value or the UCB constant (default is 0.1)
+    :param policy: The name of a registered policy, see BanditPolicies.register_policy (default is 'egreedy')
+    :param env_rngs: One Generator per repetition for the environments (default is None, random)
+    :param policy_rngs: One Generator per repetition for the policies (default is None, random)
+    :param metrics: Track the expected regret and optimal action rate as well (default is False)
+    :param indexed: Let the policies select actions with a tree index instead of an argmax over all actions,
+     which gives the same actions in O(log n_actions) per step (default is False)
+    :param compact: Use float32 and int32 arrays for the environment and policy (default is False)
+    :param environment: The name of a registered environment (default is 'stationary')
+    :param feedback_delay: Number of timesteps whose rewards are learned at once, see run_repetitions (default is 1)
+    :returns stats: A LearningCurveStats with the statistics of the rewards per timestep
+    :raise ValueError: If no policy is registered under the policy param, no environment under the environment param,
+     or feedback_delay is not a whole number of at least 1
+    """
+    check_feedback_delay(feedback_delay)
+    if env_rngs is None:
+        env_rngs = [None] * n_repetitions
+    if policy_rngs is None:
+        policy_rngs = [None] * n_repetitions
+    dtypes = compact_dtypes(compact)
+    stats = LearningCurveStats(n_timesteps, metrics=metrics)
+    # one environment and policy, reset in place for every repetition instead of reallocated
+    pi = make_policy(policy, n_actions, param_value, indexed=indexed, **dtypes) # Initialize policy
+    env = make_environment(environment, n_actions, dtype=dtypes['dtype']) # Initialize environment
+    pi, env = instrument(pi, env) # time the steps when instrumentation is on
+    pending_actions = np.zeros(feedback_delay, dtype=np.int64) # feedback that has not reached the policy yet
+    pending_rewards = np.zeros(feedback_delay)
+    for rep in range(n_repetitions):
+        env.reset(rng=env_rngs[rep])
+        pi.reset(rng=policy_rngs[rep])
+        stats.best.add(0, env.best_average_return)
+        for timestep in range(n_timesteps):
+            a = pi.select_action(t=timestep) # select action
+            if metrics: # before acting, which moves the means of a non-stationary environment
+                stats.regret.add(timestep, env.best_average_return - env.expected_reward(a))
+                stats.optimal_action.add(timestep, float(a == env.best_action))
+            r = env.act(a) # sample reward
+            stats.reward.add(timestep, r)
+            if feedback_delay == 1:
+                pi.update(a,r) # update policy
+            else:
+                pending_actions[timestep % feedback_delay] = a
+                pending_rewards[timestep % feedback_delay] = r
+                if (timestep + 1) % feedback_delay == 0:
+                    pi.update_batch(pending_actions, pending_rewards) # update policy with the delayed feedback
+    return stats
+
+
+def check_feedback_delay(feedback_delay):
+    ''' raises a ValueError unless feedback_delay is a whole number of timesteps of at least 1 '''
+    if int(feedback_delay) != feedback_delay or feedback_delay < 1:
+        raise ValueError("Feedback delay error, please pass a whole number of timesteps of at least 1 to the "
+                         "feedback_delay argument, got {} ".format(feedback_delay))
+
+
+def compact_dtypes(compact=False):
+    ''' returns the dtype of the Q-values and means and the count_dtype of the counts, for compact or full precision '''
+    if compact:
+        return {'dtype': np.float32, 'count_dtype': np.int32}
+    return {'dtype': np.float64, 'count_dtype': np.int64}
+
+
+def run_repetitions_batched(n_actions, n_timesteps, n_repetitions, param_value=0.1, policy='egreedy',
+                            env_rngs=None, policy_rngs=None, state=None, first_timestep=0, metrics=False,
+                            compact=False, environment='stationary', feedback_delay=1, buffers=None):
+    """
+    Perform the same experiment as run_repetitions, but advance all n_repetitions in lockstep. The environment
+    and policy hold (n_repetitions, n_actions) arrays, so each timestep is a handful of NumPy operations instead
+    of n_repetitions Python-level iterations.
+
+    :param n_actions: Cardinality of the action space
+    :param n_timesteps: Number of timesteps per repetition (experiment trial)
+    :param n_repetitions: Number of repetitions, how often an experiment should be run
+    :param param_value: Hyperparameter of the policy, e.g. epsilon, the initial value or the UCB constant (default is 0.1)
+    :param policy: The name of a registered policy, see BanditPolicies.register_policy (default is 'egreedy')
+    :param env_rngs: One Generator per repetition for the environments, or a seed (default is None, random)
+    :param policy_rngs: One Generator per repetition for the policies, or a seed (default is None, random)
+    :param state: Checkpoint returned by an earlier call to continue from (default is None, start fresh)
+    :param first_timestep: Timestep at which the checkpoint was taken (default is 0)
+    :param metrics: Track the expected regret and optimal action rate as well (default is False)
+    :param compact: Use float32 and int32 arrays for the environments and policies (default is False)
+    :param environment: The name of a registered environment (default is 'stationary')
+    :param feedback_delay: Number of timesteps whose rewards are learned at once, see run_repetitions (default is 1)
+    :param buffers: Arrays to keep the environment means and the statistics in instead of allocating them, e.g. views
+     of shared memory, see BanditShared: 'means' of shape (n_repetitions, n_actions), and any of the keys of the
+     state_dict of the returned LearningCurveStats. The means and per-timestep statistics are written in place
+     while the run goes on, the rest when it ends (default is None)
+    :returns (stats, state): A LearningCurveStats with the statistics of the rewards per timestep, and a dict with the checkpoint of the environments (env_*), policies (policy_*) and feedback that has not been learned yet (feedback_*) after the last timestep
+    :raise ValueError: If no policy is registered under the policy param, no environment under the environment param,
+     or feedback_delay is not a whole number of at least 1
+    """
+    check_feedback_delay(feedback_delay)
+    dtypes = compact_dtypes(compact)
+    pi = make_policy(policy, n_actions, param_value, n_repetitions=n_repetitions, rng=policy_rngs, **dtypes)
+    env = make_environment(environment, n_actions, n_repetitions=n_repetitions, rng=env_rngs,
+                           dtype=dtypes['dtype']) # Initialize environments
+    if buffers is None:
+        buffers = {}
+    if 'means' in buffers:
+        # the environments update their means in place, so from here on they move in the given buffer
+        buffers['means'][:] = env.means
+        env.means = buffers['means']
+    pi, env = instrument(pi, env) # time the steps when instrumentation is on
+    best = env.best_average_return.copy() # the means of a non-stationary environment move during the run
+    if state is not None:
+        env.load_state_dict({name[4:]: value for name, value in state.items() if name.startswith('env_')})
+        pi.load_state_dict({name[7:]: value for name, value in state.items() if name.startswith('policy_')})
+    # feedback is delivered at multiples of feedback_delay counted from the first timestep of the run, so a run
+    # continued from a checkpoint learns at the same timesteps as one that was not interrupted
+    pending_actions = np.zeros((n_repetitions, feedback_delay), dtype=np.int64)
+    pending_rewards = np.zeros((n_repetitions, feedback_delay))
+    if state is not None and 'feedback_actions' in state:
+        n_pending = state['feedback_actions'].shape[1]
+        pending_actions[:,:n_pending] = state['feedback_actions']
+        pending_rewards[:,:n_pending] = state['feedback_rewards']
+
+    # the rewards of all repetitions at a timestep form one batch of the streaming statistics
+    accumulator = lambda name: buffers[name] if name in buffers else np.zeros(n_timesteps)
+    mean_r, m2_r = accumulator('reward_mean'), accumulator('reward_m2')
+    if metrics:
+        mean_regret, m2_regret = accumulator('regret_mean'), accumulator('regret_m2')
+        mean_optimal, m2_optimal = accumulator('optimal_action_mean'), accumulator('optimal_action_m2')
+    for chunk_start in range(0, n_timesteps, env.chunk_size):
+        # draw exactly the random numbers of this chunk, so nothing is left over when the checkpoint is taken
+        chunk = min(env.chunk_size, n_timesteps - chunk_start)
+        env.prefetch(chunk)
+        pi.prefetch(chunk)
+        for timestep in range(chunk_start, chunk_start + chunk):
+            a = pi.select_action(t=first_timestep + timestep) # select one action per repetition
+            if metrics: # before acting, which moves the means of a non-stationary environment
+                regret = env.best_average_return - env.expected_reward(a)
+                optimal = (a == env.best_action)
+            r = env.act(a) # sample one reward per repetition
+            mean_r[timestep] = r.mean()
+            m2_r[timestep] = np.sum((r - mean_r[timestep])**2)
+            if metrics:
+                mean_regret[timestep] = regret.mean()
+                m2_regret[timestep] = np.sum((regret - mean_regret[timestep])**2)
+                mean_optimal[timestep] = optimal.mean()
+                m2_optimal[timestep] = np.sum((optimal - mean_optimal[timestep])**2)
+            if feedback_delay == 1:
+                pi.update(a,r) # update all policies at once
+                continue
+            column = (first_timestep + timestep) % feedback_delay
+            pending_actions[:,column] = a
+            pending_rewards[:,column] = r
+            if column == feedback_delay - 1:
+                pi.update_batch(pending_actions, pending_rewards) # learn the delayed feedback of all policies
+
+    state = {'env_' + name: value for name, value in env.state_dict().items()}
+    state.update({'policy_' + name: value for name, value in pi.state_dict().items()})
+    if feedback_delay > 1:
+        n_pending = (first_timestep + n_timesteps) % feedback_delay
+        state.update({'feedback_actions': pending_actions[:,:n_pending].copy(),
+                      'feedback_rewards': pending_rewards[:,:n_pending].copy()})
+    counts = np.full(n_timesteps, n_repetitions)
+    metric_stats = {}
+    if metrics:
+        metric_stats = {'regret': RunningStats(n_timesteps, counts, mean_regret, m2_regret),
+                        'optimal_action': RunningStats(n_timesteps, counts, mean_optimal, m2_optimal)}
+    stats = LearningCurveStats(n_timesteps, RunningStats(n_timesteps, counts, mean_r, m2_r),
+                               RunningStats(1, [n_repetitions], [best.mean()], [np.sum((best - best.mean())**2)]),
+                               **metric_stats)
+    for name, value in stats.state_dict().items():
+        if name in buffers and value is not buffers[name]:
+            buffers[name][:] = value
+    return stats, state
+
+
+def experiment(n_actions, n_timesteps, n_repetitions, smoothing_window, n_workers=None, seed=None, use_cache=True,
+               clear_cache=False, store=None, profile=False):
     """
     Perform the bandit-experiments for the three different policies (Egreedy, OI and UCB)
 
@@ -88,88 +421,49 @@ def experiment(n_actions, n_timesteps, n_repetitions, smoothing_window):
     :param n_timesteps: Number of timesteps per repetition (experiment trial)
     :param n_repetitions: Number of repetitions, how often an experiment should be run
     :param smoothing_window: size of the smoothing window
-    :param policy: The policy the reinforcement algorithm will use (default is 'egreedy')
+    :param n_workers: Number of worker processes used for the sweeps, 0 runs them serially (default is os.cpu_count())
+    :param seed: Integer seed that makes the sweeps reproducible (default is None)
+    :param use_cache: Reuse the results of earlier runs with the same settings and seed (default is True)
+    :param clear_cache: Remove all cached results before running (default is False)
+    :param store: ResultStore the mean and standard error curves of every configuration are written to, for later
+     analysis and plotting, its earlier curves are removed (default is None, a ResultStore in RESULTS_DIR)
+    :param profile: Print the time spent per phase, e.g. select_action, act, update, smoothing and savefig, and
+     the simulated steps per second per configuration. The plots are then rendered in this process, and cached
+     work units are not simulated, so clear_cache or use_cache=False times the whole sweep (default is False)
     """
-    
-    # Assignment 1: e-greedy
-    EPSILONS = [0.01,0.05,0.1,0.25]
-    all_avg_rewards_egreedy = np.empty((0,n_timesteps), dtype=object)
-    epsilon_comparison_plot = ComparisonPlot(title="Comparison of rewards per Epsilon value")
-    x=np.arange(n_timesteps)
-    for epsilon in EPSILONS:
-        avg_rewards_egreedy = run_repetitions(n_actions, n_timesteps, n_repetitions, policy='egreedy',param_value=epsilon)
-        epsilon_comparison_plot.add_curve(x,y=smooth(avg_rewards_egreedy,window=smoothing_window),label="Epsilon = %s" % epsilon)
-        all_avg_rewards_egreedy = np.append(all_avg_rewards_egreedy, [avg_rewards_egreedy],axis=0)
-    epsilon_comparison_plot.save(name="epsilon_comparison.png")
-
-    plot_avg_reward(y=avg_rewards_egreedy, name='egreedy.png')
-    
-    # Assignment 2: Optimistic init
-    INITIAL_VALUES = [0.1,0.5,1.0,2.0]
-    all_avg_rewards_oi = np.empty((0,n_timesteps), dtype=object)
-    oi_comparison_plot = ComparisonPlot(title="Comparison of rewards per initial value")
-    for initial_value in INITIAL_VALUES:
-        avg_rewards_oi = run_repetitions(n_actions, n_timesteps, n_repetitions, policy='oi', param_value=initial_value)  
-        oi_comparison_plot.add_curve(x,y=smooth(avg_rewards_oi,window=smoothing_window),label="Initial value = %s" % initial_value)
-        all_avg_rewards_oi = np.append(all_avg_rewards_oi, [avg_rewards_oi],axis=0)
-    oi_comparison_plot.save(name="oi_comparison.png")
+    if profile:
+        with instrumented() as timings:
+            experiment(n_actions, n_timesteps, n_repetitions, smoothing_window, n_workers=n_workers, seed=seed,
+                       use_cache=use_cache, clear_cache=clear_cache, store=store)
+        print(timings.report())
+        return
+    from BanditSweep import run_sweep
 
-    plot_avg_reward(y=avg_rewards_oi, name='oi.png')
+    cache = ResultCache()
+    if clear_cache:
+        cache.clear()
 
-    # Assignment 3: UCB
+    # Run all sweeps at once, so their repetitions can be spread over the worker processes
+    EPSILONS = [0.01,0.05,0.1,0.25]
+    INITIAL_VALUES = [0.1,0.5,1.0,2.0]
     C_VALUES = [0.01,0.05,0.1,0.25,0.5,1.0]
-    all_avg_rewards_ucb = np.empty((0,n_timesteps), dtype=object)
-    ucb_comparison_plot = ComparisonPlot(title="Comparison of rewards per c value")
-    for c_value in C_VALUES:
-        avg_rewards_ucb = run_repetitions(n_actions, n_timesteps, n_repetitions, policy='ucb', param_value=c_value)
-        ucb_comparison_plot.add_curve(x,y=smooth(avg_rewards_ucb,window=smoothing_window),label="C value = %s" % c_value)
-        all_avg_rewards_ucb = np.append(all_avg_rewards_ucb, [avg_rewards_ucb],axis=0)
-    ucb_comparison_plot.save(name="ucb_comparison.png")
-    plot_avg_reward(y=avg_rewards_ucb, name='ucb.png')
-
-    # Comparison of the three methods
-    # comparison_plot = ComparisonPlot(title="Comparison of the three methods")
-    # x = np.arange(n_timesteps)
-    # comparison_plot.add_curve(x,y=smooth(y=avg_rewards_egreedy,window=smoothing_window),label="e-greedy")
-    # comparison_plot.add_curve(x,y=smooth(y=avg_rewards_oi,window=smoothing_window),label="OI")
-    # comparison_plot.add_curve(x,y=smooth(y=avg_rewards_ucb,window=smoothing_window),label="UCB")
-    # comparison_plot.save(name="comparison.png")
-
-    # This creates the graph similar to the one in the book:
-    comparison_plot = ComparisonPlot(title="Comparison of the three methods")
-    x = np.arange(n_timesteps)
-    comparison_plot.add_curve(x=EPSILONS,y=all_avg_rewards_egreedy.mean(axis=1),label="e-greedy")
-    comparison_plot.add_curve(x=INITIAL_VALUES,y=all_avg_rewards_oi.mean(axis=1),label="OI")
-    comparison_plot.add_curve(x=C_VALUES,y=all_avg_rewards_ucb.mean(axis=1),label="UCB")
-    comparison_plot.save(name="comparison.png")
-
-    # Check what the optimal hyperparameters are:
-    # E-greedy
-    egreedy_argmax = np.argmax(all_avg_rewards_egreedy.mean(axis=1))
-    print('Best epsilon value:', EPSILONS[egreedy_argmax])
-
-
-    # OI
-    oi_argmax = np.argmax(all_avg_rewards_oi.mean(axis=1))
-    print('Best init value:', INITIAL_VALUES[oi_argmax])
-
-    # UCB
-    ucb_argmax = np.argmax(all_avg_rewards_ucb.mean(axis=1))
-    print('Best c value:', C_VALUES[ucb_argmax])
-
-    # Plot all the optimal hyperparameters and their learning curves
-    optimal_hyperparameters_plots = LearningCurvePlot(
-        title='Comparison learning curves of different policies \nusing optimal hyperparameters')
-    # print(all_avg_rewards_egreedy[egreedy_argmax],'with shape:', np.shape(all_avg_rewards_egreedy[egreedy_argmax]))
-    optimal_hyperparameters_plots.add_curve(y=smooth(y=all_avg_rewards_egreedy[egreedy_argmax], window=smoothing_window),
-                                            label="egreedy policy with epsilon = %s" % EPSILONS[egreedy_argmax])
-    optimal_hyperparameters_plots.add_curve(y=smooth(y=all_avg_rewards_oi[oi_argmax], window=smoothing_window),
-                                            label="OI policy with init value = %s" % INITIAL_VALUES[oi_argmax])
-    optimal_hyperparameters_plots.add_curve(y=smooth(y=all_avg_rewards_ucb[ucb_argmax], window=smoothing_window),
-                                            label="UCB policy with c = %s" % C_VALUES[ucb_argmax])
-    optimal_hyperparameters_plots.save(name="comparison_with_optimal_hyperparameters.png")
-
-    ucb_comparison_plot.add_curve(x,y=smooth(avg_rewards_ucb,window=smoothing_window),label="C value = %s" % c_value)
+    configs = [('egreedy', epsilon) for epsilon in EPSILONS] + \
+              [('oi', initial_value) for initial_value in INITIAL_VALUES] + \
+              [('ucb', c_value) for c_value in C_VALUES]
+    all_stats = run_sweep(configs, n_actions, n_timesteps, n_repetitions, n_workers=n_workers, seed=seed,
+                          cache=cache if use_cache else None, return_stats=True)
+    # the plots only read the stored curves, so they can be rendered in other processes
+    store = ResultStore() if store is None else store
+    store.clear()
+    for (policy, param_value), stats in zip(configs, all_stats):
+        store.put_stats(policy, param_value, stats)
+
+    # Check what the optimal hyperparameters are, while the plots are rendered in the background
+    with PlotPool(n_workers=0 if n_workers == 0 or current_timings() is not None else 1) as pool:
+        submit_all(pool, store.directory, smoothing_window, policies=['egreedy', 'oi', 'ucb'])
+        print('Best epsilon value:', best_param_value(store, 'egreedy'))
+        print('Best init value:', best_param_value(store, 'oi'))
+        print('Best c value:', best_param_value(store, 'ucb'))
 
 
 if __name__ == '__main__':
@@ -178,6 +472,7 @@ if __name__ == '__main__':
     n_repetitions = 500
     n_timesteps = 1000
     smoothing_window = 31
+    seed = 2022
     
     experiment(n_actions=n_actions,n_timesteps=n_timesteps,
-               n_repetitions=n_repetitions,smoothing_window=smoothing_window)
\ No newline at end of file
+               n_repetitions=n_repetitions,smoothing_window=smoothing_window,seed=seed)
\ No newline at end of file
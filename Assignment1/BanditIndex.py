@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Indexed action selection
+Practical for course 'Reinforcement Learning',
+Bachelor AI, Leiden University, The Netherlands
+2022
+By Luca Goemans & Sayf El Kaddouri
+"""
+import math
+import numpy as np
+
+
+class ArgmaxTree:
+    ''' Max segment tree over n values. The index of the largest value, the first one on ties like np.argmax,
+    is read in O(1) and changing one value costs O(log n), instead of O(n) for an argmax per step. '''
+
+    def __init__(self, values):
+        self.n = len(values)
+        self.size = 1 << max(self.n - 1, 0).bit_length()
+        self.values = [float(value) for value in values]
+        # winner[node] is the index of the largest value below node, -1 for the padding leaves
+        self.winner = [-1] * (2 * self.size)
+        self.winner[self.size:self.size + self.n] = range(self.n)
+        for node in range(self.size - 1, 0, -1):
+            self._pull(node)
+
+    def _pull(self, node):
+        left, right = self.winner[2 * node], self.winner[2 * node + 1]
+        # the left child holds the lower indices, so it wins ties
+        if right < 0 or (left >= 0 and self.values[left] >= self.values[right]):
+            self.winner[node] = left
+        else:
+            self.winner[node] = right
+
+    def argmax(self):
+        return self.winner[1]
+
+    def update(self, i, value):
+        ''' sets value i and repairs the path from its leaf to the root '''
+        self.values[i] = float(value)
+        node = (i + self.size) >> 1
+        while node:
+            self._pull(node)
+            node >>= 1
+
+
+class UCBTree:
+    ''' Kinetic tournament tree over the UCB values q + c * sqrt(log(t) / n) of n actions.
+
+    The bonus of every action grows with t, so the ranking can change without an update. Written as a line
+    q + b * s in s = sqrt(log(t)) with slope b = c / sqrt(n), an action can only overtake another one with a
+    smaller slope, at a crossing point that is known in advance. Every node stores its winner and the smallest s
+    at which a winner below it may change, and only those nodes are recomputed when t advances. An update of one
+    action repairs a single path, so a step costs O(log^2 n) amortized instead of O(n).
+
+    Winners are decided with the exact expression of UCBPolicy, and a node is recomputed while the gap to its
+    runner-up is below a small tolerance, so rounding never makes the selected action differ from np.argmax over
+    the full UCB vector. '''
+
+    # relative gap below which two values are treated as tied, far above the rounding error of the values
+    TOLERANCE = 1e-9
+
+    def __init__(self, q_table, counts, c, t):
+        self.n = len(q_table)
+        self.size = 1 << max(self.n - 1, 0).bit_length()
+        self.q = [float(value) for value in q_table]
+        self.counts = [float(value) for value in counts]
+        self.c = float(c)
+        self.slope = [self.c / math.sqrt(count) for count in self.counts]
+        self._set_time(t)
+        self.winner = [-1] * (2 * self.size)
+        self.winner[self.size:self.size + self.n] = range(self.n)
+        self.melt = [math.inf] * (2 * self.size)
+        for node in range(self.size - 1, 0, -1):
+            self._pull(node)
+
+    def _set_time(self, t):
+        self.t = t
+        self.log_t = float(np.log(t)) # np.log like UCBPolicy, math.log may differ in the last bit
+        self.s = math.sqrt(self.log_t)
+
+    def _value(self, i):
+        return self.q[i] + self.c * math.sqrt(self.log_t / self.counts[i])
+
+    def _pull(self, node):
+        left, right = 2 * node, 2 * node + 1
+        a, b = self.winner[left], self.winner[right]
+        melt = min(self.melt[left], self.melt[right])
+        if b < 0:
+            self.winner[node] = a
+            self.melt[node] = melt
+            return
+        q, s = self.q, self.s
+        if self.counts[a] == self.counts[b]:
+            # equal bonuses keep the order of q, rounding can only turn it into a tie, which the left one wins
+            if q[a] >= q[b]:
+                winner = a
+            elif q[b] - q[a] > self.TOLERANCE * (1 + abs(q[a])):
+                winner = b
+            else:
+                winner = a if self._value(a) >= self._value(b) else b
+                melt = min(melt, s)
+        else:
+            # compare the lines, only nearly tied values need the exact expression
+            slope_a, slope_b = self.slope[a], self.slope[b]
+            difference = (q[a] + slope_a * s) - (q[b] + slope_b * s)
+            tolerance = self.TOLERANCE * (1 + abs(q[a] + slope_a * s))
+            if abs(difference) <= tolerance:
+                # rounding may flip the order at any timestep
+                winner = a if self._value(a) >= self._value(b) else b
+                melt = min(melt, s)
+            else:
+                if difference > 0:
+                    winner, catch_up = a, slope_b - slope_a
+                else:
+                    winner, catch_up = b, slope_a - slope_b
+                if catch_up > 0:
+                    # the loser gains catch_up per unit of s, recompute before the gap closes
+                    melt = min(melt, s + (abs(difference) - tolerance) / catch_up)
+        self.winner[node] = winner
+        self.melt[node] = melt
+
+    def _refresh(self, node):
+        if node >= self.size:
+            return
+        if self.melt[2 * node] <= self.s:
+            self._refresh(2 * node)
+        if self.melt[2 * node + 1] <= self.s:
+            self._refresh(2 * node + 1)
+        self._pull(node)
+
+    def argmax(self, t):
+        ''' returns the action with the largest UCB value at timestep t '''
+        if t < self.t:
+            # time went back, the melting points no longer apply
+            self.__init__(self.q, self.counts, self.c, t)
+        elif t != self.t:
+            self._set_time(t)
+            if self.melt[1] <= self.s:
+                self._refresh(1)
+        return self.winner[1]
+
+    def update(self, i, q, count):
+        ''' sets the value estimate and count of action i and repairs the path to the root '''
+        self.q[i] = float(q)
+        self.counts[i] = float(count)
+        self.slope[i] = self.c / math.sqrt(self.counts[i])
+        node = (i + self.size) >> 1
+        while node:
+            self._pull(node)
+            node >>= 1
+
+
+def test():
+    rng = np.random.default_rng(2022)
+    n_actions = 1000
+    values = rng.random(n_actions)
+    tree = ArgmaxTree(values)
+    for _ in range(1000):
+        i = rng.integers(n_actions)
+        values[i] = rng.random()
+        tree.update(i, values[i])
+        assert tree.argmax() == np.argmax(values)
+    print("ArgmaxTree matches np.argmax: True")
+
+    q_table = rng.random(n_actions)
+    counts = rng.integers(1, 20, n_actions).astype(float)
+    c = 0.5
+    tree = UCBTree(q_table, counts, c, n_actions)
+    for t in range(n_actions, 5 * n_actions):
+        a = tree.argmax(t)
+        assert a == np.argmax(q_table + c * (np.sqrt(np.log(t)/counts)))
+        counts[a] += 1
+        q_table[a] += (1 / counts[a]) * (rng.random() - q_table[a])
+        tree.update(a, q_table[a], counts[a])
+    print("UCBTree matches np.argmax: True")
+
+
+if __name__ == '__main__':
+    test()
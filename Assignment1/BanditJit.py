@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+JIT-compiled step loops
+Practical for course 'Reinforcement Learning',
+Bachelor AI, Leiden University, The Netherlands
+2022
+By Luca Goemans & Sayf El Kaddouri
+"""
+import numpy as np
+from BanditEnvironment import BanditEnvironment
+from BanditStats import LearningCurveStats
+
+try:
+    from numba import njit
+    NUMBA_AVAILABLE = True
+except ImportError: # numba is optional, run_repetitions falls back to the numpy backend without it
+    NUMBA_AVAILABLE = False
+    def njit(*args, **kwargs):
+        return lambda f: f
+
+# policies with a compiled kernel, the numba backend runs the others with the numpy backend
+JIT_POLICIES = ('egreedy', 'oi', 'ucb')
+
+# The kernels run every timestep of one repetition in compiled code. They use the environment and policy streams
+# exactly like BanditEnvironment and the policies in BanditPolicies do: one uniform per reward, two uniforms per
+# e-greedy step, so the numba backend picks the same actions as the python and numpy backends.
+
+
+@njit(cache=True)
+def _egreedy_kernel(means, env_rng, policy_rng, n_timesteps, epsilon, rewards, actions):
+    n_actions = means.shape[0]
+    q_table = np.zeros(n_actions)
+    counts = np.zeros(n_actions)
+    for t in range(n_timesteps):
+        explore = policy_rng.random()
+        u = policy_rng.random()
+        if explore < epsilon:
+            a = int(u * n_actions)
+        else:
+            a = np.argmax(q_table)
+        r = 1.0 if env_rng.random() < means[a] else 0.0
+        counts[a] += 1
+        q_table[a] += (1 / counts[a]) * (r - q_table[a])
+        rewards[t] = r
+        actions[t] = a
+
+
+@njit(cache=True)
+def _oi_kernel(means, env_rng, n_timesteps, initial_value, learning_rate, rewards, actions):
+    n_actions = means.shape[0]
+    q_table = np.full(n_actions, initial_value)
+    for t in range(n_timesteps):
+        a = np.argmax(q_table)
+        r = 1.0 if env_rng.random() < means[a] else 0.0
+        q_table[a] += learning_rate * (r - q_table[a])
+        rewards[t] = r
+        actions[t] = a
+
+
+@njit(cache=True)
+def _ucb_kernel(means, env_rng, n_timesteps, c, rewards, actions):
+    n_actions = means.shape[0]
+    q_table = np.zeros(n_actions)
+    counts = np.zeros(n_actions)
+    n_tried = 0
+    for t in range(n_timesteps):
+        if n_tried < n_actions:
+            # untried actions are picked in order, so the first untried one is the next index
+            a = n_tried
+            n_tried += 1
+        else:
+            log_t = np.log(t) # computed once per step instead of once per action
+            a = 0
+            best = -np.inf
+            for i in range(n_actions):
+                value = q_table[i] + c * np.sqrt(log_t / counts[i])
+                if value > best:
+                    best = value
+                    a = i
+        r = 1.0 if env_rng.random() < means[a] else 0.0
+        counts[a] += 1
+        q_table[a] += (1 / counts[a]) * (r - q_table[a])
+        rewards[t] = r
+        actions[t] = a
+
+
+def run_repetitions_jit(n_actions, n_timesteps, n_repetitions, param_value=0.1, policy='egreedy',
+                        env_rngs=None, policy_rngs=None, metrics=False):
+    """
+    Perform the experiment of run_repetitions with a compiled step loop per repetition
+
+    :param n_actions: Cardinality of the action space
+    :param n_timesteps: Number of timesteps per repetition (experiment trial)
+    :param n_repetitions: Number of repetitions, how often an experiment should be run
+    :param param_value: Hyperparameter of the policy, e.g. epsilon, the initial value or the UCB constant (default is 0.1)
+    :param policy: The policy the reinforcement algorithm will use (default is 'egreedy')
+    :param env_rngs: One Generator per repetition for the environments
+    :param policy_rngs: One Generator per repetition for the policies
+    :param metrics: Track the expected regret and optimal action rate as well (default is False)
+    :returns stats: A LearningCurveStats with the statistics of the rewards per timestep
+    :raise ValueError: If the policy param is not one of JIT_POLICIES
+    """
+    if policy not in JIT_POLICIES:
+        raise ValueError("Policy error, please pass one of the following to the policy argument: {} ".format(
+            ', '.join("'{}'".format(name) for name in JIT_POLICIES)))
+    stats = LearningCurveStats(n_timesteps, metrics=metrics)
+    rewards = np.zeros(n_timesteps)
+    actions = np.zeros(n_timesteps, dtype=np.int64)
+    env = BanditEnvironment(n_actions=n_actions)
+    for rep in range(n_repetitions):
+        env.reset(rng=env_rngs[rep]) # draws the means like the other backends, into the same buffer
+        if policy == 'egreedy':
+            _egreedy_kernel(env.means, env.rng, policy_rngs[rep], n_timesteps, param_value, rewards, actions)
+        elif policy == 'oi':
+            _oi_kernel(env.means, env.rng, n_timesteps, float(param_value), 0.1, rewards, actions)
+        else:
+            _ucb_kernel(env.means, env.rng, n_timesteps, param_value, rewards, actions)
+        # one value per timestep, added to all timesteps at once
+        stats.reward.add(slice(None), rewards)
+        stats.best.add(0, env.best_average_return)
+        if metrics:
+            stats.regret.add(slice(None), env.best_average_return - env.means[actions])
+            stats.optimal_action.add(slice(None), (actions == env.best_action).astype(float))
+    return stats
@@ -0,0 +1,197 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Plotting stage
+Practical for course 'Reinforcement Learning',
+Bachelor AI, Leiden University, The Netherlands
+2022
+By Luca Goemans & Sayf El Kaddouri
+"""
+import os
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from BanditResults import ResultStore
+from Helper import ComparisonPlot, LearningCurvePlot, downsample, smooth
+
+# legend label and comparison plot title per policy, as in the assignment
+PARAM_LABELS = {'egreedy': ('Epsilon', 'epsilon'), 'oi': ('Initial value', 'init value'), 'ucb': ('C value', 'c')}
+TITLES = {'egreedy': "Comparison of rewards per Epsilon value", 'oi': "Comparison of rewards per initial value",
+          'ucb': "Comparison of rewards per c value"}
+FILE_NAMES = {'egreedy': 'epsilon_comparison.png', 'oi': 'oi_comparison.png', 'ucb': 'ucb_comparison.png'}
+
+# Every plot function only gets the directory of a ResultStore and reads the curves it needs from there, so it can
+# run in another process without the arrays being pickled, and it returns the path of the PNG it wrote.
+
+# curves are averaged down to this many points before they are drawn, a figure has no more pixels across
+MAX_POINTS = 2000
+
+
+def smoothed_curve(store, policy, param_value, window, metric='mean'):
+    ''' returns a stored curve smoothed with window, which is memoized per curve and window '''
+    return smooth(store.get(policy, param_value, metric), window,
+                  key=store.curve_id(policy, param_value, metric))
+
+
+def smoothed_band(store, policy, param_value, window, z=1.96):
+    """
+    Smooth the confidence band of a stored learning curve with the same window as its mean
+
+    :param store: ResultStore with the mean and std_error curves
+    :param window: size of the smoothing window
+    :param z: Number of standard errors on each side of the mean (default is 1.96, a 95% interval)
+    :returns (lower, upper): The smoothed bounds
+    """
+    y = smoothed_curve(store, policy, param_value, window)
+    std_error = store.get(policy, param_value, 'std_error')
+    half_width = smooth(y=z * np.nan_to_num(std_error), window=window,
+                        key=(store.curve_id(policy, param_value, 'std_error'), z))
+    return y - half_width, y + half_width
+
+
+def best_param_value(store, policy):
+    ''' returns the parameter value of a policy with the highest average reward over all timesteps '''
+    param_values = store.param_values(policy)
+    return param_values[int(np.argmax([store.get(policy, value, 'mean').mean() for value in param_values]))]
+
+
+def plot_policy_comparison(store_dir, policy, smoothing_window, output_dir='.', dpi=300, max_points=MAX_POINTS):
+    ''' plots the smoothed learning curve of every parameter value of a policy '''
+    store = ResultStore(store_dir)
+    label = PARAM_LABELS.get(policy, ('Parameter', None))[0]
+    plot = ComparisonPlot(title=TITLES.get(policy, "Comparison of rewards of {}".format(policy)))
+    for param_value in store.param_values(policy):
+        x, y = downsample(smoothed_curve(store, policy, param_value, smoothing_window), max_points)
+        plot.add_curve(x, y=y, label="{} = {}".format(label, param_value))
+    path = os.path.join(output_dir, FILE_NAMES.get(policy, '{}_comparison.png'.format(policy)))
+    plot.save(name=path, dpi=dpi)
+    return path
+
+
+def plot_learning_curve(store_dir, policy, param_value, smoothing_window, output_dir='.', dpi=300,
+                        max_points=MAX_POINTS):
+    ''' plots the learning curve of one configuration, raw and smoothed '''
+    store = ResultStore(store_dir)
+    plot = LearningCurvePlot(title='{}.png'.format(policy))
+    x, y = downsample(store.get(policy, param_value, 'mean'), max_points)
+    plot.add_curve(y, x=x)
+    x, y = downsample(smoothed_curve(store, policy, param_value, smoothing_window), max_points)
+    plot.add_curve(y, x=x)
+    path = os.path.join(output_dir, '{}.png'.format(policy))
+    plot.save(name=path, dpi=dpi)
+    return path
+
+
+def plot_parameter_comparison(store_dir, policies, output_dir='.', dpi=300):
+    ''' plots the average reward over all timesteps against the parameter value, one line per policy '''
+    store = ResultStore(store_dir)
+    plot = ComparisonPlot(title="Comparison of the three methods")
+    for policy in policies:
+        param_values = store.param_values(policy)
+        plot.add_curve(x=param_values, y=[store.get(policy, value, 'mean').mean() for value in param_values],
+                       label={'egreedy': "e-greedy", 'oi': "OI", 'ucb': "UCB"}.get(policy, policy))
+    path = os.path.join(output_dir, 'comparison.png')
+    plot.save(name=path, dpi=dpi)
+    return path
+
+
+def plot_optimal_hyperparameters(store_dir, policies, smoothing_window, output_dir='.', dpi=300,
+                                 max_points=MAX_POINTS):
+    ''' plots the learning curve of the best parameter value of every policy, with its confidence band '''
+    store = ResultStore(store_dir)
+    plot = LearningCurvePlot(title='Comparison learning curves of different policies \nusing optimal hyperparameters')
+    for policy in policies:
+        param_value = best_param_value(store, policy)
+        x, y = downsample(smoothed_curve(store, policy, param_value, smoothing_window), max_points)
+        lower, upper = smoothed_band(store, policy, param_value, smoothing_window)
+        plot.add_curve(y=y, x=x,
+                       label="{} policy with {} = {}".format(policy if policy == 'egreedy' else policy.upper(),
+                                                             PARAM_LABELS.get(policy, (None, 'param'))[1], param_value),
+                       band=(downsample(lower, max_points)[1], downsample(upper, max_points)[1]))
+    path = os.path.join(output_dir, 'comparison_with_optimal_hyperparameters.png')
+    plot.save(name=path, dpi=dpi)
+    return path
+
+
+def _init_worker():
+    # render to files only, a worker process has no display
+    import matplotlib
+    matplotlib.use('Agg')
+
+
+class PlotPool:
+    ''' Renders plots in background worker processes, so simulations continue while the PNGs are written.
+    Use as a context manager, which waits for the submitted plots when it exits. With n_workers=0 every plot is
+    rendered right away in this process. '''
+
+    def __init__(self, n_workers=1):
+        self.executor = ProcessPoolExecutor(max_workers=n_workers, initializer=_init_worker) if n_workers else None
+        self.futures = []
+
+    def submit(self, plot, *args, **kwargs):
+        ''' schedules plot(*args, **kwargs), one of the plot functions of this module '''
+        if self.executor is None:
+            self.futures.append(plot(*args, **kwargs))
+        else:
+            self.futures.append(self.executor.submit(plot, *args, **kwargs))
+
+    def wait(self):
+        ''' waits for every submitted plot and returns the paths of the written PNGs '''
+        paths = [future if self.executor is None else future.result() for future in self.futures]
+        self.futures = []
+        return paths
+
+    def close(self):
+        self.wait()
+        if self.executor is not None:
+            self.executor.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def submit_all(pool, store_dir, smoothing_window, policies=None, output_dir='.', dpi=300):
+    """
+    Schedule the plots of the assignment for every policy in a ResultStore
+
+    :param pool: A PlotPool
+    :param store_dir: Directory of the ResultStore with the mean and std_error curves
+    :param smoothing_window: size of the smoothing window
+    :param policies: The policies to plot (default is None, every policy in the store)
+    :param output_dir: Directory the PNGs are written to (default is '.')
+    :param dpi: Resolution of the PNGs (default is 300)
+    """
+    if policies is None:
+        policies = sorted({policy for policy, _, _ in ResultStore(store_dir).curves(metric='mean')})
+    store = ResultStore(store_dir)
+    for policy in policies:
+        pool.submit(plot_policy_comparison, store_dir, policy, smoothing_window, output_dir=output_dir, dpi=dpi)
+        pool.submit(plot_learning_curve, store_dir, policy, store.param_values(policy)[-1], smoothing_window,
+                    output_dir=output_dir, dpi=dpi)
+    pool.submit(plot_parameter_comparison, store_dir, policies, output_dir=output_dir, dpi=dpi)
+    pool.submit(plot_optimal_hyperparameters, store_dir, policies, smoothing_window, output_dir=output_dir, dpi=dpi)
+
+
+def test():
+    import shutil
+    import tempfile
+    from BanditSweep import run_sweep
+
+    directory = tempfile.mkdtemp()
+    store = ResultStore(os.path.join(directory, 'curves'))
+    configs = [('egreedy', 0.05), ('egreedy', 0.1), ('ucb', 0.1), ('ucb', 0.25)]
+    all_stats = run_sweep(configs, n_actions=10, n_timesteps=500, n_repetitions=50, n_workers=0, seed=1,
+                          return_stats=True)
+    for (policy, param_value), stats in zip(configs, all_stats):
+        store.put_stats(policy, param_value, stats)
+    with PlotPool(n_workers=2) as pool:
+        submit_all(pool, store.directory, smoothing_window=31, output_dir=directory, dpi=100)
+        paths = pool.wait()
+    print("Rendered in the background: {}".format([os.path.basename(path) for path in paths]))
+    shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    test()
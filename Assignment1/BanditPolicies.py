@@ -10,58 +10,766 @@ By Thomas Moerland
 from mimetypes import init
 import numpy as np
 from BanditEnvironment import BanditEnvironment
+from BanditIndex import ArgmaxTree, UCBTree
+from BanditRandom import POLICY_STREAM, BlockSampler, batch_rngs, get_rng_states, make_rng, set_rng_states
+
+# Every policy follows the same protocol, so the experiment driver needs no per-policy code:
+#   __init__(n_actions, <hyperparameter>, rng, dtype, count_dtype, ...), the batched variants take n_repetitions first
+#   reset(rng): start a new run in the existing arrays
+#   select_action(t=timestep): the action, or one action per run for the batched variants
+#   update(a, r): learn from reward r of action a
+#   prefetch(n_timesteps): batched variants only, see run_repetitions_batched
+#   state_dict(), load_state_dict(state): a dict of arrays with everything the run has learned and its RNG state, the
+#     runs are on the first axis for the batched variants, see BanditSnapshot. The single-run variants keep the
+#     arrays they get without copying when their dtype matches, the batched variants copy them.
+#   update_batch(actions, rewards): learn from k rewards at once, like k calls of update, from k actions and rewards,
+#     or (n_repetitions, k) arrays for the batched variants, see feedback_delay of run_repetitions
+#   select_actions(n, t): single-run variants only, n decisions without updates in between, see BanditService
+# rng and count_dtype are accepted by every policy, also by those that draw no random numbers or keep no counts,
+# and indexed by every single-run policy, also by those that have no index.
 
 class EgreedyPolicy:
+    __slots__ = ('n_actions', 'epsilon', 'q_table', 'counts', 'rng', 'indexed', '_index')
 
-    def __init__(self, n_actions=10):
+    def __init__(self, n_actions=10, rng=None, indexed=False, dtype=np.float64, count_dtype=np.int64, epsilon=0.1):
+        ''' rng: Generator, SeedSequence or int seed used for exploration (default is None, random)
+        indexed: keep the greedy action in an ArgmaxTree, O(log n_actions) per step instead of O(n_actions)
+        dtype, count_dtype: dtypes of q_table and counts, np.float32 and np.int32 halve their memory
+        epsilon: exploration probability used when select_action gets none (default is 0.1) '''
         self.n_actions = n_actions
-        self.q_table = np.zeros(n_actions)
-        self.counts = np.zeros(n_actions)
-        pass
+        self.epsilon = epsilon
+        self.q_table = np.zeros(n_actions, dtype=dtype)
+        self.counts = np.zeros(n_actions, dtype=count_dtype)
+        self.indexed = indexed
+        self.reset(rng)
+
+    def reset(self, rng=None):
+        ''' forgets everything that was learned, reusing the arrays, rng as in __init__ '''
+        self.q_table.fill(0)
+        self.counts.fill(0)
+        self.rng = make_rng(rng)
+        self._index = ArgmaxTree(self.q_table) if self.indexed else None
         
-    def select_action(self, epsilon):
-        if np.random.random() < epsilon:
-            a = np.random.randint(0,self.n_actions)
+    def select_action(self, epsilon=None, t=None):
+        if epsilon is None:
+            epsilon = self.epsilon
+        # always draw both numbers, so the stream is used like BatchEgreedyPolicy uses it
+        explore, u = self.rng.random(2)
+        if explore < epsilon:
+            a = int(u * self.n_actions)
+        elif self._index is not None:
+            a = self._index.argmax()
         else:
             a = np.argmax(self.q_table)
         return a
+
+    def select_actions(self, n, epsilon=None, t=None):
+        ''' returns n actions chosen without updates in between, drawing what n calls of select_action draw '''
+        if epsilon is None:
+            epsilon = self.epsilon
+        explore, u = self.rng.random((n, 2)).T
+        greedy = self._index.argmax() if self._index is not None else np.argmax(self.q_table)
+        return np.where(explore < epsilon, (u * self.n_actions).astype(np.int64), greedy)
         
     def update(self,a,r):
         self.counts[a] += 1
         self.q_table[a] += (1 / self.counts[a]) * (r - self.q_table[a])
+        if self._index is not None:
+            self._index.update(a, self.q_table[a])
+
+    def update_batch(self, actions, rewards):
+        ''' learns from rewards[i] of actions[i] for every i, like calling update for each pair '''
+        updated = update_sample_averages(self.q_table, self.counts, actions, rewards)
+        if self._index is not None:
+            for a in updated:
+                self._index.update(a, self.q_table[a])
+
+    def state_dict(self):
+        ''' returns a dict of arrays with the Q-values, the counts and the state of the exploration stream '''
+        return {'q_table': self.q_table, 'counts': self.counts, 'rng_state': get_rng_states([self.rng])}
+
+    def load_state_dict(self, state):
+        ''' continues from a state returned by state_dict '''
+        self.q_table = np.asarray(state['q_table'], dtype=self.q_table.dtype)
+        self.counts = np.asarray(state['counts'], dtype=self.counts.dtype)
+        set_rng_states([self.rng], state['rng_state'])
+        self._index = ArgmaxTree(self.q_table) if self.indexed else None
 
 class OIPolicy:
+    __slots__ = ('n_actions', 'q_table', 'initial_value', 'learning_rate', 'indexed', '_index')
 
-    def __init__(self, n_actions=10, initial_value=0.0, learning_rate=0.1):
+    def __init__(self, n_actions=10, initial_value=0.0, learning_rate=0.1, indexed=False, dtype=np.float64,
+                 rng=None, count_dtype=None):
+        ''' indexed: keep the greedy action in an ArgmaxTree, O(log n_actions) per step instead of O(n_actions)
+        dtype: dtype of q_table, np.float32 halves its memory '''
         self.n_actions = n_actions
-        self.q_table = np.full(self.n_actions, initial_value)
+        self.q_table = np.empty(self.n_actions, dtype=dtype)
+        self.initial_value = initial_value
         self.learning_rate = learning_rate
-        pass
+        self.indexed = indexed
+        self.reset()
+
+    def reset(self, rng=None):
+        ''' forgets everything that was learned, reusing the arrays. The policy draws no random numbers,
+        rng is accepted so every policy can be reset alike '''
+        self.q_table.fill(self.initial_value)
+        self._index = ArgmaxTree(self.q_table) if self.indexed else None
         
-    def select_action(self):
+    def select_action(self, t=None):
+        if self._index is not None:
+            return self._index.argmax()
         return np.argmax(self.q_table)
+
+    def select_actions(self, n, t=None):
+        ''' returns n actions chosen without updates in between, which are all the greedy action '''
+        return np.full(n, self.select_action(t=t), dtype=np.int64)
         
     def update(self,a,r):
         self.q_table[a] += self.learning_rate * (r - self.q_table[a])
+        if self._index is not None:
+            self._index.update(a, self.q_table[a])
+
+    def update_batch(self, actions, rewards):
+        ''' learns from rewards[i] of actions[i] for every i, like calling update for each pair in order '''
+        updated = update_exponential_averages(self.q_table, self.learning_rate, actions, rewards)
+        if self._index is not None:
+            for a in updated:
+                self._index.update(a, self.q_table[a])
+
+    def state_dict(self):
+        ''' returns a dict with the Q-values, the policy draws no random numbers '''
+        return {'q_table': self.q_table}
+
+    def load_state_dict(self, state):
+        ''' continues from a state returned by state_dict '''
+        self.q_table = np.asarray(state['q_table'], dtype=self.q_table.dtype)
+        self._index = ArgmaxTree(self.q_table) if self.indexed else None
 
 class UCBPolicy:
+    __slots__ = ('n_actions', 'c', 'q_table', 'counts', 'indexed', '_index', '_untried')
 
-    def __init__(self, n_actions=10):
+    def __init__(self, n_actions=10, indexed=False, dtype=np.float64, count_dtype=np.int64, c=1.0, rng=None):
+        ''' indexed: keep the UCB values in a UCBTree once every action is tried, so a step costs
+        O(log^2 n_actions) amortized instead of recomputing all n_actions bonuses
+        dtype, count_dtype: dtypes of q_table and counts, np.float32 and np.int32 halve their memory
+        c: exploration constant used when select_action gets none (default is 1.0) '''
         self.n_actions = n_actions
-        self.q_table = np.zeros(n_actions)
-        self.counts = np.zeros(n_actions)
-        pass
+        self.c = c
+        self.q_table = np.zeros(n_actions, dtype=dtype)
+        self.counts = np.zeros(n_actions, dtype=count_dtype)
+        self.indexed = indexed
+        self.reset()
+
+    def reset(self, rng=None):
+        ''' forgets everything that was learned, reusing the arrays. The policy draws no random numbers,
+        rng is accepted so every policy can be reset alike '''
+        self.q_table.fill(0)
+        self.counts.fill(0)
+        self._index = None
+        self._untried = 0 # counts only grow, so the first untried action only moves forward
     
-    def select_action(self, c, t):
+    def select_action(self, c=None, t=None):
         # return np.argmax(self.q_table + c * (np.sqrt(np.log(t)/self.q_table)))
+        if c is None:
+            c = self.c
+        if self.indexed:
+            return self._select_indexed(c, t)
         if not np.all(self.counts):
             return np.argmax(self.counts == 0)
         else:
             return np.argmax(self.q_table + c * (np.sqrt(np.log(t)/self.counts)))
+
+    def _select_indexed(self, c, t):
+        while self._untried < self.n_actions and self.counts[self._untried] > 0:
+            self._untried += 1
+        if self._untried < self.n_actions:
+            return self._untried
+        if self._index is None or self._index.c != c:
+            self._index = UCBTree(self.q_table, self.counts, c, t)
+        return self._index.argmax(t)
+
+    def select_actions(self, n, c=None, t=None):
+        ''' returns n actions chosen without updates in between, which are all the action with the largest bound '''
+        return np.full(n, self.select_action(c=c, t=t), dtype=np.int64)
         
     def update(self,a,r):
         self.counts[a] += 1
         self.q_table[a] += (1 / self.counts[a]) * (r - self.q_table[a])
+        if self._index is not None:
+            self._index.update(a, self.q_table[a], self.counts[a])
+
+    def update_batch(self, actions, rewards):
+        ''' learns from rewards[i] of actions[i] for every i, like calling update for each pair '''
+        updated = update_sample_averages(self.q_table, self.counts, actions, rewards)
+        if self._index is not None:
+            for a in updated:
+                self._index.update(a, self.q_table[a], self.counts[a])
+
+    def state_dict(self):
+        ''' returns a dict with the Q-values and counts, the policy draws no random numbers '''
+        return {'q_table': self.q_table, 'counts': self.counts}
+
+    def load_state_dict(self, state):
+        ''' continues from a state returned by state_dict, the index is rebuilt at the next indexed selection '''
+        self.q_table = np.asarray(state['q_table'], dtype=self.q_table.dtype)
+        self.counts = np.asarray(state['counts'], dtype=self.counts.dtype)
+        self._index = None
+        self._untried = 0
+
+
+def flat_actions(actions, shape):
+    ''' returns the positions of actions in the flattened (n_actions,) or (n_repetitions, n_actions) table of the
+    given shape, for (k,) or (n_repetitions, k) actions respectively, in the order the rewards arrived '''
+    actions = np.asarray(actions, dtype=np.int64)
+    if len(shape) == 2:
+        actions = actions + shape[1] * np.arange(shape[0])[:,None]
+    return actions.ravel()
+
+
+def update_sample_averages(q_table, counts, actions, rewards):
+    """
+    Add a batch of rewards to sample averages in place. The new average of an action with n earlier rewards and k
+    new ones summing to s is q + (s - k * q) / (n + k), so the counts are those of k single updates and the averages
+    equal theirs up to rounding.
+
+    :param q_table: Sample average per action, (n_actions,) or (n_repetitions, n_actions)
+    :param counts: Number of rewards per action, shaped like q_table
+    :param actions: The action of every reward, (k,) or (n_repetitions, k), actions may repeat
+    :param rewards: The rewards, shaped like actions
+    :returns updated: The positions in the flattened q_table that received rewards
+    """
+    flat = flat_actions(actions, q_table.shape)
+    added = np.bincount(flat, minlength=q_table.size)
+    reward_sums = np.bincount(flat, weights=np.ravel(rewards), minlength=q_table.size)
+    updated = np.flatnonzero(added)
+    q_values = q_table.reshape(-1)
+    counts.reshape(-1)[updated] += added[updated].astype(counts.dtype)
+    q_values[updated] += (reward_sums[updated] - added[updated] * q_values[updated]) / counts.reshape(-1)[updated]
+    return updated
+
+
+def update_exponential_averages(q_table, learning_rate, actions, rewards):
+    """
+    Apply a batch of constant learning rate updates in place, in the order the rewards arrived. k updates of one
+    action leave (1 - lr)^k of its old value and give the i-th of its rewards the weight lr * (1 - lr)^(k - 1 - i).
+
+    :param q_table: Value per action, (n_actions,) or (n_repetitions, n_actions)
+    :param learning_rate: The learning rate lr
+    :param actions: The action of every reward, (k,) or (n_repetitions, k), actions may repeat
+    :param rewards: The rewards, shaped like actions
+    :returns updated: The positions in the flattened q_table that received rewards
+    """
+    flat = flat_actions(actions, q_table.shape)
+    # a stable sort groups the rewards per action and keeps their order within the group
+    order = np.argsort(flat, kind='stable')
+    grouped = flat[order]
+    added = np.bincount(grouped, minlength=q_table.size)
+    rank = np.arange(len(grouped)) - np.searchsorted(grouped, grouped)
+    decay = 1 - learning_rate
+    weights = learning_rate * decay ** (added[grouped] - 1 - rank) * np.ravel(rewards)[order]
+    q_values = q_table.reshape(-1)
+    q_values[:] = decay ** added * q_values + np.bincount(grouped, weights=weights, minlength=q_table.size)
+    return np.flatnonzero(added)
+
+
+class BatchEgreedyPolicy:
+    ''' E-greedy policy for n_repetitions independent runs, row i of q_table and counts belongs to run i '''
+    __slots__ = ('n_repetitions', 'n_actions', 'epsilon', 'q_table', 'counts', 'rngs', 'chunk_size', '_uniforms',
+                 '_rows')
+
+    def __init__(self, n_repetitions, n_actions=10, rng=None, chunk_size=None, dtype=np.float64, count_dtype=np.int64,
+                 epsilon=0.1):
+        ''' rng: list with one Generator per run, or a seed from which those are derived (default is None, random)
+        chunk_size: number of timesteps of exploration draws sampled per RNG call (default is None, see BlockSampler)
+        dtype, count_dtype: dtypes of q_table and counts, np.float32 and np.int32 halve their memory
+        epsilon: exploration probability used when select_action gets none (default is 0.1) '''
+        self.n_repetitions = n_repetitions
+        self.n_actions = n_actions
+        self.epsilon = epsilon
+        self.q_table = np.zeros((n_repetitions, n_actions), dtype=dtype)
+        self.counts = np.zeros((n_repetitions, n_actions), dtype=count_dtype)
+        self.chunk_size = chunk_size
+        self._rows = np.arange(n_repetitions)
+        self.reset(rng)
+
+    def reset(self, rng=None):
+        ''' forgets everything that was learned, reusing the arrays, rng as in __init__ '''
+        self.q_table.fill(0)
+        self.counts.fill(0)
+        self.rngs = batch_rngs(rng, self.n_repetitions, role=POLICY_STREAM)
+        self._uniforms = BlockSampler(self.rngs, width=2, chunk_size=self.chunk_size)
+
+    def select_action(self, epsilon=None, t=None):
+        if epsilon is None:
+            epsilon = self.epsilon
+        u = self._uniforms.next()
+        random_a = (u[:,1] * self.n_actions).astype(np.int64)
+        return np.where(u[:,0] < epsilon, random_a, np.argmax(self.q_table, axis=1))
+
+    def prefetch(self, n_timesteps):
+        ''' draws the exploration numbers of the next n_timesteps '''
+        self._uniforms.prefetch(n_timesteps)
+
+    def update(self,a,r):
+        self.counts[self._rows,a] += 1
+        self.q_table[self._rows,a] += (1 / self.counts[self._rows,a]) * (r - self.q_table[self._rows,a])
+
+    def update_batch(self, actions, rewards):
+        ''' learns from the (n_repetitions, k) rewards of the (n_repetitions, k) actions, like k calls of update '''
+        update_sample_averages(self.q_table, self.counts, actions, rewards)
+
+    def state_dict(self):
+        ''' returns a dict of arrays with the state of every run, the runs are on the first axis '''
+        uniforms = self._uniforms.state_dict()
+        return {'q_table': self.q_table, 'counts': self.counts,
+                'rng_state': uniforms['rng_state'], 'uniforms': uniforms['block']}
+
+    def load_state_dict(self, state):
+        ''' restores a state returned by state_dict, the number of runs has to match '''
+        self.q_table = np.array(state['q_table'], dtype=self.q_table.dtype)
+        self.counts = np.array(state['counts'], dtype=self.counts.dtype)
+        self._uniforms.load_state_dict({'rng_state': state['rng_state'], 'block': state['uniforms']})
+
+class BatchOIPolicy:
+    ''' Optimistic initialization policy for n_repetitions independent runs '''
+    __slots__ = ('n_repetitions', 'n_actions', 'q_table', 'initial_value', 'learning_rate', '_rows')
+
+    def __init__(self, n_repetitions, n_actions=10, initial_value=0.0, learning_rate=0.1, dtype=np.float64,
+                 rng=None, count_dtype=None):
+        ''' dtype: dtype of q_table, np.float32 halves its memory '''
+        self.n_repetitions = n_repetitions
+        self.n_actions = n_actions
+        self.q_table = np.empty((n_repetitions, n_actions), dtype=dtype)
+        self.initial_value = initial_value
+        self.learning_rate = learning_rate
+        self._rows = np.arange(n_repetitions)
+        self.reset()
+
+    def reset(self, rng=None):
+        ''' forgets everything that was learned, reusing the arrays '''
+        self.q_table.fill(self.initial_value)
+
+    def select_action(self, t=None):
+        return np.argmax(self.q_table, axis=1)
+
+    def prefetch(self, n_timesteps):
+        ''' the policy draws no random numbers '''
+        pass
+
+    def update(self,a,r):
+        self.q_table[self._rows,a] += self.learning_rate * (r - self.q_table[self._rows,a])
+
+    def update_batch(self, actions, rewards):
+        ''' learns from the (n_repetitions, k) rewards of the (n_repetitions, k) actions, like k calls of update '''
+        update_exponential_averages(self.q_table, self.learning_rate, actions, rewards)
+
+    def state_dict(self):
+        ''' returns a dict of arrays with the state of every run, the runs are on the first axis '''
+        return {'q_table': self.q_table}
+
+    def load_state_dict(self, state):
+        ''' restores a state returned by state_dict, the number of runs has to match '''
+        self.q_table = np.array(state['q_table'], dtype=self.q_table.dtype)
+
+class BatchUCBPolicy:
+    ''' UCB policy for n_repetitions independent runs '''
+    __slots__ = ('n_repetitions', 'n_actions', 'c', 'q_table', 'counts', '_rows')
+
+    def __init__(self, n_repetitions, n_actions=10, dtype=np.float64, count_dtype=np.int64, c=1.0, rng=None):
+        ''' dtype, count_dtype: dtypes of q_table and counts, np.float32 and np.int32 halve their memory
+        c: exploration constant used when select_action gets none (default is 1.0) '''
+        self.n_repetitions = n_repetitions
+        self.n_actions = n_actions
+        self.c = c
+        self.q_table = np.zeros((n_repetitions, n_actions), dtype=dtype)
+        self.counts = np.zeros((n_repetitions, n_actions), dtype=count_dtype)
+        self._rows = np.arange(n_repetitions)
+
+    def reset(self, rng=None):
+        ''' forgets everything that was learned, reusing the arrays '''
+        self.q_table.fill(0)
+        self.counts.fill(0)
+
+    def select_action(self, c=None, t=None):
+        if c is None:
+            c = self.c
+        # runs that still have untried actions pick the first one, like UCBPolicy
+        untried = self.counts == 0
+        has_untried = untried.any(axis=1)
+        if has_untried.all():
+            return np.argmax(untried, axis=1)
+        a = np.argmax(self.q_table + c * (np.sqrt(np.log(t)/np.maximum(self.counts, 1))), axis=1)
+        if has_untried.any():
+            a = np.where(has_untried, np.argmax(untried, axis=1), a)
+        return a
+
+    def prefetch(self, n_timesteps):
+        ''' the policy draws no random numbers '''
+        pass
+
+    def update(self,a,r):
+        self.counts[self._rows,a] += 1
+        self.q_table[self._rows,a] += (1 / self.counts[self._rows,a]) * (r - self.q_table[self._rows,a])
+
+    def update_batch(self, actions, rewards):
+        ''' learns from the (n_repetitions, k) rewards of the (n_repetitions, k) actions, like k calls of update '''
+        update_sample_averages(self.q_table, self.counts, actions, rewards)
+
+    def state_dict(self):
+        ''' returns a dict of arrays with the state of every run, the runs are on the first axis '''
+        return {'q_table': self.q_table, 'counts': self.counts}
+
+    def load_state_dict(self, state):
+        ''' restores a state returned by state_dict, the number of runs has to match '''
+        self.q_table = np.array(state['q_table'], dtype=self.q_table.dtype)
+        self.counts = np.array(state['counts'], dtype=self.counts.dtype)
+
+def beta_uniforms(prior):
+    ''' returns the number of uniforms sample_beta uses per sample, two more when parameters can be below 1 '''
+    return 6 if prior >= 1 else 8
+
+
+def sample_gamma(shape, x, u_accept, u_fallback, u_boost=None):
+    ''' returns Gamma(shape) samples from one attempt of Marsaglia & Tsang (2000) with standard normals x and
+    uniforms u_accept, and the exact inverse of the Gamma CDF at u_fallback where that attempt is rejected, which
+    happens for a few percent. A shape below 1 is sampled as Gamma(shape + 1) * u_boost^(1 / shape). '''
+    boost = shape < 1
+    a = shape + boost
+    d = a - 1 / 3
+    v = (1 + x / np.sqrt(9 * d))**3
+    with np.errstate(invalid='ignore', divide='ignore'):
+        accepted = (v > 0) & (np.log1p(-u_accept) < 0.5 * x**2 + d - d * v + d * np.log(v))
+    samples = d * v
+    if not accepted.all():
+        from scipy.special import gammaincinv # imported on first use, a rejection is rare
+        rejected = ~accepted
+        samples[rejected] = gammaincinv(a[rejected], u_fallback[rejected])
+    if u_boost is not None and boost.any():
+        samples[boost] *= (1 - u_boost[boost])**(1 / shape[boost])
+    return samples
+
+
+def sample_beta(a, b, u):
+    ''' a, b: arrays of Beta parameters of the same shape
+    u: uniforms in [0, 1) of shape a.shape + (6,), or a.shape + (8,) when parameters can be below 1, see beta_uniforms
+    returns Beta(a, b) samples as X / (X + Y) of Gamma(a) and Gamma(b) samples, see sample_gamma. Every sample uses a
+    fixed number of uniforms however often an attempt is rejected, so they can be drawn in blocks per run like those of
+    the other policies, and the vectorized arithmetic costs the same for any number of observations. '''
+    # one Box-Muller pair gives the normals of both Gamma samples
+    radius = np.sqrt(-2 * np.log1p(-u[..., 0]))
+    angle = 2 * np.pi * u[..., 1]
+    boost = u.shape[-1] == 8
+    x = sample_gamma(a, radius * np.cos(angle), u[..., 2], u[..., 3], u[..., 6] if boost else None)
+    y = sample_gamma(b, radius * np.sin(angle), u[..., 4], u[..., 5], u[..., 7] if boost else None)
+    return x / (x + y)
+
+
+class ThompsonPolicy:
+    ''' Beta-Bernoulli Thompson sampling: every step a mean is sampled per action from its Beta(prior + successes,
+    prior + failures) posterior and the action with the largest sample is taken. Meant for rewards in [0, 1]. '''
+    __slots__ = ('n_actions', 'prior', 'successes', 'failures', 'rng')
+
+    def __init__(self, n_actions=10, prior=1.0, rng=None, dtype=np.float64, count_dtype=None, indexed=False):
+        ''' prior: both parameters of the Beta prior of every action (default is 1.0, uniform)
+        rng: Generator, SeedSequence or int seed used for the posterior samples (default is None, random)
+        dtype: dtype of successes and failures, np.float32 halves their memory
+        indexed: ignored, every sample changes every step so there is nothing to index '''
+        self.n_actions = n_actions
+        self.prior = prior
+        self.successes = np.zeros(n_actions, dtype=dtype)
+        self.failures = np.zeros(n_actions, dtype=dtype)
+        self.reset(rng)
+
+    def reset(self, rng=None):
+        ''' forgets everything that was learned, reusing the arrays, rng as in __init__ '''
+        self.successes.fill(0)
+        self.failures.fill(0)
+        self.rng = make_rng(rng)
+
+    def select_action(self, t=None):
+        # a fixed number of uniforms per action, so the stream is used like BatchThompsonPolicy uses it
+        u = self.rng.random((self.n_actions, beta_uniforms(self.prior)))
+        return np.argmax(sample_beta(self.prior + self.successes, self.prior + self.failures, u))
+
+    def update(self,a,r):
+        self.successes[a] += r
+        self.failures[a] += 1 - r
+
+    def update_batch(self, actions, rewards):
+        ''' learns from rewards[i] of actions[i] for every i, like calling update for each pair '''
+        add_posterior_counts(self.successes, self.failures, actions, rewards)
+
+    def state_dict(self):
+        ''' returns a dict of arrays with the posterior counts and the state of the sampling stream '''
+        return {'successes': self.successes, 'failures': self.failures, 'rng_state': get_rng_states([self.rng])}
+
+    def load_state_dict(self, state):
+        ''' continues from a state returned by state_dict '''
+        self.successes = np.asarray(state['successes'], dtype=self.successes.dtype)
+        self.failures = np.asarray(state['failures'], dtype=self.failures.dtype)
+        set_rng_states([self.rng], state['rng_state'])
+
+class GradientBanditPolicy:
+    ''' Gradient bandit: samples from a softmax over action preferences, which follow stochastic gradient ascent
+    on the expected reward with the average reward as baseline (Sutton & Barto, section 2.8) '''
+    __slots__ = ('n_actions', 'step_size', 'preferences', 'baseline', 'n_updates', 'rng', '_probs')
+
+    def __init__(self, n_actions=10, step_size=0.1, rng=None, dtype=np.float64, count_dtype=None, indexed=False):
+        ''' step_size: step size of the preference updates (default is 0.1)
+        rng: Generator, SeedSequence or int seed used to sample actions (default is None, random)
+        dtype: dtype of the preferences, np.float32 halves their memory
+        indexed: ignored, every probability changes every step so there is nothing to index '''
+        self.n_actions = n_actions
+        self.step_size = step_size
+        self.preferences = np.zeros(n_actions, dtype=dtype)
+        self.reset(rng)
+
+    def reset(self, rng=None):
+        ''' forgets everything that was learned, reusing the arrays, rng as in __init__ '''
+        self.preferences.fill(0)
+        self.baseline = 0.0
+        self.n_updates = 0
+        self.rng = make_rng(rng)
+        self._probs = None
+
+    def probabilities(self):
+        ''' returns the softmax of the preferences '''
+        # subtracting the largest preference keeps exp from overflowing and does not change the softmax
+        z = np.exp(self.preferences - self.preferences.max())
+        return z / z.sum()
+
+    def select_action(self, t=None):
+        self._probs = self.probabilities()
+        # inverse transform sampling with one uniform, like BatchGradientBanditPolicy
+        u = self.rng.random()
+        return min(int(np.sum(np.cumsum(self._probs) <= u)), self.n_actions - 1)
+
+    def update(self,a,r):
+        probs = self._probs if self._probs is not None else self.probabilities()
+        self.n_updates += 1
+        delta = self.step_size * (r - self.baseline)
+        # H_a += delta * (1 - pi_a) and H_b -= delta * pi_b for the other actions
+        self.preferences -= delta * probs
+        self.preferences[a] += delta
+        self.baseline += (r - self.baseline) / self.n_updates
+        self._probs = None
+
+    def update_batch(self, actions, rewards):
+        ''' learns from rewards[i] of actions[i] for every i in order, one update at a time, as every update changes
+        the probabilities the next one depends on '''
+        self._probs = None
+        for a, r in zip(actions, rewards):
+            self.update(a, r)
+
+    def state_dict(self):
+        ''' returns a dict of arrays with the preferences, the baseline and the state of the sampling stream '''
+        return {'preferences': self.preferences, 'baseline': np.array(self.baseline),
+                'n_updates': np.array(self.n_updates), 'rng_state': get_rng_states([self.rng])}
+
+    def load_state_dict(self, state):
+        ''' continues from a state returned by state_dict '''
+        self.preferences = np.asarray(state['preferences'], dtype=self.preferences.dtype)
+        self.baseline = float(state['baseline'])
+        self.n_updates = int(state['n_updates'])
+        set_rng_states([self.rng], state['rng_state'])
+        self._probs = None
+
+class BatchThompsonPolicy:
+    ''' Beta-Bernoulli Thompson sampling for n_repetitions independent runs. The posteriors of all runs and actions
+    are sampled at once with sample_beta, from one row of uniforms per run. '''
+    __slots__ = ('n_repetitions', 'n_actions', 'prior', 'successes', 'failures', 'rngs', 'chunk_size', '_uniforms',
+                 '_rows')
+
+    def __init__(self, n_repetitions, n_actions=10, prior=1.0, rng=None, chunk_size=None, dtype=np.float64,
+                 count_dtype=None):
+        ''' rng: list with one Generator per run, or a seed from which those are derived (default is None, random)
+        chunk_size: number of timesteps of uniforms sampled per RNG call (default is None, see BlockSampler) '''
+        self.n_repetitions = n_repetitions
+        self.n_actions = n_actions
+        self.prior = prior
+        self.successes = np.zeros((n_repetitions, n_actions), dtype=dtype)
+        self.failures = np.zeros((n_repetitions, n_actions), dtype=dtype)
+        self.chunk_size = chunk_size
+        self._rows = np.arange(n_repetitions)
+        self.reset(rng)
+
+    def reset(self, rng=None):
+        ''' forgets everything that was learned, reusing the arrays, rng as in __init__ '''
+        self.successes.fill(0)
+        self.failures.fill(0)
+        self.rngs = batch_rngs(rng, self.n_repetitions, role=POLICY_STREAM)
+        self._uniforms = BlockSampler(self.rngs, width=self.n_actions * beta_uniforms(self.prior),
+                                      chunk_size=self.chunk_size)
+
+    def select_action(self, t=None):
+        u = self._uniforms.next().reshape(self.n_repetitions, self.n_actions, -1)
+        return np.argmax(sample_beta(self.prior + self.successes, self.prior + self.failures, u), axis=1)
+
+    def prefetch(self, n_timesteps):
+        ''' reserves the uniforms of the next n_timesteps, which are drawn at most chunk_size timesteps at a time as a
+        block of uniforms for every action per timestep can be large '''
+        self._uniforms.reserve(n_timesteps)
+
+    def update(self,a,r):
+        self.successes[self._rows,a] += r
+        self.failures[self._rows,a] += 1 - r
+
+    def update_batch(self, actions, rewards):
+        ''' learns from the (n_repetitions, k) rewards of the (n_repetitions, k) actions, like k calls of update '''
+        add_posterior_counts(self.successes, self.failures, actions, rewards)
+
+    def state_dict(self):
+        ''' returns a dict of arrays with the state of every run, the runs are on the first axis '''
+        uniforms = self._uniforms.state_dict()
+        return {'successes': self.successes, 'failures': self.failures,
+                'rng_state': uniforms['rng_state'], 'uniforms': uniforms['block']}
+
+    def load_state_dict(self, state):
+        ''' restores a state returned by state_dict, the number of runs has to match '''
+        self.successes = np.array(state['successes'], dtype=self.successes.dtype)
+        self.failures = np.array(state['failures'], dtype=self.failures.dtype)
+        self._uniforms.load_state_dict({'rng_state': state['rng_state'], 'block': state['uniforms']})
+
+class BatchGradientBanditPolicy:
+    ''' Gradient bandit for n_repetitions independent runs, row i of preferences belongs to run i '''
+    __slots__ = ('n_repetitions', 'n_actions', 'step_size', 'preferences', 'baseline', 'n_updates', 'rngs',
+                 'chunk_size', '_uniforms', '_probs', '_rows')
+
+    def __init__(self, n_repetitions, n_actions=10, step_size=0.1, rng=None, chunk_size=None, dtype=np.float64,
+                 count_dtype=np.int64):
+        ''' rng: list with one Generator per run, or a seed from which those are derived (default is None, random)
+        chunk_size: number of timesteps of uniforms sampled per RNG call (default is None, see BlockSampler) '''
+        self.n_repetitions = n_repetitions
+        self.n_actions = n_actions
+        self.step_size = step_size
+        self.preferences = np.zeros((n_repetitions, n_actions), dtype=dtype)
+        self.baseline = np.zeros(n_repetitions, dtype=dtype)
+        self.n_updates = np.zeros(n_repetitions, dtype=count_dtype)
+        self.chunk_size = chunk_size
+        self._rows = np.arange(n_repetitions)
+        self.reset(rng)
+
+    def reset(self, rng=None):
+        ''' forgets everything that was learned, reusing the arrays, rng as in __init__ '''
+        self.preferences.fill(0)
+        self.baseline.fill(0)
+        self.n_updates.fill(0)
+        self.rngs = batch_rngs(rng, self.n_repetitions, role=POLICY_STREAM)
+        self._uniforms = BlockSampler(self.rngs, chunk_size=self.chunk_size)
+        self._probs = None
+
+    def probabilities(self):
+        ''' returns the softmax of the preferences of every run '''
+        z = np.exp(self.preferences - self.preferences.max(axis=1, keepdims=True))
+        return z / z.sum(axis=1, keepdims=True)
+
+    def select_action(self, t=None):
+        self._probs = self.probabilities()
+        u = self._uniforms.next()
+        a = np.sum(np.cumsum(self._probs, axis=1) <= u[:,None], axis=1)
+        return np.minimum(a, self.n_actions - 1)
+
+    def prefetch(self, n_timesteps):
+        ''' draws the uniforms of the next n_timesteps '''
+        self._uniforms.prefetch(n_timesteps)
+
+    def update(self,a,r):
+        probs = self._probs if self._probs is not None else self.probabilities()
+        self.n_updates += 1
+        delta = self.step_size * (r - self.baseline)
+        self.preferences -= delta[:,None] * probs
+        self.preferences[self._rows,a] += delta
+        self.baseline += (r - self.baseline) / self.n_updates
+        self._probs = None
+
+    def update_batch(self, actions, rewards):
+        ''' learns from the (n_repetitions, k) rewards of the (n_repetitions, k) actions, one column at a time, as
+        every update changes the probabilities the next one depends on '''
+        self._probs = None
+        for a, r in zip(np.transpose(actions), np.transpose(rewards)):
+            self.update(a, r)
+
+    def state_dict(self):
+        ''' returns a dict of arrays with the state of every run, the runs are on the first axis '''
+        uniforms = self._uniforms.state_dict()
+        return {'preferences': self.preferences, 'baseline': self.baseline, 'n_updates': self.n_updates,
+                'rng_state': uniforms['rng_state'], 'uniforms': uniforms['block']}
+
+    def load_state_dict(self, state):
+        ''' restores a state returned by state_dict, the number of runs has to match '''
+        self.preferences = np.array(state['preferences'], dtype=self.preferences.dtype)
+        self.baseline = np.array(state['baseline'], dtype=self.baseline.dtype)
+        self.n_updates = np.array(state['n_updates'], dtype=self.n_updates.dtype)
+        self._uniforms.load_state_dict({'rng_state': state['rng_state'], 'block': state['uniforms']})
+        self._probs = None
+
+
+def add_posterior_counts(successes, failures, actions, rewards):
+    ''' adds a batch of rewards in [0, 1] to the Beta posterior counts, (n_actions,) or (n_repetitions, n_actions),
+    of their (k,) or (n_repetitions, k) actions '''
+    flat = flat_actions(actions, successes.shape)
+    rewards = np.ravel(rewards)
+    successes.reshape(-1)[:] += np.bincount(flat, weights=rewards, minlength=successes.size)
+    failures.reshape(-1)[:] += np.bincount(flat, weights=1 - rewards, minlength=failures.size)
+
+
+class PolicySpec:
+    ''' A registered policy: its class, its batched class (None if it has none) and the name of the
+    constructor argument that run_repetitions sets to param_value '''
+    __slots__ = ('policy_class', 'batch_class', 'param')
+
+    def __init__(self, policy_class, batch_class=None, param='epsilon'):
+        self.policy_class = policy_class
+        self.batch_class = batch_class
+        self.param = param
+
+
+POLICIES = {}
+
+
+def register_policy(name, policy_class, batch_class=None, param='epsilon'):
+    """
+    Make a policy available to run_repetitions under name. The classes have to follow the protocol at the top of
+    this module.
+
+    :param name: The name passed as the policy argument of run_repetitions
+    :param policy_class: The policy for a single run, used by the 'python' and 'indexed' backends
+    :param batch_class: The policy for n_repetitions runs in lockstep, used by the 'numpy' backend (default is None)
+    :param param: The constructor argument that is set to param_value (default is 'epsilon')
+    """
+    POLICIES[name] = PolicySpec(policy_class, batch_class, param)
+
+
+def make_policy(name, n_actions, param_value, n_repetitions=None, **options):
+    """
+    Construct a registered policy
+
+    :param name: Name of the policy, see register_policy
+    :param n_actions: Cardinality of the action space
+    :param param_value: Value of the hyperparameter of the policy
+    :param n_repetitions: Construct the batched variant for this many runs (default is None, a single run)
+    :param options: Further constructor arguments, e.g. rng, dtype and count_dtype
+    :returns pi: The policy
+    :raise ValueError: If no policy is registered under name, or it has no batched variant
+    """
+    if name not in POLICIES:
+        raise ValueError("Policy error, please pass one of the following to the policy argument: {} ".format(
+            ', '.join("'{}'".format(name) for name in POLICIES)))
+    spec = POLICIES[name]
+    options[spec.param] = param_value
+    if n_repetitions is None:
+        return spec.policy_class(n_actions=n_actions, **options)
+    if spec.batch_class is None:
+        raise ValueError("Policy error, policy '{}' has no batched variant, use the 'python' backend".format(name))
+    return spec.batch_class(n_repetitions=n_repetitions, n_actions=n_actions, **options)
+
+
+register_policy('egreedy', EgreedyPolicy, BatchEgreedyPolicy, param='epsilon')
+register_policy('oi', OIPolicy, BatchOIPolicy, param='initial_value')
+register_policy('ucb', UCBPolicy, BatchUCBPolicy, param='c')
+register_policy('thompson', ThompsonPolicy, BatchThompsonPolicy, param='prior')
+register_policy('gradient', GradientBanditPolicy, BatchGradientBanditPolicy, param='step_size')
+
     
 def test():
     n_actions = 10
@@ -84,6 +792,16 @@ def test():
     r = env.act(a) # sample reward
     pi.update(a,r) # update policy
     print("Test UCB policy with action {}, received reward {}".format(a,r))
+
+    actions = pi.select_actions(20, t=2) # 20 decisions whose rewards arrive later
+    rewards = np.array([env.act(a) for a in actions])
+    delayed = UCBPolicy(n_actions=n_actions)
+    delayed.update(a,r)
+    delayed.update_batch(actions, rewards) # learn them in bulk
+    for a, r in zip(actions, rewards):
+        pi.update(a,r)
+    print("Test batched UCB update, same counts: {}, largest difference in Q-values: {:.1e}".format(
+        np.array_equal(pi.counts, delayed.counts), np.abs(pi.q_table - delayed.q_table).max()))
     
 if __name__ == '__main__':
     test()
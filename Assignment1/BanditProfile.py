@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Instrumentation and profiling
+Practical for course 'Reinforcement Learning',
+Bachelor AI, Leiden University, The Netherlands
+2022
+By Luca Goemans & Sayf El Kaddouri
+"""
+import argparse
+import cProfile
+import functools
+import sys
+import time
+from contextlib import contextmanager
+
+# Instrumentation is off unless a Timings is made current with instrumented(). While it is off, the experiment loops
+# use the policies and environments themselves and the timed functions cost one check per call.
+_current = None
+
+# the methods timed per step by instrument, with the name of the object they belong to
+POLICY_METHODS = ('select_action', 'update', 'update_batch', 'prefetch')
+ENVIRONMENT_METHODS = ('act', 'prefetch')
+
+
+class Timings:
+    ''' Seconds and number of calls per phase, e.g. 'policy.select_action' or 'savefig', and simulated steps and
+    seconds per (policy, param_value) configuration '''
+
+    def __init__(self):
+        self.seconds = {}
+        self.calls = {}
+        self.steps = {}
+        self.step_seconds = {}
+
+    def add(self, phase, seconds, calls=1):
+        self.seconds[phase] = self.seconds.get(phase, 0.0) + seconds
+        self.calls[phase] = self.calls.get(phase, 0) + calls
+
+    def add_steps(self, config, steps, seconds):
+        ''' records that steps timesteps of a configuration, summed over its repetitions, took seconds '''
+        self.steps[config] = self.steps.get(config, 0) + steps
+        self.step_seconds[config] = self.step_seconds.get(config, 0.0) + seconds
+
+    def merge(self, other):
+        ''' adds the timings of another Timings, e.g. one returned by a worker process '''
+        for phase in other.seconds:
+            self.add(phase, other.seconds[phase], other.calls[phase])
+        for config in other.steps:
+            self.add_steps(config, other.steps[config], other.step_seconds[config])
+        return self
+
+    def steps_per_second(self):
+        ''' returns per configuration the simulated timesteps per second '''
+        return {config: self.steps[config] / max(self.step_seconds[config], 1e-12) for config in self.steps}
+
+    def report(self):
+        ''' returns a table with the time per phase, and the steps per second per configuration '''
+        lines = ["{:<28} {:>10} {:>10} {:>12}".format('phase', 'calls', 'seconds', 'us per call')]
+        for phase in sorted(self.seconds, key=self.seconds.get, reverse=True):
+            lines.append("{:<28} {:>10} {:>10.3f} {:>12.2f}".format(phase, self.calls[phase], self.seconds[phase],
+                                                                    1e6 * self.seconds[phase] / self.calls[phase]))
+        if self.steps:
+            lines.append("{:<28} {:>10} {:>10} {:>12}".format('configuration', 'steps', 'seconds', 'steps per s'))
+            rates = self.steps_per_second()
+            for config in sorted(self.steps, key=str):
+                lines.append("{:<28} {:>10} {:>10.3f} {:>12.0f}".format('{} {}'.format(*config), self.steps[config],
+                                                                        self.step_seconds[config], rates[config]))
+        return '\n'.join(lines)
+
+
+def current_timings():
+    ''' returns the Timings that instrumentation records into, None while it is off '''
+    return _current
+
+
+@contextmanager
+def instrumented(timings=None):
+    """
+    Record timings while the block runs, e.g. around run_sweep. Work units that run_sweep gives to worker processes
+    report their timings back to this process, plots rendered by a PlotPool worker are not timed.
+
+    :param timings: The Timings to record into (default is None, a new one)
+    :returns timings: The Timings, as the target of the with statement
+    """
+    global _current
+    previous = _current
+    _current = Timings() if timings is None else timings
+    try:
+        yield _current
+    finally:
+        _current = previous
+
+
+def timed(phase):
+    ''' decorator that records the calls of a function as phase while instrumentation is on '''
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if _current is None:
+                return function(*args, **kwargs)
+            timings = _current
+            started = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                timings.add(phase, time.perf_counter() - started)
+        return wrapper
+    return decorator
+
+
+class _Timed:
+    ''' Stands in for a policy or environment, timing the calls of some of its methods and passing everything else
+    on to it '''
+
+    def __init__(self, obj, name, methods, timings):
+        self._obj = obj
+        for method in methods:
+            if hasattr(obj, method):
+                setattr(self, method, _timed_method(getattr(obj, method), '{}.{}'.format(name, method), timings))
+
+    def __getattr__(self, attribute):
+        return getattr(self._obj, attribute)
+
+
+def _timed_method(method, phase, timings):
+    @functools.wraps(method)
+    def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return method(*args, **kwargs)
+        finally:
+            timings.add(phase, time.perf_counter() - started)
+    return wrapper
+
+
+def instrument(pi, env):
+    """
+    Time the per-step methods of a policy and an environment while instrumentation is on
+
+    :returns (pi, env): Stand-ins that record into the current Timings, or pi and env themselves while it is off
+    """
+    if _current is None:
+        return pi, env
+    return _Timed(pi, 'policy', POLICY_METHODS, _current), _Timed(env, 'environment', ENVIRONMENT_METHODS, _current)
+
+
+def profile_configuration(path, policy='egreedy', param_value=0.1, n_actions=10, n_timesteps=1000, n_repetitions=100,
+                          backend='numpy', **kwargs):
+    """
+    Profile the simulation of one configuration with cProfile and dump the statistics, which pstats, snakeviz or
+    flameprof (for a flame graph) can read
+
+    :param path: Path of the .prof file
+    :param kwargs: Further arguments of run_repetitions_stats, e.g. seed or environment
+    :returns stats: The LearningCurveStats of the profiled run
+    """
+    from BanditExperiment import run_repetitions_stats # BanditExperiment instruments itself with this module
+
+    profiler = cProfile.Profile()
+    stats = profiler.runcall(run_repetitions_stats, n_actions, n_timesteps, n_repetitions, param_value=param_value,
+                             policy=policy, backend=backend, **kwargs)
+    profiler.dump_stats(path)
+    return stats
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Time the phases of one configuration, or dump a cProfile of it.")
+    parser.add_argument('--policy', default='egreedy')
+    parser.add_argument('--param-value', type=float, default=0.1)
+    parser.add_argument('--n-actions', type=int, default=10)
+    parser.add_argument('--n-timesteps', type=int, default=1000)
+    parser.add_argument('--n-repetitions', type=int, default=100)
+    parser.add_argument('--backend', default='numpy', choices=['numpy', 'python', 'numba', 'indexed'])
+    parser.add_argument('--environment', default='stationary')
+    parser.add_argument('--seed', type=int, default=2022)
+    parser.add_argument('--profile', help="write a cProfile dump to this path instead of timing the phases")
+    args = parser.parse_args(argv)
+
+    kwargs = dict(policy=args.policy, param_value=args.param_value, n_actions=args.n_actions,
+                  n_timesteps=args.n_timesteps, n_repetitions=args.n_repetitions, backend=args.backend,
+                  environment=args.environment, seed=args.seed)
+    if args.profile is not None:
+        profile_configuration(args.profile, **kwargs)
+        print("Wrote {}, e.g. view it with python -m pstats {}".format(args.profile, args.profile))
+        return 0
+    from BanditExperiment import run_repetitions_stats
+    # run as a script this module is __main__, while the experiment code records into the imported BanditProfile
+    from BanditProfile import instrumented
+
+    with instrumented() as timings:
+        run_repetitions_stats(**kwargs)
+    print(timings.report())
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Seeded random number streams
+Practical for course 'Reinforcement Learning',
+Bachelor AI, Leiden University, The Netherlands
+2022
+By Luca Goemans & Sayf El Kaddouri
+"""
+import numpy as np
+
+# stream roles within a repetition, every repetition gets one independent stream per role
+ENV_STREAM = 0
+POLICY_STREAM = 1
+
+# upper bound on the number of pre-sampled values a BlockSampler holds when no chunk_size is given
+BLOCK_ELEMENTS = 2**20
+
+
+def as_seed_sequence(seed=None):
+    ''' seed: None, an int, a SeedSequence or a Generator
+    returns a SeedSequence, a Generator is consumed to derive fresh entropy '''
+    if isinstance(seed, np.random.SeedSequence):
+        return seed
+    if isinstance(seed, np.random.Generator):
+        return np.random.SeedSequence(seed.integers(0, 2**63, size=4).tolist())
+    return np.random.SeedSequence(seed)
+
+
+def make_rng(seed=None):
+    ''' seed: None, an int, a SeedSequence or a Generator
+    returns a PCG64 Generator, a Generator is passed through unchanged '''
+    if isinstance(seed, np.random.Generator):
+        return seed
+    return np.random.Generator(np.random.PCG64(as_seed_sequence(seed)))
+
+
+def repetition_rngs(seed, n_repetitions, first_repetition=0, role=ENV_STREAM):
+    ''' returns one Generator per repetition in [first_repetition, first_repetition + n_repetitions)
+    The stream of repetition i only depends on the seed, i and the role, so a repetition draws the
+    same numbers no matter how the repetitions are batched or split over workers '''
+    seed_seq = as_seed_sequence(seed)
+    return [np.random.Generator(np.random.PCG64(np.random.SeedSequence(
+                seed_seq.entropy, spawn_key=tuple(seed_seq.spawn_key) + (rep, role))))
+            for rep in range(first_repetition, first_repetition + n_repetitions)]
+
+
+def get_rng_states(rngs):
+    ''' returns an (n_rngs, 6) uint64 array with the PCG64 state of every Generator, see set_rng_states '''
+    states = np.empty((len(rngs), 6), dtype=np.uint64)
+    for i, rng in enumerate(rngs):
+        state = rng.bit_generator.state
+        value, inc = state['state']['state'], state['state']['inc']
+        states[i] = [value >> 64, value & 0xFFFFFFFFFFFFFFFF, inc >> 64, inc & 0xFFFFFFFFFFFFFFFF,
+                     state['has_uint32'], state['uinteger']]
+    return states
+
+
+def set_rng_states(rngs, states):
+    ''' restores the PCG64 states returned by get_rng_states, one row per Generator '''
+    for rng, row in zip(rngs, states):
+        value_hi, value_lo, inc_hi, inc_lo, has_uint32, uinteger = (int(x) for x in row)
+        rng.bit_generator.state = {'bit_generator': 'PCG64',
+                                   'state': {'state': (value_hi << 64) | value_lo, 'inc': (inc_hi << 64) | inc_lo},
+                                   'has_uint32': has_uint32, 'uinteger': uinteger}
+
+
+def batch_rngs(rng, n_repetitions, role=ENV_STREAM):
+    ''' rng: a list with one Generator per repetition, or a seed accepted by repetition_rngs
+    returns a list with one Generator per repetition '''
+    if isinstance(rng, (list, tuple)):
+        if len(rng) != n_repetitions:
+            raise ValueError("Expected one Generator per repetition, got {} for {} repetitions".format(len(rng), n_repetitions))
+        return list(rng)
+    return repetition_rngs(rng, n_repetitions, role=role)
+
+
+class BlockSampler:
+    ''' Serves one row of random values per timestep for a batch of streams, drawing chunk_size
+    timesteps per stream at a time. Row i always comes from stream i and the values only depend on how
+    many timesteps were consumed, not on chunk_size. '''
+
+    def __init__(self, rngs, width=None, chunk_size=None, normal=False):
+        ''' rngs: one Generator per row
+        width: number of values per row and timestep, None for a single value
+        chunk_size: number of timesteps drawn at once (default is None, as many as fit in BLOCK_ELEMENTS)
+        normal: draw standard normal instead of uniform [0, 1) values '''
+        self.rngs = rngs
+        self.width = width
+        if chunk_size is None:
+            chunk_size = max(1, BLOCK_ELEMENTS // (len(rngs) * (width or 1)))
+        self.chunk_size = chunk_size
+        self.normal = normal
+        self._block = None
+        self._step = 0
+        self._reserved = 0 # timesteps announced by reserve that are not drawn yet
+
+    def prefetch(self, n_timesteps):
+        ''' draws the values of the next n_timesteps, anything left of the previous block is kept in front '''
+        size = (n_timesteps,) if self.width is None else (n_timesteps, self.width)
+        if self.normal:
+            block = np.stack([rng.standard_normal(size) for rng in self.rngs], axis=1)
+        else:
+            block = np.stack([rng.random(size) for rng in self.rngs], axis=1)
+        if self._block is not None and self._step < len(self._block):
+            block = np.concatenate([self._block[self._step:], block])
+        self._block = block
+        self._step = 0
+
+    def reserve(self, n_timesteps):
+        ''' announces that the next n_timesteps are served, they are then drawn at most chunk_size timesteps at a time
+        when needed, so no values beyond them are drawn, like prefetch(n_timesteps) without holding them at once '''
+        left = 0 if self._block is None else len(self._block) - self._step
+        self._reserved = max(0, n_timesteps - left)
+
+    def state_dict(self):
+        ''' returns the stream states and the values drawn but not yet served, with the rows on the first axis '''
+        if self._block is None:
+            shape = (len(self.rngs), 0) if self.width is None else (len(self.rngs), 0, self.width)
+            block = np.empty(shape)
+        else:
+            block = np.swapaxes(self._block[self._step:], 0, 1)
+        return {'rng_state': get_rng_states(self.rngs), 'block': block}
+
+    def load_state_dict(self, state):
+        ''' restores a state returned by state_dict '''
+        set_rng_states(self.rngs, state['rng_state'])
+        self._block = np.swapaxes(state['block'], 0, 1) if state['block'].shape[1] else None
+        self._step = 0
+        self._reserved = 0
+
+    def next(self):
+        ''' returns the values of the next timestep, shape (n_rows,) or (n_rows, width) '''
+        if self._block is None or self._step == len(self._block):
+            n_timesteps = min(self.chunk_size, self._reserved) if self._reserved else self.chunk_size
+            self._reserved -= min(n_timesteps, self._reserved)
+            self.prefetch(n_timesteps)
+        values = self._block[self._step]
+        self._step += 1
+        return values
@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Columnar results store
+Practical for course 'Reinforcement Learning',
+Bachelor AI, Leiden University, The Netherlands
+2022
+By Luca Goemans & Sayf El Kaddouri
+"""
+import json
+import os
+import shutil
+import tempfile
+import uuid
+import numpy as np
+from BanditCache import write_atomic
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results')
+
+
+class ResultStore:
+    ''' Stores every (policy, param_value, metric) curve as its own .npy file, with a small JSON index of the
+    curves. A curve is loaded as a read-only memory map, so reading one curve of a large sweep costs only the
+    pages that are touched, and adding a curve never rewrites the others. '''
+
+    def __init__(self, directory=RESULTS_DIR):
+        self.directory = directory
+        self._index_path = os.path.join(directory, 'index.json')
+        self._curves = {}
+        self._next_id = 0
+        if os.path.exists(self._index_path):
+            with open(self._index_path) as f:
+                index = json.load(f)
+            self._next_id = index['next_id']
+            for entry in index['curves']:
+                self._curves[self._key(entry['policy'], entry['param_value'], entry['metric'])] = entry
+
+    @staticmethod
+    def _key(policy, param_value, metric):
+        return (policy, float(param_value), metric)
+
+    def _write_index(self):
+        index = {'next_id': self._next_id, 'curves': list(self._curves.values())}
+        write_atomic(self._index_path, lambda f: f.write(json.dumps(index, indent=1).encode()))
+
+    def put(self, policy, param_value, metric, values):
+        ''' stores a curve, replacing an earlier curve of the same policy, param_value and metric '''
+        os.makedirs(self.directory, exist_ok=True)
+        key = self._key(policy, param_value, metric)
+        old = self._curves.get(key)
+        values = np.ascontiguousarray(values)
+        entry = {'policy': policy, 'param_value': float(param_value), 'metric': metric,
+                 'file': 'curve_{}.npy'.format(self._next_id), 'length': len(values), 'dtype': values.dtype.str,
+                 'token': uuid.uuid4().hex}
+        self._next_id += 1
+        write_atomic(os.path.join(self.directory, entry['file']), lambda f: np.save(f, values))
+        self._curves[key] = entry
+        self._write_index()
+        if old is not None:
+            os.remove(os.path.join(self.directory, old['file']))
+
+    def put_stats(self, policy, param_value, stats):
+        ''' stores the mean and standard error of a LearningCurveStats, and its metrics if they are tracked '''
+        self.put(policy, param_value, 'mean', stats.mean)
+        self.put(policy, param_value, 'std_error', stats.std_error)
+        if stats.metrics:
+            self.put(policy, param_value, 'cumulative_expected_regret', stats.cumulative_expected_regret)
+            self.put(policy, param_value, 'optimal_action_rate', stats.optimal_action_rate)
+
+    def get(self, policy, param_value, metric, mmap=True):
+        """
+        Load one curve
+
+        :param mmap: Return a read-only memory map instead of reading the whole curve (default is True)
+        :returns values: The curve
+        :raise KeyError: If the curve is not stored
+        """
+        entry = self._curves[self._key(policy, param_value, metric)]
+        return np.load(os.path.join(self.directory, entry['file']), mmap_mode='r' if mmap else None)
+
+    def curve_id(self, policy, param_value, metric):
+        ''' returns an id that changes whenever the curve is replaced, e.g. to memoize values derived from it. File
+        names are reused after clear, so the id also holds a random token drawn when the curve was stored. '''
+        entry = self._curves[self._key(policy, param_value, metric)]
+        return '{}#{}'.format(os.path.join(os.path.abspath(self.directory), entry['file']), entry.get('token', ''))
+
+    def __contains__(self, curve):
+        return self._key(*curve) in self._curves
+
+    def curves(self, policy=None, metric=None):
+        ''' returns the (policy, param_value, metric) of every stored curve, optionally of one policy or metric '''
+        return sorted(key for key in self._curves
+                      if (policy is None or key[0] == policy) and (metric is None or key[2] == metric))
+
+    def param_values(self, policy, metric='mean'):
+        ''' returns the sorted parameter values of a policy for which the metric is stored '''
+        return [param_value for _, param_value, _ in self.curves(policy, metric)]
+
+    def load(self, policy, metric='mean', param_values=None):
+        ''' returns a (len(param_values), n_timesteps) array with the curves of a policy, all of equal length
+        (default param_values is None, every stored value) '''
+        if param_values is None:
+            param_values = self.param_values(policy, metric)
+        return np.array([self.get(policy, param_value, metric) for param_value in param_values])
+
+    def clear(self):
+        ''' removes every stored curve '''
+        shutil.rmtree(self.directory, ignore_errors=True)
+        self._curves = {}
+        self._next_id = 0
+
+    def to_parquet(self, path):
+        """
+        Export every curve to one Parquet file with a row per curve, for tools outside this code base
+
+        :param path: Path of the Parquet file
+        :raise ValueError: If pyarrow is not installed
+        """
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError: # pyarrow is optional, the .npy files are the store itself
+            raise ValueError("Export error, writing Parquet needs pyarrow, install it or read the .npy files")
+        keys = self.curves()
+        curves = [np.asarray(self.get(*key), dtype=float) for key in keys]
+        offsets = np.concatenate([[0], np.cumsum([len(curve) for curve in curves])]).astype(np.int64)
+        values = np.concatenate(curves) if curves else np.zeros(0)
+        table = pa.table({'policy': [key[0] for key in keys], 'param_value': [key[1] for key in keys],
+                          'metric': [key[2] for key in keys],
+                          'values': pa.LargeListArray.from_arrays(pa.array(offsets), pa.array(values))})
+        pq.write_table(table, path)
+
+
+def test():
+    from BanditSweep import run_sweep
+
+    directory = tempfile.mkdtemp()
+    store = ResultStore(directory)
+    configs = [('egreedy', 0.05), ('egreedy', 0.1), ('ucb', 0.25)]
+    all_stats = run_sweep(configs, n_actions=10, n_timesteps=500, n_repetitions=100, n_workers=0, seed=1,
+                          return_stats=True)
+    for (policy, param_value), stats in zip(configs, all_stats):
+        store.put_stats(policy, param_value, stats)
+
+    reopened = ResultStore(directory)
+    print("Stored curves: {}".format(reopened.curves(metric='mean')))
+    curve = reopened.get('egreedy', 0.1, 'mean')
+    print("Memory mapped: {}, identical: {}".format(isinstance(curve, np.memmap), np.array_equal(curve, all_stats[1].mean)))
+    print("egreedy curves: {}".format(reopened.load('egreedy').shape))
+
+    # curves stored again after clear reuse their file names, but must not hit the memoized smoothing of the old ones
+    from BanditPlots import smoothed_curve
+    from Helper import smooth
+    before = smoothed_curve(reopened, 'ucb', 0.25, 31)
+    store.clear()
+    all_stats = run_sweep(configs, n_actions=10, n_timesteps=500, n_repetitions=100, n_workers=0, seed=2,
+                          return_stats=True)
+    for (policy, param_value), stats in zip(configs, all_stats):
+        store.put_stats(policy, param_value, stats)
+    after = smoothed_curve(ResultStore(directory), 'ucb', 0.25, 31)
+    print("Smoothed again after clear: {}".format(not np.array_equal(before, after) and
+                                                  np.array_equal(after, smooth(all_stats[2].mean, 31))))
+    shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    test()
@@ -0,0 +1,201 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Command-line experiment runner
+Practical for course 'Reinforcement Learning',
+Bachelor AI, Leiden University, The Netherlands
+2022
+By Luca Goemans & Sayf El Kaddouri
+"""
+import argparse
+import json
+import os
+import shutil
+import sys
+import numpy as np
+from BanditCache import ResultCache, write_atomic
+from BanditPlots import PlotPool, plot_learning_curve, plot_optimal_hyperparameters, plot_parameter_comparison, \
+    plot_policy_comparison
+from BanditResults import ResultStore
+from BanditSweep import REPETITION_CHUNK, run_sweep
+
+# the settings and grids of the assignment, every key can be overridden by a config file or a command-line option
+DEFAULT_CONFIG = {
+    'n_actions': 10,
+    'n_timesteps': 1000,
+    'n_repetitions': 500,
+    'seed': 2022,
+    'backend': 'numpy',
+    'environment': 'stationary',
+    'feedback_delay': 1,
+    'n_workers': None,
+    'chunk_size': REPETITION_CHUNK,
+    'metrics': False,
+    'compact': False,
+    'output': 'results',
+    'plots': True,
+    'smoothing_window': 31,
+    'sweeps': {
+        'egreedy': [0.01, 0.05, 0.1, 0.25],
+        'oi': [0.1, 0.5, 1.0, 2.0],
+        'ucb': [0.01, 0.05, 0.1, 0.25, 0.5, 1.0],
+    },
+}
+
+# keys that may differ between a run and its resumption. They do not change the results of a work unit, so e.g. a
+# run with fewer sweeps reuses the units it shares with the earlier run
+RESUMABLE_KEYS = ('n_workers', 'output', 'sweeps', 'plots', 'smoothing_window')
+
+
+def load_config(path):
+    """
+    Read a config file, JSON or YAML depending on the extension
+
+    :param path: Path of a .json, .yaml or .yml file with a dict of DEFAULT_CONFIG keys
+    :returns config: The dict in the file
+    :raise ValueError: If the file is YAML and PyYAML is not installed, or it holds an unknown key
+    """
+    with open(path) as f:
+        if path.endswith(('.yaml', '.yml')):
+            try:
+                import yaml
+            except ImportError: # PyYAML is optional, JSON configs work without it
+                raise ValueError("Config error, reading '{}' needs PyYAML, install it or use a JSON config".format(path))
+            config = yaml.safe_load(f) or {}
+        else:
+            config = json.load(f)
+    unknown = set(config) - set(DEFAULT_CONFIG)
+    if unknown:
+        raise ValueError("Config error, unknown keys {}, the following are allowed: {} ".format(
+            sorted(unknown), ', '.join("'{}'".format(name) for name in DEFAULT_CONFIG)))
+    return config
+
+
+def resolve_config(config, previous=None):
+    """
+    Fill in the defaults, and take over the seed of the run that is resumed if none is given
+
+    :param config: A dict with some of the DEFAULT_CONFIG keys
+    :param previous: The resolved config of an earlier run in the same output directory (default is None)
+    :returns config: The resolved config, with an integer seed
+    """
+    resolved = {**DEFAULT_CONFIG, **config}
+    if resolved['seed'] is None:
+        # a random seed is drawn once and stored, so a resumed run continues with the same repetitions
+        resolved['seed'] = previous['seed'] if previous is not None else int(np.random.SeedSequence().entropy)
+    return resolved
+
+
+def run(config, restart=False, log=print):
+    """
+    Run every sweep of a config. Each finished work unit is stored in output/units right away, and the curves of
+    each finished sweep in the ResultStore output/curves, so a run that is killed continues from its last finished
+    unit when it is started again with the same config. With plots, the PNGs of a finished sweep are rendered to
+    output by a background process while the next sweep runs.
+
+    :param config: A config dict, see DEFAULT_CONFIG
+    :param restart: Throw away the results of an earlier run in the output directory (default is False)
+    :param log: Called with every progress message (default is print)
+    :returns results: A dict with per policy a dict of (len(values), n_timesteps) arrays, one per stored metric
+    :raise ValueError: If the output directory holds a run with different settings and restart is False
+    """
+    output = config.get('output', DEFAULT_CONFIG['output'])
+    run_path = os.path.join(output, 'run.json')
+    if restart:
+        shutil.rmtree(output, ignore_errors=True)
+    previous = None
+    if os.path.exists(run_path):
+        with open(run_path) as f:
+            previous = json.load(f)
+    config = resolve_config(config, previous)
+    if previous is not None:
+        changed = sorted(name for name in config if name not in RESUMABLE_KEYS and config[name] != previous.get(name))
+        if changed:
+            raise ValueError("Resume error, '{}' holds a run with different {}, pass another output directory or "
+                             "restart".format(output, ', '.join(changed)))
+        log("Resuming the run in '{}'".format(output))
+    os.makedirs(output, exist_ok=True)
+    write_atomic(run_path, lambda f: f.write(json.dumps(config, indent=2).encode()))
+
+    # the units are only ever needed by this run, so they are never evicted
+    cache = ResultCache(os.path.join(output, 'units'), max_bytes=float('inf'))
+    store = ResultStore(os.path.join(output, 'curves'))
+    results = {}
+    with PlotPool(n_workers=1 if config['plots'] else 0) as pool:
+        for policy, values in config['sweeps'].items():
+            results[policy] = _run_policy_sweep(config, policy, values, cache, store, log)
+            if config['plots']:
+                pool.submit(plot_policy_comparison, store.directory, policy, config['smoothing_window'], output)
+                pool.submit(plot_learning_curve, store.directory, policy, values[-1], config['smoothing_window'],
+                            output)
+        if config['plots']:
+            policies = list(config['sweeps'])
+            pool.submit(plot_parameter_comparison, store.directory, policies, output)
+            pool.submit(plot_optimal_hyperparameters, store.directory, policies, config['smoothing_window'], output)
+    return results
+
+
+def _run_policy_sweep(config, policy, values, cache, store, log):
+    ''' runs the sweep of one policy, stores its curves and returns them per metric '''
+    progress = lambda n_done, n_units: log("{}: {} of {} work units done".format(policy, n_done, n_units))
+    all_stats = run_sweep([(policy, value) for value in values], config['n_actions'], config['n_timesteps'],
+                          config['n_repetitions'], n_workers=config['n_workers'], seed=config['seed'],
+                          backend=config['backend'], chunk_size=config['chunk_size'], cache=cache,
+                          return_stats=True, metrics=config['metrics'], compact=config['compact'],
+                          environment=config['environment'], feedback_delay=config['feedback_delay'],
+                          progress=progress)
+    for value, stats in zip(values, all_stats):
+        store.put_stats(policy, value, stats)
+    results = {metric: store.load(policy, metric, values)
+               for metric in sorted({key[2] for key in store.curves(policy)})}
+    best = np.argmax(results['mean'].mean(axis=1))
+    log("{}: best value {} with average reward {:.4f}".format(policy, values[best], results['mean'][best].mean()))
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run bandit hyperparameter sweeps from a JSON or YAML config. A "
+                                     "killed run continues from its last finished work unit when started again.")
+    parser.add_argument('--config', help="JSON or YAML file with any of the keys of --print-config")
+    parser.add_argument('--policies', nargs='+', help="only run the sweeps of these policies")
+    parser.add_argument('--n-actions', type=int)
+    parser.add_argument('--n-timesteps', type=int)
+    parser.add_argument('--n-repetitions', type=int)
+    parser.add_argument('--seed', type=int)
+    parser.add_argument('--backend', choices=['numpy', 'python', 'numba', 'indexed'])
+    parser.add_argument('--environment')
+    parser.add_argument('--feedback-delay', type=int, help="learn the rewards in bulk every this many timesteps")
+    parser.add_argument('--workers', type=int, dest='n_workers', help="worker processes, 0 runs serially")
+    parser.add_argument('--metrics', action='store_true', default=None, help="also store regret and optimal action rate")
+    parser.add_argument('--compact', action='store_true', default=None, help="use float32 and int32 arrays")
+    parser.add_argument('--output', help="directory for the results and the finished work units")
+    parser.add_argument('--no-plots', action='store_false', default=None, dest='plots', help="do not render the PNGs")
+    parser.add_argument('--restart', action='store_true', help="discard an earlier run in the output directory")
+    parser.add_argument('--print-config', action='store_true', help="print the resolved config as JSON and exit")
+    args = parser.parse_args(argv)
+
+    config = load_config(args.config) if args.config is not None else {}
+    for name in ('n_actions', 'n_timesteps', 'n_repetitions', 'seed', 'backend', 'environment', 'feedback_delay',
+                 'n_workers', 'metrics', 'compact', 'output', 'plots'):
+        if getattr(args, name) is not None:
+            config[name] = getattr(args, name)
+    if args.policies is not None:
+        sweeps = config.get('sweeps', DEFAULT_CONFIG['sweeps'])
+        missing = [policy for policy in args.policies if policy not in sweeps]
+        if missing:
+            parser.error("no sweep for {} in the config".format(', '.join(missing)))
+        config['sweeps'] = {policy: sweeps[policy] for policy in args.policies}
+
+    if args.print_config:
+        print(json.dumps(resolve_config(config), indent=2))
+        return 0
+    try:
+        run(config, restart=args.restart)
+    except ValueError as error:
+        print(error, file=sys.stderr)
+        return 2
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,197 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Adaptive hyperparameter search
+Practical for course 'Reinforcement Learning',
+Bachelor AI, Leiden University, The Netherlands
+2022
+By Luca Goemans & Sayf El Kaddouri
+"""
+import math
+import numpy as np
+from BanditRandom import as_seed_sequence
+from BanditSweep import run_sweep
+
+# spawn key of the stream the candidate values are drawn from, repetition streams use (repetition, role) keys
+SEARCH_STREAM = (2**32 - 1,)
+
+
+class ContinuousRange:
+    ''' A continuous hyperparameter range [low, high], searched on a log scale when log=True '''
+    __slots__ = ('low', 'high', 'log')
+
+    def __init__(self, low, high, log=False):
+        self.low = low
+        self.high = high
+        self.log = log
+
+    def sample(self, n_values, rng):
+        ''' returns n_values increasing values, one uniform draw from each of n_values equally wide strata '''
+        u = (np.arange(n_values) + rng.random(n_values)) / n_values
+        if self.log:
+            return np.exp(np.log(self.low) + u * (np.log(self.high) - np.log(self.low)))
+        return self.low + u * (self.high - self.low)
+
+
+# ranges that cover the grids of experiment()
+SEARCH_SPACES = {'egreedy': ContinuousRange(0.001, 0.5, log=True),
+                 'oi': ContinuousRange(0.1, 2.0),
+                 'ucb': ContinuousRange(0.005, 2.0, log=True)}
+
+
+class SearchResult:
+    ''' Outcome of adaptive_search: the score of every configuration, how many repetitions it got, and the best one '''
+    __slots__ = ('configs', 'scores', 'std_errors', 'n_repetitions', 'best', 'n_steps', 'full_steps')
+
+    def __init__(self, configs, scores, std_errors, n_repetitions, best, n_steps, full_steps):
+        self.configs = configs
+        self.scores = scores
+        self.std_errors = std_errors
+        self.n_repetitions = n_repetitions
+        self.best = best
+        self.n_steps = n_steps
+        self.full_steps = full_steps
+
+    @property
+    def best_config(self):
+        return self.configs[self.best]
+
+    @property
+    def budget_fraction(self):
+        ''' simulated steps as a fraction of the steps of running every configuration for max_repetitions '''
+        return self.n_steps / self.full_steps
+
+
+def adaptive_search(configs, n_actions, n_timesteps, max_repetitions=500, batch_size=25, min_batches=3, z=2.0,
+                    eta=None, n_workers=None, seed=None, backend='numpy', cache=None, environment='stationary'):
+    """
+    Find the (policy, param_value) configuration with the highest average reward by racing: all remaining
+    configurations are evaluated on the next batch of repetitions, after which every configuration whose batch
+    scores are worse than those of the leader by more than z standard errors is dropped. Repetition i of every
+    configuration faces the same bandit problem, so the scores are compared as paired differences, which
+    separates configurations with far fewer repetitions than comparing their means. With eta, the search also
+    does successive halving: after min_batches, min_batches * eta, ... batches only the best 1 / eta of the
+    remaining configurations go on.
+
+    :param configs: A list of (policy, param_value) tuples
+    :param n_actions: Cardinality of the action space
+    :param n_timesteps: Number of timesteps per repetition (experiment trial)
+    :param max_repetitions: Repetitions a configuration gets if it is never dropped, rounded down to whole batches
+     (default is 500)
+    :param batch_size: Number of repetitions added per round (default is 25)
+    :param min_batches: Number of batches before anything is dropped, at least 2 to estimate the standard error of
+     a paired difference (default is 3)
+    :param z: Number of standard errors by which a configuration has to trail the leader to be dropped
+     (default is 2.0)
+    :param eta: Halving rate above 1, None only drops configurations that are statistically worse (default is None)
+    :param n_workers: Number of worker processes per round, see run_sweep (default is os.cpu_count())
+    :param seed: Int or SeedSequence, the same seed gives the same search (default is None, random)
+    :param backend: Backend passed on to run_repetitions (default is 'numpy')
+    :param cache: A ResultCache for the batches, so a repeated search only simulates new batches
+     (default is None, no caching)
+    :param environment: The name of a registered environment (default is 'stationary')
+    :returns result: A SearchResult
+    :raise ValueError: If max_repetitions is less than one batch, min_batches is below 2 or eta is not above 1
+    """
+    if max_repetitions < batch_size:
+        raise ValueError("Search error, please pass a max_repetitions of at least one batch of {}, got {}".format(
+            batch_size, max_repetitions))
+    if min_batches < 2:
+        raise ValueError("Search error, please pass a min_batches of at least 2, the standard error of the scores "
+                         "needs two batches, got {}".format(min_batches))
+    if eta is not None and eta <= 1:
+        raise ValueError("Search error, eta is the halving rate and has to be above 1, got {}".format(eta))
+    seed = as_seed_sequence(seed)
+    n_batches = max_repetitions // batch_size
+    batch_scores = [[] for _ in configs]
+    remaining = list(range(len(configs)))
+    n_steps = 0
+    next_rung = min_batches
+    for batch in range(n_batches):
+        stats = run_sweep([configs[i] for i in remaining], n_actions, n_timesteps, batch_size, n_workers=n_workers,
+                          seed=seed, backend=backend, chunk_size=batch_size, cache=cache, return_stats=True,
+                          environment=environment, first_repetition=batch * batch_size)
+        for i, config_stats in zip(remaining, stats):
+            batch_scores[i].append(config_stats.mean.mean())
+        n_steps += len(remaining) * batch_size * n_timesteps
+        if batch + 1 < min_batches or len(remaining) == 1:
+            continue
+        remaining = race(remaining, batch_scores, z)
+        if eta is not None and batch + 1 >= next_rung:
+            ranked = sorted(remaining, key=lambda i: np.mean(batch_scores[i]), reverse=True)
+            remaining = sorted(ranked[:math.ceil(len(ranked) / eta)])
+            # whole batches, and at least one more, so a fractional eta such as 1.5 still halves
+            next_rung = max(math.ceil(next_rung * eta), batch + 2)
+        if len(remaining) == 1:
+            break
+
+    scores = np.array([np.mean(scores) for scores in batch_scores])
+    std_errors = np.array([np.std(scores, ddof=1) / np.sqrt(len(scores)) if len(scores) > 1 else np.nan
+                           for scores in batch_scores])
+    n_repetitions = np.array([len(scores) * batch_size for scores in batch_scores])
+    best = max(remaining, key=lambda i: scores[i])
+    return SearchResult(configs, scores, std_errors, n_repetitions, best, n_steps,
+                        len(configs) * n_batches * batch_size * n_timesteps)
+
+
+def race(remaining, batch_scores, z):
+    """
+    Drop the configurations that are statistically worse than the leader
+
+    :param remaining: Indices of the configurations still in the race, which all have the same batches
+    :param batch_scores: Per configuration a list with the average reward of each batch
+    :param z: Number of standard errors of the paired difference by which a configuration has to trail the leader
+    :returns remaining: The indices of the configurations that stay in the race
+    """
+    leader = max(remaining, key=lambda i: np.mean(batch_scores[i]))
+    kept = []
+    for i in remaining:
+        difference = np.array(batch_scores[leader]) - np.array(batch_scores[i])
+        std_error = np.std(difference, ddof=1) / np.sqrt(len(difference))
+        if i == leader or difference.mean() <= z * std_error:
+            kept.append(i)
+    return kept
+
+
+def search_hyperparameter(policy, space=None, n_values=8, seed=None, **kwargs):
+    """
+    Search the hyperparameter of one policy over a list of values or a continuous range
+
+    :param policy: The name of a registered policy
+    :param space: A list of values, or a ContinuousRange from which n_values stratified values are drawn
+     (default is None, SEARCH_SPACES[policy])
+    :param n_values: Number of values drawn from a ContinuousRange (default is 8)
+    :param seed: Int or SeedSequence, used for the values and the repetitions (default is None, random)
+    :param kwargs: The other arguments of adaptive_search, e.g. n_actions and n_timesteps
+    :returns result: A SearchResult, result.best_config[1] is the best value
+    """
+    seed = as_seed_sequence(seed)
+    if space is None:
+        space = SEARCH_SPACES[policy]
+    if isinstance(space, ContinuousRange):
+        rng = np.random.default_rng(np.random.SeedSequence(seed.entropy,
+                                                           spawn_key=tuple(seed.spawn_key) + SEARCH_STREAM))
+        space = [float(value) for value in space.sample(n_values, rng)]
+    return adaptive_search([(policy, value) for value in space], seed=seed, **kwargs)
+
+
+def test():
+    n_actions, n_timesteps, n_repetitions = 10, 1000, 500
+    epsilons = [0.01, 0.05, 0.1, 0.25]
+    configs = [('egreedy', epsilon) for epsilon in epsilons]
+    full = run_sweep(configs, n_actions, n_timesteps, n_repetitions, n_workers=0, seed=2022)
+    print("Best epsilon of the full grid: {}".format(epsilons[np.argmax(full.mean(axis=1))]))
+    result = adaptive_search(configs, n_actions, n_timesteps, max_repetitions=n_repetitions, n_workers=0, seed=2022)
+    print("Best epsilon of the adaptive search: {} with {:.0%} of the steps".format(result.best_config[1],
+                                                                                   result.budget_fraction))
+
+    result = search_hyperparameter('ucb', n_actions=n_actions, n_timesteps=n_timesteps,
+                                   max_repetitions=n_repetitions, n_workers=0, seed=2022)
+    for (policy, c), score, n in zip(result.configs, result.scores, result.n_repetitions):
+        print("c = {:.4f}: average reward {:.4f} over {} repetitions".format(c, score, n))
+    print("Best c value of the continuous search: {:.4f} with {:.0%} of the steps".format(result.best_config[1],
+                                                                                       result.budget_fraction))
+
+
+if __name__ == '__main__':
+    test()
@@ -0,0 +1,237 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Asynchronous policy service
+Practical for course 'Reinforcement Learning',
+Bachelor AI, Leiden University, The Netherlands
+2022
+By Luca Goemans & Sayf El Kaddouri
+"""
+import asyncio
+import time
+import numpy as np
+from BanditEnvironment import BanditEnvironment
+from BanditPolicies import make_policy
+from BanditRandom import ENV_STREAM, POLICY_STREAM, repetition_rngs
+
+# latencies of this many most recent decisions are kept for the percentiles
+LATENCY_WINDOW = 100000
+
+
+class PolicyService:
+    ''' Serves the decisions and updates of many concurrent asyncio clients from one policy. Requests that arrive
+    within max_delay seconds after the first waiting one, up to max_batch of them, are handled together: all updates
+    of the batch with one update_batch of the policy, then all decisions with one select_actions, so a decision
+    always sees the rewards of the updates that were waiting with it. A request that is cancelled before its batch is
+    handled, e.g. by a timeout, is left out of the batch. Only use the policy through the service while it runs. '''
+
+    def __init__(self, policy, max_batch=256, max_delay=0.001):
+        """
+        :param policy: A policy of BanditPolicies, select_actions and update_batch are used when it has them
+        :param max_batch: Maximum number of requests handled together (default is 256)
+        :param max_delay: Seconds the first request of a batch waits for others to join it (default is 0.001)
+        """
+        self.policy = policy
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.t = 0 # decisions served, the timestep of the next decision
+        self.n_updates = 0
+        self.n_batches = 0
+        self._latencies = np.zeros(LATENCY_WINDOW)
+        self._queue = None
+        self._task = None
+        self._started = None
+
+    async def start(self):
+        ''' starts handling requests in a task of the running event loop '''
+        self._queue = asyncio.Queue()
+        self._started = time.perf_counter()
+        self._task = asyncio.ensure_future(self._serve())
+
+    async def stop(self):
+        ''' handles the requests that are still waiting and stops '''
+        if not self._task.done():
+            await self._queue.put(None)
+        await self._task
+
+    async def __aenter__(self):
+        await self.start()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.stop()
+
+    async def select_action(self):
+        ''' returns the action chosen by the policy '''
+        self._check_running()
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put(('select', future, time.perf_counter()))
+        return await future
+
+    async def update(self, a, r):
+        """
+        Returns once the policy has learned reward r of action a
+
+        :raise ValueError: If a is not one of the actions of the policy
+        """
+        self._check_running()
+        if int(a) != a or not 0 <= a < self.policy.n_actions:
+            raise ValueError("Service error, action {} is not one of the {} actions of the policy".format(
+                a, self.policy.n_actions))
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put(('update', future, a, r))
+        await future
+
+    def _check_running(self):
+        ''' raises if no serving task would handle a request '''
+        if self._task is None or self._task.done():
+            raise RuntimeError("Service error, the service is not running, please start it first")
+
+    async def _serve(self):
+        stopping = False
+        while not stopping:
+            batch = [await self._queue.get()]
+            if self._queue.qsize() < self.max_batch - 1 and batch[0] is not None:
+                await asyncio.sleep(self.max_delay)
+            while len(batch) < self.max_batch and not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+            stopping = None in batch
+            self._handle_safely([request for request in batch if request is not None])
+        # requests that were queued behind the stop request
+        while not self._queue.empty():
+            self._handle_safely([self._queue.get_nowait()])
+
+    def _handle_safely(self, batch):
+        ''' handles a batch, an error is raised to the requests of the batch that were not answered yet and the
+        service goes on with the next batch '''
+        try:
+            self._handle(batch)
+        except Exception as error:
+            for request in batch:
+                if not request[1].done():
+                    request[1].set_exception(error)
+
+    def _handle(self, batch):
+        # cancelled requests are skipped, so they neither change the policy nor fail the others
+        batch = [request for request in batch if not request[1].done()]
+        updates = [request for request in batch if request[0] == 'update']
+        selects = [request for request in batch if request[0] == 'select']
+        if updates:
+            actions = np.array([request[2] for request in updates])
+            rewards = np.array([request[3] for request in updates], dtype=float)
+            if hasattr(self.policy, 'update_batch'):
+                self.policy.update_batch(actions, rewards)
+            else:
+                for a, r in zip(actions, rewards):
+                    self.policy.update(a, r)
+            self.n_updates += len(updates)
+            for request in updates:
+                request[1].set_result(None)
+        if selects:
+            if hasattr(self.policy, 'select_actions'):
+                actions = self.policy.select_actions(len(selects), t=self.t)
+            else:
+                actions = [self.policy.select_action(t=self.t + i) for i in range(len(selects))]
+            now = time.perf_counter()
+            for request, a in zip(selects, actions):
+                self._latencies[self.t % LATENCY_WINDOW] = now - request[2]
+                self.t += 1
+                request[1].set_result(int(a))
+        self.n_batches += 1
+
+    def stats(self):
+        """
+        Counters of the service so far
+
+        :returns stats: A dict with the number of decisions, updates and batches, the mean batch size, the p50 and
+         p99 decision latency in seconds, and the decisions per second since start
+        """
+        latencies = self._latencies[:min(self.t, LATENCY_WINDOW)]
+        elapsed = time.perf_counter() - self._started if self._started is not None else np.nan
+        return {'decisions': self.t, 'updates': self.n_updates, 'batches': self.n_batches,
+                'mean_batch_size': (self.t + self.n_updates) / max(self.n_batches, 1),
+                'p50_latency': np.percentile(latencies, 50) if self.t else np.nan,
+                'p99_latency': np.percentile(latencies, 99) if self.t else np.nan,
+                'throughput': self.t / elapsed}
+
+
+async def generate_load(service, env, n_clients=100, n_requests=100, think_time=0.0):
+    """
+    Simulate clients that each choose an action, observe its reward in env and report it, n_requests times
+
+    :param service: A started PolicyService
+    :param env: A BanditEnvironment the clients act in
+    :param n_clients: Number of concurrent clients (default is 100)
+    :param n_requests: Number of decisions per client (default is 100)
+    :param think_time: Seconds a client waits between observing a reward and reporting it (default is 0.0)
+    :returns rewards: Total reward per client
+    """
+    async def client():
+        total = 0.0
+        for _ in range(n_requests):
+            a = await service.select_action()
+            r = env.act(a)
+            if think_time:
+                await asyncio.sleep(think_time)
+            await service.update(a, r)
+            total += r
+        return total
+
+    return await asyncio.gather(*[client() for _ in range(n_clients)])
+
+
+async def load_test(policy='egreedy', param_value=0.1, n_actions=10, n_clients=100, n_requests=100, max_batch=256,
+                    max_delay=0.001, seed=None):
+    """
+    Run generate_load against a PolicyService around a new policy
+
+    :param policy: The name of a registered policy (default is 'egreedy')
+    :param param_value: The hyperparameter of the policy (default is 0.1)
+    :param seed: Seed of the environment and the policy (default is None, random)
+    :returns (stats, average_reward): The stats of the service and the average reward per decision
+    """
+    env = BanditEnvironment(n_actions, rng=repetition_rngs(seed, 1, role=ENV_STREAM)[0])
+    pi = make_policy(policy, n_actions, param_value, rng=repetition_rngs(seed, 1, role=POLICY_STREAM)[0])
+    async with PolicyService(pi, max_batch=max_batch, max_delay=max_delay) as service:
+        rewards = await generate_load(service, env, n_clients, n_requests)
+        stats = service.stats()
+    return stats, sum(rewards) / (n_clients * n_requests)
+
+
+def test():
+    for max_batch in [1, 256]:
+        stats, average_reward = asyncio.run(load_test(n_clients=200, n_requests=50, max_batch=max_batch, seed=1))
+        print("max_batch = {}: {:.0f} decisions/s in batches of {:.1f}, p50 latency {:.2f} ms, p99 latency {:.2f} ms, "
+              "average reward {:.3f}".format(max_batch, stats['throughput'], stats['mean_batch_size'],
+                                             1000 * stats['p50_latency'], 1000 * stats['p99_latency'], average_reward))
+
+    async def failures():
+        service = PolicyService(make_policy('egreedy', 10, 0.1, rng=1))
+        errors = []
+        async with service:
+            for request in [service.update(42, 1.0), service.update(0, 'reward'), service.select_action()]:
+                try:
+                    await request
+                except ValueError as error:
+                    errors.append(type(error).__name__)
+        try:
+            await service.select_action()
+        except RuntimeError as error:
+            errors.append(type(error).__name__)
+        return errors
+
+    async def cancellation():
+        async with PolicyService(make_policy('egreedy', 10, 0.1, rng=1), max_delay=0.05) as service:
+            cancelled = asyncio.ensure_future(service.select_action())
+            other = asyncio.ensure_future(service.select_action())
+            await asyncio.sleep(0)
+            cancelled.cancel()
+            a = await other
+        return a, service.t
+
+    print("Invalid action, failing batch, stopped service: {}".format(asyncio.run(failures())))
+    print("Decision next to a cancelled request: action {}, decisions served {}".format(*asyncio.run(cancellation())))
+
+
+if __name__ == '__main__':
+    test()
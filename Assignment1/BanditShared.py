@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Shared-memory repetitions
+Practical for course 'Reinforcement Learning',
+Bachelor AI, Leiden University, The Netherlands
+2022
+By Luca Goemans & Sayf El Kaddouri
+"""
+import os
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+import numpy as np
+from BanditExperiment import compact_dtypes, run_repetitions_batched
+from BanditRandom import ENV_STREAM, POLICY_STREAM, as_seed_sequence, repetition_rngs
+from BanditStats import LearningCurveStats
+from BanditSweep import REPETITION_CHUNK, make_work_units
+
+# offsets of the arrays in a shared block are rounded up to this many bytes
+ALIGNMENT = 64
+
+
+class SharedArrays:
+    ''' Named NumPy arrays in one multiprocessing.shared_memory block. The process that creates them passes spec to
+    its workers, which attach to the same memory, so nothing is copied or pickled in either direction. The
+    creator unlinks the block on close, use it as a context manager. '''
+    __slots__ = ('spec', 'arrays', '_block', '_owner')
+
+    def __init__(self, shapes=None, spec=None):
+        """
+        :param shapes: Per name a (shape, dtype) tuple, to create zeroed arrays in a new block
+        :param spec: The spec of existing SharedArrays, to attach to them instead
+        """
+        self._owner = spec is None
+        if spec is None:
+            layout, size = {}, 0
+            for name, (shape, dtype) in shapes.items():
+                size = -(-size // ALIGNMENT) * ALIGNMENT
+                layout[name] = (tuple(shape), np.dtype(dtype).str, size)
+                size += int(np.prod(shape)) * np.dtype(dtype).itemsize
+            self._block = shared_memory.SharedMemory(create=True, size=max(size, 1))
+            spec = {'name': self._block.name, 'layout': layout}
+        else:
+            # workers share the resource tracker of the creator, which unlinks the block, so attaching registers
+            # nothing new with it
+            self._block = shared_memory.SharedMemory(name=spec['name'])
+        self.spec = spec
+        self.arrays = {name: np.ndarray(shape, dtype=dtype, buffer=self._block.buf, offset=offset)
+                       for name, (shape, dtype, offset) in spec['layout'].items()}
+        if self._owner:
+            for array in self.arrays.values():
+                array.fill(0)
+
+    def __getitem__(self, name):
+        return self.arrays[name]
+
+    def close(self):
+        ''' detaches from the block, and frees it if this process created it, the arrays can not be used anymore '''
+        self.arrays = {}
+        self._block.close()
+        if self._owner:
+            self._block.unlink()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def _run_shared_unit(args):
+    ''' runs one work unit in a worker, writing into its rows of the shared arrays '''
+    spec, unit_index, first_repetition, n_repetitions, n_actions, n_timesteps, param_value, policy, seed, metrics, \
+        compact, environment, feedback_delay = args
+    shared = SharedArrays(spec=spec)
+    try:
+        buffers = {name: array[unit_index] for name, array in shared.arrays.items() if name != 'means'}
+        buffers['means'] = shared['means'][first_repetition:first_repetition + n_repetitions]
+        run_repetitions_batched(n_actions, n_timesteps, n_repetitions, param_value=param_value, policy=policy,
+                                env_rngs=repetition_rngs(seed, n_repetitions, first_repetition, role=ENV_STREAM),
+                                policy_rngs=repetition_rngs(seed, n_repetitions, first_repetition, role=POLICY_STREAM),
+                                metrics=metrics, compact=compact, environment=environment,
+                                feedback_delay=feedback_delay, buffers=buffers)
+        del buffers
+    finally:
+        shared.close()
+
+
+def run_repetitions_shared(n_actions, n_timesteps, n_repetitions, param_value=0.1, policy='egreedy', n_workers=None,
+                           seed=None, chunk_size=REPETITION_CHUNK, metrics=False, compact=False,
+                           environment='stationary', feedback_delay=1, return_means=False):
+    """
+    Perform the experiment of run_repetitions with the 'numpy' backend over worker processes that share memory with
+    this one. The means of all environments and one row of per-timestep statistics per work unit live in shared
+    memory: every worker moves the means of its repetitions and writes its statistics in place, so a worker only
+    gets the settings of its unit and sends nothing back. The rows are then merged here in unit order, which
+    gives exactly the statistics of run_sweep with the same seed and chunk_size.
+
+    :param n_workers: Number of worker processes, 0 runs every unit in this process (default is os.cpu_count())
+    :param seed: Int or SeedSequence from which every repetition derives its streams (default is None, random)
+    :param chunk_size: Number of repetitions per work unit (default is REPETITION_CHUNK)
+    :param return_means: Also return the (n_repetitions, n_actions) means of the environments after the last
+     timestep (default is False)
+    :returns stats: A LearningCurveStats over the repetitions, or (stats, means) with return_means
+    """
+    seed = as_seed_sequence(seed)
+    if n_workers is None:
+        n_workers = os.cpu_count() or 1
+    units = make_work_units([(policy, param_value)], n_repetitions, chunk_size=chunk_size)
+    # one row per unit of every array of the statistics, shaped like those of a single unit
+    template = LearningCurveStats(n_timesteps, metrics=metrics).state_dict()
+    shapes = {name: ((len(units),) + value.shape, np.float64) for name, value in template.items()}
+    shapes['means'] = ((n_repetitions, n_actions), compact_dtypes(compact)['dtype'])
+
+    with SharedArrays(shapes) as shared:
+        args = [(shared.spec, unit_index, first_repetition, n_chunk, n_actions, n_timesteps, param_value, policy,
+                 seed, metrics, compact, environment, feedback_delay)
+                for unit_index, (_, _, _, first_repetition, n_chunk) in enumerate(units)]
+        if n_workers == 0:
+            for unit_args in args:
+                _run_shared_unit(unit_args)
+        else:
+            with ProcessPoolExecutor(max_workers=n_workers) as executor:
+                list(executor.map(_run_shared_unit, args))
+
+        # merging copies into the accumulators of stats, so the shared block can be freed afterwards
+        stats = LearningCurveStats(n_timesteps, metrics=metrics)
+        for unit_index in range(len(units)):
+            stats.merge(LearningCurveStats.from_state_dict({name: shared[name][unit_index] for name in template}))
+        means = shared['means'].copy() if return_means else None
+    if return_means:
+        return stats, means
+    return stats
+
+
+def test():
+    import time
+    from BanditSweep import run_sweep
+
+    n_actions, n_timesteps, n_repetitions = 10, 2000, 400
+    started = time.perf_counter()
+    stats, means = run_repetitions_shared(n_actions, n_timesteps, n_repetitions, param_value=0.25, policy='ucb',
+                                          n_workers=2, seed=2022, metrics=True, return_means=True)
+    shared_time = time.perf_counter() - started
+    started = time.perf_counter()
+    expected = run_sweep([('ucb', 0.25)], n_actions, n_timesteps, n_repetitions, n_workers=2, seed=2022,
+                         metrics=True, return_stats=True)[0]
+    sweep_time = time.perf_counter() - started
+    print("Shared memory: {:.2f} s, sweep: {:.2f} s, identical statistics: {}".format(
+        shared_time, sweep_time, all(np.array_equal(value, expected.state_dict()[name])
+                                     for name, value in stats.state_dict().items())))
+    print("Means of {} environments, average best mean {:.4f}".format(len(means), stats.best.mean[0]))
+
+
+if __name__ == '__main__':
+    test()
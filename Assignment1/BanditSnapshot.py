@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Policy and environment snapshots
+Practical for course 'Reinforcement Learning',
+Bachelor AI, Leiden University, The Netherlands
+2022
+By Luca Goemans & Sayf El Kaddouri
+"""
+import json
+import os
+import tempfile
+import numpy as np
+from BanditCache import write_atomic
+
+# A snapshot is one file: MAGIC, the length of the JSON header as a little-endian uint64, the header, and the raw
+# arrays, each starting at a multiple of ALIGNMENT bytes so it can be viewed in a memory map as it is
+MAGIC = b'BANDITSNAPSHOT1\n'
+ALIGNMENT = 64
+
+
+def save_snapshot(path, **objects):
+    """
+    Write the state of policies and environments to one file
+
+    :param path: Path of the snapshot file, which is replaced at once when it is complete
+    :param objects: Per name an object with a state_dict, e.g. pi=policy, env=environment, or a dict of arrays such as
+     the checkpoint returned by run_repetitions_batched
+    """
+    header = {'objects': {}}
+    arrays = []
+    offset = 0
+    for name, obj in objects.items():
+        state = obj if isinstance(obj, dict) else obj.state_dict()
+        entry = {'class': None if isinstance(obj, dict) else type(obj).__name__, 'arrays': {}}
+        for key, value in state.items():
+            value = np.asarray(value)
+            if value.dtype.hasobject:
+                raise ValueError("Snapshot error, '{}' of '{}' is not a numeric array".format(key, name))
+            offset = -(-offset // ALIGNMENT) * ALIGNMENT
+            entry['arrays'][key] = {'dtype': value.dtype.str, 'shape': list(value.shape), 'offset': offset}
+            arrays.append((offset, value))
+            offset += value.nbytes
+        header['objects'][name] = entry
+    header_bytes = json.dumps(header).encode()
+    data_start = _data_start(len(header_bytes))
+
+    def write(f):
+        f.write(MAGIC)
+        f.write(np.array(len(header_bytes), dtype='<u8').tobytes())
+        f.write(header_bytes)
+        for array_offset, value in arrays:
+            f.seek(data_start + array_offset)
+            f.write(value.tobytes())
+        f.truncate(data_start + offset)
+
+    write_atomic(path, write)
+
+
+def _data_start(header_length):
+    ''' returns the offset of the arrays in the file, the first multiple of ALIGNMENT after the header '''
+    return -(-(len(MAGIC) + 8 + header_length) // ALIGNMENT) * ALIGNMENT
+
+
+def load_snapshot(path, mmap=True):
+    """
+    Read the states of a snapshot
+
+    :param path: Path of a file written by save_snapshot
+    :param mmap: View the arrays in a copy-on-write memory map instead of reading the file, so only the pages that
+     are used are read and a write never reaches the file (default is True)
+    :returns (states, classes): Per name the dict of arrays of the object, and per name its class name, None for a
+     dict of arrays
+    :raise ValueError: If the file is not a snapshot
+    """
+    with open(path, 'rb') as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError("Snapshot error, '{}' is not a snapshot written by save_snapshot".format(path))
+        header_length = int(np.frombuffer(f.read(8), dtype='<u8')[0])
+        header = json.loads(f.read(header_length))
+        data_start = _data_start(header_length)
+        if not mmap:
+            f.seek(data_start)
+            data = np.frombuffer(bytearray(f.read()), dtype=np.uint8)
+    if mmap:
+        size = os.path.getsize(path) - data_start
+        # plain array views of the map, memmap itself does not keep the shape of 0-d views
+        data = np.memmap(path, dtype=np.uint8, mode='c', offset=data_start, shape=(size,)).view(np.ndarray) \
+            if size > 0 else np.zeros(0, dtype=np.uint8)
+    states, classes = {}, {}
+    for name, entry in header['objects'].items():
+        states[name] = {}
+        for key, info in entry['arrays'].items():
+            dtype = np.dtype(info['dtype'])
+            n_bytes = dtype.itemsize * int(np.prod(info['shape']))
+            states[name][key] = data[info['offset']:info['offset'] + n_bytes].view(dtype).reshape(info['shape'])
+        classes[name] = entry['class']
+    return states, classes
+
+
+def restore_snapshot(path, mmap=True, **objects):
+    """
+    Continue policies and environments from a snapshot, e.g. a warm-started policy in a new worker. The objects
+    have to be constructed like the ones that were saved, with the same number of actions, runs and dtypes.
+
+    :param path: Path of a file written by save_snapshot
+    :param mmap: Map the arrays instead of reading them, see load_snapshot (default is True)
+    :param objects: Per name in the snapshot the object to restore, e.g. pi=policy, env=environment
+    :returns objects: The restored objects, in the order they were passed
+    :raise ValueError: If a name is not in the snapshot, or was saved from another class
+    """
+    states, classes = load_snapshot(path, mmap=mmap)
+    for name, obj in objects.items():
+        if name not in states:
+            raise ValueError("Snapshot error, '{}' holds no '{}', please pass one of the following: {} ".format(
+                path, name, ', '.join("'{}'".format(name) for name in states)))
+        if classes[name] is not None and classes[name] != type(obj).__name__:
+            raise ValueError("Snapshot error, '{}' of '{}' is a {}, not a {}".format(name, path, classes[name],
+                                                                                 type(obj).__name__))
+        obj.load_state_dict(states[name])
+    return list(objects.values())
+
+
+def test():
+    import shutil
+    from BanditEnvironment import make_environment
+    from BanditExperiment import run_repetitions_batched
+    from BanditPolicies import make_policy
+    from BanditRandom import ENV_STREAM, POLICY_STREAM, repetition_rngs
+
+    directory = tempfile.mkdtemp()
+    path = os.path.join(directory, 'ucb.snapshot')
+
+    # train a policy, snapshot it, and continue in a fresh policy and environment
+    n_actions, n_timesteps = 10, 1000
+    env = make_environment('random_walk', n_actions, rng=1)
+    pi = make_policy('egreedy', n_actions, 0.1, rng=2)
+    for t in range(n_timesteps):
+        a = pi.select_action(t=t)
+        pi.update(a, env.act(a))
+    save_snapshot(path, pi=pi, env=env)
+    warm_pi, warm_env = restore_snapshot(path, pi=make_policy('egreedy', n_actions, 0.1),
+                                         env=make_environment('random_walk', n_actions))
+    rewards = []
+    for policy, environment in [(pi, env), (warm_pi, warm_env)]:
+        rewards.append([])
+        for t in range(n_timesteps, n_timesteps + 100):
+            a = policy.select_action(t=t)
+            r = environment.act(a)
+            policy.update(a, r)
+            rewards[-1].append(r)
+    print("Warm-started policy memory mapped: {}, continues identically: {}".format(
+        isinstance(warm_pi.q_table.base.base, np.memmap), rewards[0] == rewards[1]))
+
+    # checkpoint a batched run halfway and continue it from the snapshot
+    n_repetitions = 50
+    env_rngs = lambda: repetition_rngs(3, n_repetitions, role=ENV_STREAM)
+    policy_rngs = lambda: repetition_rngs(3, n_repetitions, role=POLICY_STREAM)
+    full, _ = run_repetitions_batched(n_actions, n_timesteps, n_repetitions, policy='ucb', env_rngs=env_rngs(),
+                                      policy_rngs=policy_rngs())
+    first, state = run_repetitions_batched(n_actions, n_timesteps // 2, n_repetitions, policy='ucb',
+                                           env_rngs=env_rngs(), policy_rngs=policy_rngs())
+    save_snapshot(path, checkpoint=state)
+    second, _ = run_repetitions_batched(n_actions, n_timesteps // 2, n_repetitions, policy='ucb', env_rngs=env_rngs(),
+                                        policy_rngs=policy_rngs(), state=load_snapshot(path)[0]['checkpoint'],
+                                        first_timestep=n_timesteps // 2)
+    print("Run continued from a checkpoint is identical: {}, snapshot of {} bytes".format(
+        np.array_equal(full.mean, first.extend(second).mean), os.path.getsize(path)))
+    shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    test()
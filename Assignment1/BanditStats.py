@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Streaming statistics of learning curves
+Practical for course 'Reinforcement Learning',
+Bachelor AI, Leiden University, The Netherlands
+2022
+By Luca Goemans & Sayf El Kaddouri
+"""
+import numpy as np
+
+
+class RunningStats:
+    ''' Count, mean and sum of squared deviations (M2) of a stream of values per index, e.g. per timestep.
+    Values are added one at a time (Welford) or a batch at a time, and two accumulators over disjoint streams
+    can be merged (Chan et al.), so memory stays O(length) no matter how many repetitions are added. '''
+
+    def __init__(self, length, count=None, mean=None, m2=None):
+        self.count = np.zeros(length) if count is None else np.asarray(count, dtype=float)
+        self.mean = np.zeros(length) if mean is None else np.asarray(mean, dtype=float)
+        self.m2 = np.zeros(length) if m2 is None else np.asarray(m2, dtype=float)
+
+    def __len__(self):
+        return len(self.mean)
+
+    def add(self, index, value):
+        ''' adds a single value at index '''
+        self.count[index] += 1
+        delta = value - self.mean[index]
+        self.mean[index] += delta / self.count[index]
+        self.m2[index] += delta * (value - self.mean[index])
+
+    def add_batch(self, index, values):
+        ''' adds a vector of values at index, e.g. the rewards of all repetitions at one timestep '''
+        n = len(values)
+        batch_mean = np.mean(values)
+        batch_m2 = np.sum((values - batch_mean)**2)
+        self._combine(index, n, batch_mean, batch_m2)
+
+    def _combine(self, index, n, mean, m2):
+        count = self.count[index] + n
+        delta = mean - self.mean[index]
+        with np.errstate(invalid='ignore', divide='ignore'):
+            # an empty accumulator simply takes over the other side
+            self.mean[index] = np.where(self.count[index] > 0, self.mean[index] + delta * n / count, mean)
+            self.m2[index] = np.where(self.count[index] > 0, self.m2[index] + m2 + delta**2 * self.count[index] * n / count, m2)
+        self.count[index] = count
+
+    def merge(self, other):
+        ''' adds the values of another accumulator of the same length, in place '''
+        self._combine(slice(None), other.count, other.mean, other.m2)
+        return self
+
+    def extend(self, other):
+        ''' appends the indices of another accumulator, e.g. later timesteps of the same repetitions '''
+        return RunningStats(len(self) + len(other), np.concatenate([self.count, other.count]),
+                            np.concatenate([self.mean, other.mean]), np.concatenate([self.m2, other.m2]))
+
+    def truncate(self, length):
+        ''' returns an accumulator with only the first length indices '''
+        return RunningStats(length, self.count[:length], self.mean[:length], self.m2[:length])
+
+    @property
+    def variance(self):
+        ''' unbiased sample variance per index, nan where fewer than two values were added '''
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return np.where(self.count > 1, self.m2 / (self.count - 1), np.nan)
+
+    @property
+    def std_error(self):
+        ''' standard error of the mean per index '''
+        return np.sqrt(self.variance / self.count)
+
+    def confidence_interval(self, z=1.96):
+        ''' returns the (lower, upper) normal approximation confidence bounds of the mean per index '''
+        half_width = z * self.std_error
+        return self.mean - half_width, self.mean + half_width
+
+    def state_dict(self, prefix=''):
+        return {prefix + 'count': self.count, prefix + 'mean': self.mean, prefix + 'm2': self.m2}
+
+    @classmethod
+    def from_state_dict(cls, state, prefix=''):
+        mean = state[prefix + 'mean']
+        return cls(len(mean), state[prefix + 'count'], mean, state[prefix + 'm2'])
+
+
+class LearningCurveStats:
+    ''' Streaming statistics of a bandit experiment: the reward per timestep over the repetitions and the mean
+    pay-off of the best action per repetition, from which the cumulative regret follows. Optionally also the
+    expected regret of the chosen action and whether it was the best action, per timestep. '''
+
+    # optional per-timestep metrics, tracked next to the reward when metrics=True
+    METRICS = ('regret', 'optimal_action')
+
+    def __init__(self, n_timesteps, reward=None, best=None, metrics=False, **metric_stats):
+        self.reward = RunningStats(n_timesteps) if reward is None else reward
+        self.best = RunningStats(1) if best is None else best
+        for name in self.METRICS:
+            default = RunningStats(n_timesteps) if metrics else None
+            setattr(self, name, metric_stats.get(name, default))
+
+    @property
+    def metrics(self):
+        ''' whether the optional metrics are tracked '''
+        return self.regret is not None
+
+    def _metric_stats(self):
+        return {name: getattr(self, name) for name in self.METRICS if getattr(self, name) is not None}
+
+    @property
+    def n_repetitions(self):
+        return int(self.best.count[0])
+
+    @property
+    def n_timesteps(self):
+        return len(self.reward)
+
+    @property
+    def mean(self):
+        return self.reward.mean
+
+    @property
+    def variance(self):
+        return self.reward.variance
+
+    @property
+    def std_error(self):
+        return self.reward.std_error
+
+    def confidence_interval(self, z=1.96):
+        return self.reward.confidence_interval(z)
+
+    @property
+    def cumulative_regret(self):
+        ''' expected pay-off of always playing the best action minus the obtained reward, summed over time '''
+        return np.cumsum(self.best.mean[0] - self.reward.mean)
+
+    @property
+    def cumulative_expected_regret(self):
+        ''' pay-off of the best action minus the mean pay-off of the chosen action, summed over time. Unlike
+        cumulative_regret it does not contain the reward noise, only available when metrics are tracked '''
+        return np.cumsum(self.regret.mean)
+
+    @property
+    def optimal_action_rate(self):
+        ''' fraction of the repetitions that chose the best action per timestep, when metrics are tracked '''
+        return self.optimal_action.mean
+
+    def merge(self, other):
+        ''' adds the repetitions of another experiment with the same number of timesteps, in place '''
+        self.reward.merge(other.reward)
+        self.best.merge(other.best)
+        for name, stats in self._metric_stats().items():
+            stats.merge(getattr(other, name))
+        return self
+
+    def extend(self, other):
+        ''' appends later timesteps of the same repetitions '''
+        metric_stats = {name: stats.extend(getattr(other, name)) for name, stats in self._metric_stats().items()}
+        return LearningCurveStats(self.n_timesteps + other.n_timesteps, self.reward.extend(other.reward), self.best,
+                                  **metric_stats)
+
+    def truncate(self, n_timesteps):
+        metric_stats = {name: stats.truncate(n_timesteps) for name, stats in self._metric_stats().items()}
+        return LearningCurveStats(n_timesteps, self.reward.truncate(n_timesteps), self.best, **metric_stats)
+
+    def state_dict(self):
+        state = self.reward.state_dict('reward_')
+        state.update(self.best.state_dict('best_'))
+        for name, stats in self._metric_stats().items():
+            state.update(stats.state_dict(name + '_'))
+        return state
+
+    @classmethod
+    def from_state_dict(cls, state):
+        reward = RunningStats.from_state_dict(state, 'reward_')
+        metric_stats = {name: RunningStats.from_state_dict(state, name + '_') for name in cls.METRICS
+                        if name + '_mean' in state}
+        return cls(len(reward), reward, RunningStats.from_state_dict(state, 'best_'), **metric_stats)
+
+
+def test():
+    values = np.random.rand(1000, 5)
+    stats = RunningStats(5)
+    for row in values[:400]:
+        for index, value in enumerate(row):
+            stats.add(index, value)
+    other = RunningStats(5)
+    for index in range(5):
+        other.add_batch(index, values[400:, index])
+    stats.merge(other)
+    print("Merged mean matches: {}".format(np.allclose(stats.mean, values.mean(axis=0))))
+    print("Merged variance matches: {}".format(np.allclose(stats.variance, values.var(axis=0, ddof=1))))
+
+
+if __name__ == '__main__':
+    test()
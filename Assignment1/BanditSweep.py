@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Parallel hyperparameter sweeps
+Practical for course 'Reinforcement Learning',
+Bachelor AI, Leiden University, The Netherlands
+2022
+By Luca Goemans & Sayf El Kaddouri
+"""
+import os
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from BanditExperiment import lookup_result, run_repetitions_stats
+from BanditProfile import current_timings, instrumented
+from BanditRandom import as_seed_sequence
+from BanditStats import LearningCurveStats
+
+# number of repetitions per work unit; fixed so that the result does not depend on the number of workers
+REPETITION_CHUNK = 100
+
+
+def make_work_units(configs, n_repetitions, chunk_size=REPETITION_CHUNK, first_repetition=0):
+    """
+    Split every (policy, param_value) configuration into chunks of repetitions
+
+    :param configs: A list of (policy, param_value) tuples
+    :param n_repetitions: Number of repetitions per configuration
+    :param chunk_size: Number of repetitions per work unit (default is REPETITION_CHUNK)
+    :param first_repetition: Index of the first repetition of every configuration (default is 0)
+    :returns units: A list of (config_index, policy, param_value, first_repetition, n_repetitions) tuples
+    """
+    units = []
+    for config_index, (policy, param_value) in enumerate(configs):
+        for start in range(first_repetition, first_repetition + n_repetitions, chunk_size):
+            n_chunk = min(chunk_size, first_repetition + n_repetitions - start)
+            units.append((config_index, policy, param_value, start, n_chunk))
+    return units
+
+
+def run_work_unit(unit, n_actions, n_timesteps, seed, backend='numpy', cache=None, metrics=False, compact=False,
+                  environment='stationary', feedback_delay=1):
+    """
+    Run a single work unit. Repetition i always draws from the streams of repetition i of the seed, so
+    every configuration is evaluated on the same sequence of random bandit problems.
+
+    :returns stats: The LearningCurveStats of the repetitions of the unit
+    """
+    config_index, policy, param_value, first_repetition, n_repetitions = unit
+    return run_repetitions_stats(n_actions, n_timesteps, n_repetitions, param_value=param_value, policy=policy,
+                                 backend=backend, seed=seed, first_repetition=first_repetition, cache=cache,
+                                 metrics=metrics, compact=compact, environment=environment,
+                                 feedback_delay=feedback_delay)
+
+
+def _run_work_unit(args):
+    return run_work_unit(*args)
+
+
+def _run_work_unit_timed(args):
+    # a worker process has its own instrumentation, which is sent back with the result
+    with instrumented() as timings:
+        stats = run_work_unit(*args)
+    return stats, timings
+
+
+def _merge_timings(results, timings):
+    for stats, worker_timings in results:
+        timings.merge(worker_timings)
+        yield stats
+
+
+def run_sweep(configs, n_actions, n_timesteps, n_repetitions, n_workers=None, seed=None, backend='numpy',
+              chunk_size=REPETITION_CHUNK, cache=None, return_stats=False, metrics=False, compact=False,
+              environment='stationary', first_repetition=0, progress=None, feedback_delay=1):
+    """
+    Evaluate every (policy, param_value) configuration, spreading chunks of repetitions over a process pool
+
+    :param configs: A list of (policy, param_value) tuples, e.g. [('egreedy', 0.1), ('ucb', 0.25)]
+    :param n_actions: Cardinality of the action space
+    :param n_timesteps: Number of timesteps per repetition (experiment trial)
+    :param n_repetitions: Number of repetitions per configuration
+    :param n_workers: Number of worker processes, 0 runs every unit serially in this process (default is os.cpu_count())
+    :param seed: Int or SeedSequence, the result is identical for any n_workers given the same seed
+     (default is None, random)
+    :param backend: Backend passed on to run_repetitions (default is 'numpy')
+    :param chunk_size: Number of repetitions per work unit (default is REPETITION_CHUNK)
+    :param cache: A ResultCache for the work units, ignored without a seed (default is None, no caching)
+    :param return_stats: Return the merged LearningCurveStats per configuration instead (default is False)
+    :param metrics: Track the expected regret and optimal action rate in the statistics (default is False)
+    :param compact: Use float32 and int32 arrays for the environments and policies (default is False)
+    :param environment: The name of a registered environment, e.g. 'random_walk' (default is 'stationary')
+    :param first_repetition: Run repetitions [first_repetition, first_repetition + n_repetitions) of every
+     configuration, so a sweep can be extended with more repetitions later (default is 0)
+    :param progress: Called as progress(n_done, n_units) once the cached units are looked up and after every
+     finished unit (default is None)
+    :param feedback_delay: Number of timesteps whose rewards are learned at once, see run_repetitions (default is 1)
+    :returns all_avg_r: An array of shape (len(configs), n_timesteps) with the average reward per timestep
+    """
+    if seed is None:
+        cache = None # a random seed is never repeated, so its results are not worth storing
+    seed = as_seed_sequence(seed)
+    if n_workers is None:
+        n_workers = os.cpu_count() or 1
+    units = make_work_units(configs, n_repetitions, chunk_size=chunk_size, first_repetition=first_repetition)
+
+    # look up cached units here, so a fully cached sweep does not start any worker
+    unit_stats = [None] * len(units)
+    pending = []
+    for i, unit in enumerate(units):
+        config_index, policy, param_value, first_repetition, n_chunk = unit
+        if cache is not None:
+            unit_stats[i] = lookup_result(cache, n_actions, n_timesteps, n_chunk, param_value, policy, backend, seed,
+                                          first_repetition, metrics=metrics, compact=compact,
+                                          environment=environment, feedback_delay=feedback_delay)
+        if unit_stats[i] is None:
+            pending.append(i)
+
+    args = [(units[i], n_actions, n_timesteps, seed, backend, cache, metrics, compact, environment, feedback_delay)
+            for i in pending]
+    n_cached = len(units) - len(pending)
+    if progress is not None:
+        progress(n_cached, len(units))
+
+    def collect(unit_stats_pending):
+        # store every unit as soon as it finishes, so progress is reported while the others still run
+        for n_done, (i, stats) in enumerate(zip(pending, unit_stats_pending), start=n_cached + 1):
+            unit_stats[i] = stats
+            if progress is not None:
+                progress(n_done, len(units))
+
+    if n_workers == 0 or not pending:
+        collect(map(_run_work_unit, args))
+    else:
+        timings = current_timings()
+        with ProcessPoolExecutor(max_workers=n_workers) as executor:
+            if timings is None:
+                collect(executor.map(_run_work_unit, args))
+            else:
+                collect(_merge_timings(executor.map(_run_work_unit_timed, args), timings))
+
+    # merge the partial statistics in unit order, so the result does not depend on what was cached
+    all_stats = [LearningCurveStats(n_timesteps, metrics=metrics) for _ in configs]
+    for unit, stats in zip(units, unit_stats):
+        all_stats[unit[0]].merge(stats)
+    if return_stats:
+        return all_stats
+    return np.array([stats.mean for stats in all_stats])
+
+
+def test():
+    configs = [('egreedy', 0.1), ('oi', 1.0), ('ucb', 0.25)]
+    serial = run_sweep(configs, n_actions=10, n_timesteps=200, n_repetitions=250, n_workers=0, seed=1)
+    parallel = run_sweep(configs, n_actions=10, n_timesteps=200, n_repetitions=250, n_workers=2, seed=1)
+    print("Mean reward per configuration: {}".format(serial.mean(axis=1)))
+    print("Parallel result identical to serial result: {}".format(np.array_equal(serial, parallel)))
+
+
+if __name__ == '__main__':
+    test()
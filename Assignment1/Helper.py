@@ -8,37 +8,55 @@ Bachelor AI, Leiden University, The Netherlands
 By Thomas Moerland
 """
 
+from collections import OrderedDict
 import numpy as np
-import matplotlib.pyplot as plt
-from scipy.signal import savgol_filter
+from BanditProfile import timed
+
+# number of smoothed curves kept by smooth, least recently used ones are dropped first
+MAX_SMOOTHED = 256
+_smoothed = OrderedDict()
+
+def pyplot():
+    ''' returns matplotlib.pyplot, imported on first use so that importing Helper stays cheap '''
+    import matplotlib.pyplot as plt
+    return plt
 
 class LearningCurvePlot:
 
     def __init__(self,title=None):
-        self.fig,self.ax = plt.subplots()
+        self.fig,self.ax = pyplot().subplots()
         self.ax.set_xlabel('Time')
         self.ax.set_ylabel('Reward')      
         self.ax.set_ylim([0,1.0])
         if title is not None:
             self.ax.set_title(title)
         
-    def add_curve(self,y,label=None):
+    def add_curve(self,y,label=None,band=None,x=None):
         ''' y: vector of average reward results
-        label: string to appear as label in plot legend '''
+        label: string to appear as label in plot legend
+        band: optional (lower, upper) vectors, e.g. LearningCurveStats.confidence_interval(), shaded around y
+        x: optional timesteps of y, e.g. the bin centres returned by downsample (default is 0, 1, ...) '''
+        if x is None:
+            x = np.arange(len(y))
         if label is not None:
-            self.ax.plot(y,label=label)
+            line, = self.ax.plot(x,y,label=label)
         else:
-            self.ax.plot(y)
+            line, = self.ax.plot(x,y)
+        if band is not None:
+            self.ax.fill_between(x,band[0],band[1],color=line.get_color(),alpha=0.2,linewidth=0)
         
-    def save(self,name='test.png'):
-        ''' name: string for filename of saved figure '''
+    def save(self,name='test.png',dpi=300):
+        ''' name: string for filename of saved figure
+        dpi: resolution of the saved figure
+        The figure is closed afterwards, so its memory is freed '''
         self.ax.legend()
-        self.fig.savefig(name,dpi=300)
+        savefig(self.fig,name,dpi)
+        pyplot().close(self.fig)
 
 class ComparisonPlot:
 
     def __init__(self,title=None):
-        self.fig,self.ax = plt.subplots()
+        self.fig,self.ax = pyplot().subplots()
         self.ax.set_xlabel('Parameter (exploration)')
         self.ax.set_ylabel('Average reward') 
         self.ax.set_xscale('log')
@@ -54,16 +72,69 @@ class ComparisonPlot:
         else:
             self.ax.plot(x,y)
         
-    def save(self,name='test.png'):
-        ''' name: string for filename of saved figure '''
+    def save(self,name='test.png',dpi=300):
+        ''' name: string for filename of saved figure
+        dpi: resolution of the saved figure
+        The figure is closed afterwards, so its memory is freed '''
         self.ax.legend()
-        self.fig.savefig(name,dpi=300)
+        savefig(self.fig,name,dpi)
+        pyplot().close(self.fig)
+
+@timed('savefig')
+def savefig(fig, name, dpi):
+    ''' writes a figure, timed as its own phase as rendering the PNG is often the slowest part of a plot '''
+    fig.savefig(name,dpi=dpi)
 
-def smooth(y, window, poly=1):
+@timed('smooth')
+def smooth(y, window, poly=1, key=None):
     '''
     y: vector to be smoothed 
-    window: size of the smoothing window '''
-    return savgol_filter(y,window,poly)
+    window: size of the smoothing window
+    key: optional hashable id of y, e.g. the file of a stored curve. The result is then kept per (key, window, poly),
+    so smoothing the same curve again is free, and returned read-only as every later call shares it
+    A Savitzky-Golay filter with poly=1 is a moving average away from the edges, and a straight line fitted to the
+    first and last window values at the edges, which is computed in O(len(y)) with cumulative sums. '''
+    if key is not None and (key, window, poly) in _smoothed:
+        _smoothed.move_to_end((key, window, poly))
+        return _smoothed[(key, window, poly)]
+    if poly == 1 and window % 2 == 1 and 1 < window <= len(y):
+        smoothed = _moving_average(np.asarray(y, dtype=float), window)
+    else:
+        from scipy.signal import savgol_filter # imported on first use, like pyplot
+        smoothed = savgol_filter(y,window,poly)
+    if key is not None:
+        smoothed.setflags(write=False)
+        _smoothed[(key, window, poly)] = smoothed
+        if len(_smoothed) > MAX_SMOOTHED:
+            _smoothed.popitem(last=False)
+    return smoothed
+
+def _moving_average(y, window):
+    ''' savgol_filter(y, window, 1) for an odd window of at most len(y) '''
+    half = window // 2
+    cumsum = np.concatenate([[0.0], np.cumsum(y)])
+    smoothed = np.empty_like(y)
+    smoothed[half:len(y) - half] = (cumsum[window:] - cumsum[:-window]) / window
+    # like mode='interp': the edges lie on the least squares line through the first and last window values
+    x = np.arange(window) - half
+    edges = ((y[:window], smoothed[:half], x[:half]), (y[-window:], smoothed[len(y) - half:], x[window - half:]))
+    for edge, out, positions in edges:
+        out[:] = edge.mean() + np.dot(x, edge) / np.dot(x, x) * positions
+    return smoothed
+
+@timed('downsample')
+def downsample(y, max_points):
+    '''
+    y: vector, e.g. a smoothed learning curve
+    max_points: maximum number of points to keep, e.g. the width of the plot in pixels
+    returns (x, y) with the averages of y over equally long bins and the centres of those bins, or all of y if it
+    has at most max_points values '''
+    y = np.asarray(y)
+    if len(y) <= max_points:
+        return np.arange(len(y)), y
+    edges = np.linspace(0, len(y), max_points + 1).astype(np.int64)
+    sums = np.add.reduceat(y, edges[:-1])
+    return (edges[:-1] + edges[1:] - 1) / 2, sums / np.diff(edges)
 
 if __name__ == '__main__':
     # Test Learning curve plot
@@ -78,4 +149,9 @@ if __name__ == '__main__':
     PerfTest = ComparisonPlot(title="Test Comparison")
     PerfTest.add_curve(np.arange(5),np.random.rand(5),label='method 1')
     PerfTest.add_curve(np.arange(5),np.random.rand(5),label='method 2')
-    PerfTest.save(name='comparison_test.png') 
\ No newline at end of file
+    PerfTest.save(name='comparison_test.png')
+
+    # Test the cumulative sum smoothing against the Savitzky-Golay filter
+    from scipy.signal import savgol_filter
+    y = np.random.rand(10**6)
+    print("Moving average matches savgol_filter: {}".format(np.allclose(smooth(y,window=31),savgol_filter(y,31,1))))
\ No newline at end of file